@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import sqlite3
+from typing import Optional
+
+from db import end_of_day_sql, order_price_sql
+
+
+# Report groupings: dim name in sales_rollup -> UI title.
+DIMENSIONS = {
+    "day": "День",
+    "product": "Товар",
+    "supplier": "Поставщик",
+    "category": "Категория",
+    "pickup_point": "Пункт выдачи",
+}
+
+_DAYS_PER_STEP = 200  # keeps the IN (...) lists well under the bound-parameter limit
+
+
+def refresh_sales(conn: sqlite3.Connection) -> int:
+    """Rebuild sales_daily and sales_rollup for the days queued in sales_dirty_day.
+
+    Triggers on "order"/order_product queue a day whenever one of its orders
+    changes, so a refresh only touches the days that actually changed. Revenue
+    is taken at the discounted price in effect at the end of the order day
+    (see db.product_as_of_sql), so repricing does not rewrite past days.
+    With nothing queued no lock is taken. Inside the caller's transaction the
+    refresh becomes part of it (and commits with it). Returns the number of
+    rebuilt days.
+    """
+    if not conn.in_transaction:
+        if not conn.execute("SELECT 1 FROM sales_dirty_day LIMIT 1").fetchone():
+            return 0
+        with conn:
+            # Take the write lock up-front so no new dirty days slip in between
+            # reading the queue and clearing it.
+            conn.execute("BEGIN IMMEDIATE")
+            return _refresh_queued(conn)
+    return _refresh_queued(conn)
+
+
+def _refresh_queued(conn: sqlite3.Connection) -> int:
+    days = [r[0] for r in conn.execute("SELECT day FROM sales_dirty_day ORDER BY day")]
+    for i in range(0, len(days), _DAYS_PER_STEP):
+        _rebuild_days(conn, days[i:i + _DAYS_PER_STEP])
+    return len(days)
+
+
+def _rebuild_days(conn: sqlite3.Connection, days: list[str]) -> None:
+    marks = ", ".join("?" for _ in days)
+    conn.execute(f"DELETE FROM sales_daily WHERE day IN ({marks})", days)
+    conn.execute(
+        f"""
+        INSERT INTO sales_daily(day, product_article, pickup_point_id, supplier, category, units, revenue)
+        SELECT o.order_date, op.product_article, o.pickup_point_id, p.supplier, p.category,
+               SUM(op.quantity),
+               SUM(op.quantity * {order_price_sql("op.product_article", end_of_day_sql("o.order_date"))})
+        FROM "order" o
+        JOIN order_product op ON op.order_id = o.id
+        JOIN product_view p ON p.article = op.product_article
+        WHERE o.order_date IN ({marks})
+        GROUP BY o.order_date, op.product_article, o.pickup_point_id
+        """,
+        days,
+    )
+
+    conn.execute(f"DELETE FROM sales_rollup WHERE day IN ({marks})", days)
+    for dim, key_sql in [
+        ("day", "''"),
+        ("product", "product_article"),
+        ("supplier", "supplier"),
+        ("category", "category"),
+        ("pickup_point", "CAST(pickup_point_id AS TEXT)"),
+    ]:
+        conn.execute(
+            f"""
+            INSERT INTO sales_rollup(dim, day, key, units, revenue)
+            SELECT ?, day, {key_sql}, SUM(units), SUM(revenue)
+            FROM sales_daily
+            WHERE day IN ({marks})
+            GROUP BY day, {key_sql}
+            """,
+            [dim, *days],
+        )
+
+    conn.execute(f"DELETE FROM sales_dirty_day WHERE day IN ({marks})", days)
+
+
+def sales_report(
+    conn: sqlite3.Connection,
+    dim: str,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> list[sqlite3.Row]:
+    """Units and revenue per ``dim`` value for [date_from, date_to], read from the rollups.
+
+    Rows have ``key``, ``label``, ``units`` and ``revenue``; for ``dim='day'`` the key is the day.
+    """
+    if dim not in DIMENSIONS:
+        raise ValueError(f"Unknown report dimension: {dim}")
+
+    where = ["r.dim = ?"]
+    params: list = [dim]
+    if date_from:
+        where.append("r.day >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("r.day <= ?")
+        params.append(date_to)
+    where_sql = " AND ".join(where)
+
+    if dim == "day":
+        return conn.execute(
+            f"""
+            SELECT r.day AS key, r.day AS label, r.units, r.revenue
+            FROM sales_rollup r
+            WHERE {where_sql}
+            ORDER BY r.day
+            """,
+            params,
+        ).fetchall()
+
+    label_sql = {
+        "product": "COALESCE(p.name, r.key)",
+        "pickup_point": "COALESCE(pp.address, r.key)",
+    }.get(dim, "r.key")
+    return conn.execute(
+        f"""
+        SELECT r.key, {label_sql} AS label, SUM(r.units) AS units, SUM(r.revenue) AS revenue
+        FROM sales_rollup r
+        LEFT JOIN product p ON r.dim = 'product' AND p.article = r.key
+        LEFT JOIN pickup_point pp ON r.dim = 'pickup_point' AND pp.id = CAST(r.key AS INTEGER)
+        WHERE {where_sql}
+        GROUP BY r.key
+        ORDER BY revenue DESC
+        """,
+        params,
+    ).fetchall()
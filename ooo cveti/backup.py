@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+from db import APP_ROOT, DB_FILE
+
+
+BACKUP_DIR = APP_ROOT / "backups"
+BACKUP_LOG_NAME = "backup.log"  # kept in the backup directory, one line per scheduled run
+KEEP_SNAPSHOTS = 14
+
+# Pages copied per backup step. Each step holds a read lock on trade.db only
+# for its own duration; between steps writers are free to commit.
+PAGES_PER_STEP = 256
+STEP_PAUSE = 0.005
+MAX_RESTARTS = 3
+BUSY_RETRY = 5 * 60  # seconds; the scheduler's next attempt after a BackupBusy
+
+
+@dataclass
+class BackupStats:
+    path: Path
+    pages: int
+    steps: int
+    seconds: float
+    max_step_ms: float
+    restarts: int
+    db_bytes: int
+    archive_bytes: int
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.db_bytes / 1_000_000 / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.path.name}: {self.pages} стр. за {self.seconds:.2f} с "
+            f"({self.mb_per_second:.1f} МБ/с), шагов {self.steps}, "
+            f"макс. блокировка {self.max_step_ms:.1f} мс, перезапусков {self.restarts}, "
+            f"архив {self.archive_bytes / 1_000_000:.2f} МБ из {self.db_bytes / 1_000_000:.2f} МБ"
+        )
+
+
+def _snapshot_path(backup_dir: Path) -> Path:
+    """A snapshot path that is not taken yet.
+
+    Microseconds in the name keep two snapshots of the same second apart and
+    the names in time order, which list_snapshots relies on.
+    """
+    while True:
+        target = backup_dir / f"trade-{datetime.now():%Y%m%d-%H%M%S-%f}.db.gz"
+        if not target.exists() and not target.with_suffix(".part").exists():
+            return target
+
+
+def list_snapshots(backup_dir: Path = BACKUP_DIR) -> list[Path]:
+    """Snapshots, newest first."""
+    return sorted(backup_dir.glob("trade-*.db.gz"), reverse=True)
+
+
+class BackupBusy(Exception):
+    """Writers kept changing a rollback-journal database during the copy; try again later."""
+
+
+def _copy_online(
+    src: sqlite3.Connection,
+    dst: sqlite3.Connection,
+    pages_per_step: int,
+    pause: float,
+    progress: Optional[Callable[[int, int], None]],
+) -> tuple[int, int, float, int]:
+    """sqlite3 online backup in small steps; returns (pages, steps, longest step in ms, restarts).
+
+    A write by another connection between two steps makes SQLite restart the
+    copy from page 1. In WAL mode the source keeps one read transaction open for
+    the whole copy: that pins a consistent snapshot and does not block writers.
+    With a rollback journal that would lock writers out for the whole copy, so
+    the copy runs unpinned and raises BackupBusy after MAX_RESTARTS restarts.
+    The database is not switched to WAL here: WAL does not work for a trade.db
+    shared from a network folder.
+    """
+    wal = str(src.execute("PRAGMA journal_mode").fetchone()[0]).lower() == "wal"
+    return _run_backup(src, dst, pages_per_step, pause, progress, pin=wal, max_restarts=None if wal else MAX_RESTARTS)
+
+
+def _run_backup(
+    src: sqlite3.Connection,
+    dst: sqlite3.Connection,
+    pages_per_step: int,
+    pause: float,
+    progress: Optional[Callable[[int, int], None]],
+    pin: bool,
+    max_restarts: Optional[int],
+) -> tuple[int, int, float, int]:
+    steps = 0
+    restarts = 0
+    max_step = 0.0
+    total = 0
+    last_remaining: Optional[int] = None
+    t = time.perf_counter()
+
+    def on_step(status: int, remaining: int, pages_total: int) -> None:
+        nonlocal steps, restarts, max_step, total, last_remaining, t
+        max_step = max(max_step, time.perf_counter() - t)
+        steps += 1
+        total = pages_total
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if max_restarts is not None and restarts > max_restarts:
+                raise BackupBusy(f"база менялась во время копирования, перезапусков: {restarts}")
+        last_remaining = remaining
+        if progress:
+            progress(pages_total - remaining, pages_total)
+        # One pause per step: the backup API sleeps by itself only after a busy step,
+        # so the gap for writers after a normal step is taken here.
+        if pause and status == sqlite3.SQLITE_OK:
+            time.sleep(pause)
+        t = time.perf_counter()
+
+    if pin:
+        src.execute("BEGIN")
+        src.execute("SELECT count(*) FROM sqlite_master").fetchone()
+    try:
+        src.backup(dst, pages=pages_per_step, progress=on_step, sleep=pause)
+    finally:
+        if pin:
+            src.rollback()
+    return total, steps, max_step * 1000, restarts
+
+
+def create_snapshot(
+    db_path: Path = DB_FILE,
+    backup_dir: Path = BACKUP_DIR,
+    keep: int = KEEP_SNAPSHOTS,
+    pages_per_step: int = PAGES_PER_STEP,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> BackupStats:
+    """Take a consistent copy of a live trade.db, gzip it into ``backup_dir`` and rotate old snapshots."""
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+        raw = Path(tmp) / "trade.db"
+        src = sqlite3.connect(db_path)
+        dst = sqlite3.connect(raw)
+        try:
+            pages, steps, max_step_ms, restarts = _copy_online(src, dst, pages_per_step, STEP_PAUSE, progress)
+        finally:
+            dst.close()
+            src.close()
+
+        target = _snapshot_path(backup_dir)
+        partial = target.with_suffix(".part")
+        with open(raw, "rb") as fin, gzip.open(partial, "wb", compresslevel=6) as fout:
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+        partial.replace(target)
+        db_bytes = raw.stat().st_size
+
+    for old in list_snapshots(backup_dir)[keep:]:
+        old.unlink(missing_ok=True)
+
+    return BackupStats(
+        path=target,
+        pages=pages,
+        steps=steps,
+        seconds=time.perf_counter() - started,
+        max_step_ms=max_step_ms,
+        restarts=restarts,
+        db_bytes=db_bytes,
+        archive_bytes=target.stat().st_size,
+    )
+
+
+def _replace_file(raw: Path, db_path: Path) -> int:
+    """Put ``raw`` in place of ``db_path`` as a file; returns its page count.
+
+    Journal files left by the damaged database go first: SQLite would
+    otherwise roll a stale hot journal back into the restored file.
+    """
+    db_path = Path(db_path)
+    fd, tmp = tempfile.mkstemp(dir=db_path.resolve().parent, suffix=".part")
+    os.close(fd)
+    try:
+        shutil.copyfile(raw, tmp)
+        for suffix in ("-journal", "-wal", "-shm"):
+            Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+        os.replace(tmp, db_path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("PRAGMA page_count").fetchone()[0]
+
+
+def restore_snapshot(snapshot: Path, db_path: Path = DB_FILE, pages_per_step: int = PAGES_PER_STEP) -> BackupStats:
+    """Replace the contents of ``db_path`` with ``snapshot``.
+
+    The snapshot is unpacked and integrity-checked first, then copied into the
+    live database through the backup API, so other connections (e.g. a running
+    App) see the restored data instead of a file swapped underneath them.
+    A target too damaged for the backup API to write into
+    is replaced as a file instead.
+    """
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = Path(tmp) / "restore.db"
+        with gzip.open(snapshot, "rb") as fin, open(raw, "wb") as fout:
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+
+        src = sqlite3.connect(raw)
+        try:
+            check = src.execute("PRAGMA integrity_check").fetchone()[0]
+            if check != "ok":
+                raise sqlite3.DatabaseError(f"Снимок {snapshot.name} повреждён: {check}")
+            try:
+                dst = sqlite3.connect(db_path)
+                try:
+                    pages, steps, max_step_ms, restarts = _copy_online(src, dst, pages_per_step, 0, None)
+                finally:
+                    dst.close()
+            except sqlite3.OperationalError:
+                raise  # locked, unwritable: not a reason to swap the file under other connections
+            except sqlite3.DatabaseError:
+                pages, steps, max_step_ms, restarts = _replace_file(raw, db_path), 1, 0.0, 0
+        finally:
+            src.close()
+        db_bytes = raw.stat().st_size
+
+    return BackupStats(
+        path=snapshot,
+        pages=pages,
+        steps=steps,
+        seconds=time.perf_counter() - started,
+        max_step_ms=max_step_ms,
+        restarts=restarts,
+        db_bytes=db_bytes,
+        archive_bytes=snapshot.stat().st_size,
+    )
+
+
+class BackupScheduler:
+    """Takes a snapshot every ``interval`` seconds from a daemon thread; a busy one is retried after BUSY_RETRY.
+
+    Every run, failed or not, is appended to BACKUP_LOG_NAME in ``backup_dir``.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        db_path: Path = DB_FILE,
+        backup_dir: Path = BACKUP_DIR,
+        on_done: Optional[Callable[[Optional[BackupStats], Optional[Exception]], None]] = None,
+    ) -> None:
+        self.interval = interval
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.on_done = on_done
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="backup", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        wait = self.interval
+        while not self._stop.wait(wait):
+            wait = self.interval
+            try:
+                stats = create_snapshot(self.db_path, self.backup_dir)
+                err = None
+            except BackupBusy as e:
+                stats, err = None, e
+                wait = min(BUSY_RETRY, self.interval)  # a quieter moment comes sooner than the next interval
+            except Exception as e:
+                stats, err = None, e
+            self._log(stats, err)
+            if self.on_done:
+                self.on_done(stats, err)
+
+    def _log(self, stats: Optional[BackupStats], err: Optional[Exception]) -> None:
+        text = f"не создана: {err}" if err else stats.summary()
+        try:
+            self.backup_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.backup_dir / BACKUP_LOG_NAME, "a", encoding="utf-8") as log:
+                log.write(f"{datetime.now():%Y-%m-%d %H:%M:%S} {text}\n")
+        except OSError:
+            pass  # e.g. the backup folder is unreachable: on_done still hears about the run
@@ -1,13 +1,8 @@
-from db import get_conn
-
-with get_conn() as conn:
-    rows = conn.execute("""
-        SELECT u.login, u.password, r.name as role
-        FROM user u
-        JOIN role r ON r.id = u.role_id
-        ORDER BY u.id
-    """).fetchall()
-
-print("USERS IN DB:")
-for r in rows:
-    print(r["login"], r["password"], "-", r["role"])
+"""Lists the users of trade.db; the same as ``python cli.py dump users``."""
+
+import sys
+
+import cli
+
+if __name__ == "__main__":
+    sys.exit(cli.main(["dump", "users"]))
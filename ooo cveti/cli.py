@@ -0,0 +1,549 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import sys
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, TextIO
+
+import analytics
+import backup
+import export
+import forecast
+import intake
+import loadtest
+import maintenance
+import recommend
+import replicate
+from db import (
+    DB_FILE,
+    SORT_QTY_NONE,
+    branches_from_paths,
+    federated_query,
+    get_conn,
+    init_db_if_needed,
+    migrate,
+    orders_query,
+    products_query,
+)
+
+
+DEFAULT_CHUNK = 1000
+EXIT_BROKEN_PIPE = 128 + 13  # what a shell reports for a writer killed by SIGPIPE
+
+# How a subcommand uses --db (set as ``db_use`` on its parser).
+DB_MIGRATE = "migrate"  # it must exist and is brought up to date first
+DB_NONE = "none"  # the command takes its databases from its own arguments
+
+# Columns that may be bulk-updated on product, with their parser and check.
+PRODUCT_UPDATE_COLUMNS = {
+    "cost": (float, lambda v: v >= 0, "стоимость не может быть отрицательной"),
+    "discount": (int, lambda v: 0 <= v <= 100, "скидка должна быть в диапазоне 0..100"),
+    "max_discount": (int, lambda v: 0 <= v <= 100, "макс. скидка должна быть в диапазоне 0..100"),
+    "quantity": (int, lambda v: v >= 0, "количество не может быть отрицательным"),
+}
+
+DUMP_QUERIES = {
+    "users": """
+        SELECT u.id, u.surname, u.name, u.patronymic, u.login, u.password, r.name AS role
+        FROM user u
+        JOIN role r ON r.id = u.role_id
+        ORDER BY u.id
+    """,
+    "products": """
+        SELECT article, name, unit, cost, max_discount, manufacturer, supplier, category,
+               discount, quantity, description, image_path
+        FROM product_view
+        ORDER BY article
+    """,
+    "orders": """
+        SELECT o.id, o.order_date, o.delivery_date, o.pickup_point_id, p.address AS pickup,
+               o.client_name, o.pickup_code, s.name AS status
+        FROM "order" o
+        JOIN order_status s ON s.id = o.status_id
+        JOIN pickup_point p ON p.id = o.pickup_point_id
+        ORDER BY o.id
+    """,
+}
+
+
+def _progress(msg: str) -> None:
+    print(msg, file=sys.stderr, flush=True)
+
+
+def _chunks(it: Iterable, size: int) -> Iterator[list]:
+    it = iter(it)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _open_input(path: str) -> TextIO:
+    if path == "-":
+        return sys.stdin
+    return open(path, newline="", encoding="utf-8-sig")
+
+
+def cmd_dump(args: argparse.Namespace) -> int:
+    out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        writer = csv.writer(out, delimiter="\t" if args.format == "tsv" else ",")
+        with get_conn(args.db) as conn:
+            cur = conn.execute(DUMP_QUERIES[args.what])
+            writer.writerow([d[0] for d in cur.description])
+            total = 0
+            while True:
+                rows = cur.fetchmany(args.chunk_size)
+                if not rows:
+                    break
+                writer.writerows(tuple(r) for r in rows)
+                total += len(rows)
+                _progress(f"Выгружено строк: {total}")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+def _run_chunked(args: argparse.Namespace, sql: str, params: Iterable[tuple]) -> int:
+    """Execute ``sql`` for every parameter tuple, one transaction per chunk.
+
+    Returns the number of rows changed (or that would have been changed with --dry-run).
+    """
+    changed = 0
+    processed = 0
+    conn = get_conn(args.db)
+    try:
+        for chunk in _chunks(params, args.chunk_size):
+            cur = conn.executemany(sql, chunk)
+            changed += max(cur.rowcount, 0)
+            processed += len(chunk)
+            if args.dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+            _progress(f"Обработано строк: {processed}, изменено: {changed}")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return changed
+
+
+def _read_product_updates(
+    reader: csv.DictReader, columns: list[str], known: set[str], errors: list[str]
+) -> Iterator[tuple]:
+    for line_no, row in enumerate(reader, start=2):
+        article = (row.get("article") or "").strip()
+        if not article:
+            errors.append(f"строка {line_no}: не указан артикул")
+            continue
+        if article not in known:
+            errors.append(f"строка {line_no}: товар {article!r} не найден")
+            continue
+        values: list = []
+        bad = False
+        for col in columns:
+            raw = (row.get(col) or "").strip()
+            if not raw:
+                values.append(None)  # keep current value
+                continue
+            parse, check, msg = PRODUCT_UPDATE_COLUMNS[col]
+            try:
+                v = parse(raw.replace(",", "."))
+            except ValueError:
+                errors.append(f"строка {line_no}: некорректное значение {col}={raw!r}")
+                bad = True
+                break
+            if not check(v):
+                errors.append(f"строка {line_no}: {msg}")
+                bad = True
+                break
+            values.append(v)
+        if not bad:
+            yield (*values, article)
+
+
+def cmd_update_products(args: argparse.Namespace) -> int:
+    f = _open_input(args.input)
+    try:
+        reader = csv.DictReader(f, delimiter=args.delimiter)
+        header = reader.fieldnames or []
+        if "article" not in header:
+            _progress("Ошибка: во входных данных нет столбца article.")
+            return 2
+        columns = [c for c in header if c in PRODUCT_UPDATE_COLUMNS]
+        if not columns:
+            _progress(f"Ошибка: нет столбцов для обновления ({', '.join(PRODUCT_UPDATE_COLUMNS)}).")
+            return 2
+        sets = ", ".join(f"{c} = COALESCE(?, {c})" for c in columns)
+        with get_conn(args.db) as conn:
+            known = {r[0] for r in conn.execute("SELECT article FROM product")}
+        errors: list[str] = []
+        changed = _run_chunked(args, f"UPDATE product SET {sets} WHERE article = ?",
+                               _read_product_updates(reader, columns, known, errors))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return _finish(args, changed, errors)
+
+
+def _read_status_updates(reader: csv.DictReader, statuses: dict[str, int], errors: list[str]) -> Iterator[tuple]:
+    for line_no, row in enumerate(reader, start=2):
+        raw_id = (row.get("id") or "").strip()
+        status = (row.get("status") or "").strip()
+        try:
+            order_id = int(raw_id)
+        except ValueError:
+            errors.append(f"строка {line_no}: некорректный номер заказа {raw_id!r}")
+            continue
+        if not status:
+            errors.append(f"строка {line_no}: не указан статус")
+            continue
+        if status not in statuses:
+            errors.append(f"строка {line_no}: неизвестный статус {status!r}")
+            continue
+        yield statuses[status], order_id
+
+
+def cmd_set_order_status(args: argparse.Namespace) -> int:
+    f = _open_input(args.input)
+    try:
+        reader = csv.DictReader(f, delimiter=args.delimiter)
+        if not {"id", "status"} <= set(reader.fieldnames or []):
+            _progress("Ошибка: во входных данных должны быть столбцы id и status.")
+            return 2
+        with get_conn(args.db) as conn:
+            statuses = {r["name"]: r["id"] for r in conn.execute("SELECT id, name FROM order_status")}
+        errors: list[str] = []
+        changed = _run_chunked(args, 'UPDATE "order" SET status_id = ? WHERE id = ?',
+                               _read_status_updates(reader, statuses, errors))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return _finish(args, changed, errors)
+
+
+def _finish(args: argparse.Namespace, changed: int, errors: list[str]) -> int:
+    for e in errors:
+        _progress(f"Пропущено: {e}")
+    suffix = " (пробный запуск, изменения отменены)" if args.dry_run else ""
+    _progress(f"Итого изменено строк: {changed}, ошибок: {len(errors)}{suffix}")
+    return 1 if errors else 0
+
+
+def cmd_init(args: argparse.Namespace) -> int:
+    created = not (args.db or DB_FILE).exists()
+    init_db_if_needed(args.db)
+    _progress(f"{'Создана' if created else 'Обновлена'} база {args.db or DB_FILE}")
+    return 0
+
+
+def _open_existing(path: Path | None) -> bool:
+    """Migrate the database at ``path`` if it exists; otherwise say so and return False.
+
+    Only ``init`` creates databases: a mistyped path must not quietly become a new, seeded one.
+    """
+    if not (path or DB_FILE).exists():
+        _progress(f"Ошибка: база {path or DB_FILE} не найдена (новую создаёт команда init).")
+        return False
+    migrate(path)
+    return True
+
+
+def cmd_refresh_analytics(args: argparse.Namespace) -> int:
+    with get_conn(args.db) as conn:
+        days = analytics.refresh_sales(conn)
+    _progress(f"Пересчитано дней: {days}")
+    return 0
+
+
+def cmd_reorder(args: argparse.Namespace) -> int:
+    with get_conn(args.db) as conn:
+        analytics.refresh_sales(conn)  # imports and replication leave days queued; the forecast reads as-is
+        rows = forecast.reorder_report(forecast.compute_forecast(conn))
+    if args.output:
+        export.export_rows(Path(args.output), rows, export.REORDER_EXPORT_COLUMNS)
+    else:
+        writer = csv.writer(sys.stdout)
+        writer.writerow([h for _, h in export.REORDER_EXPORT_COLUMNS])
+        writer.writerows([r[k] for k, _ in export.REORDER_EXPORT_COLUMNS] for r in rows)
+    _progress(f"Позиций к заказу: {len(rows)}")
+    return 0
+
+
+def cmd_rebuild_pairs(args: argparse.Namespace) -> int:
+    def progress(done: int, total: int) -> None:
+        _progress(f"Частей заказов посчитано: {done}/{total}")
+
+    stats = recommend.rebuild_pairs(args.db or DB_FILE, workers=args.workers, progress=progress)
+    _progress(f"Заказов: {stats.orders}, пар товаров: {stats.pairs}, {stats.seconds:.1f} с, попыток: {stats.attempts}")
+    return 0
+
+
+def cmd_loadtest(args: argparse.Namespace) -> int:
+    try:
+        if args.replay:
+            report = loadtest.replay_log(
+                args.replay, args.db or DB_FILE, workers=args.workers, speed=args.speed,
+                timeout=args.timeout, in_place=args.in_place,
+            )
+        else:
+            report = loadtest.run_load(
+                args.db or DB_FILE, mix=loadtest.parse_mix(args.mix),
+                workers=loadtest.DEFAULT_WORKERS if args.workers is None else args.workers,
+                seconds=args.seconds if args.ops is None else None, ops=args.ops, think=args.think,
+                timeout=args.timeout, seed=args.seed, record=args.record, in_place=args.in_place,
+            )
+    except (OSError, ValueError) as e:
+        _progress(f"Ошибка: {e}")
+        return 2
+    print(report.summary())
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report.as_dict(), f, ensure_ascii=False, indent=2)
+    return 1 if report.ops[-1].errors else 0
+
+
+def cmd_import_orders(args: argparse.Namespace) -> int:
+    if args.input == "-":
+        rows = intake.rows_from_text(sys.stdin.read())
+    else:
+        rows = intake.rows_from_file(Path(args.input))
+    with get_conn(args.db) as conn:
+        result = intake.intake_orders(conn, rows, dry_run=args.dry_run)
+    for e in result.errors:
+        _progress(f"Ошибка: {e}")
+    if result.errors:
+        _progress(f"Найдено ошибок: {len(result.errors)}, ни один заказ не загружен.")
+        return 1
+    suffix = " (пробный запуск, ничего не записано)" if args.dry_run else ""
+    _progress(f"Загружено заказов: {result.orders}, позиций: {result.lines}{suffix}")
+    return 0
+
+
+def cmd_backup(args: argparse.Namespace) -> int:
+    if args.list:
+        for snap in backup.list_snapshots(args.dir):
+            print(f"{snap.name}\t{snap.stat().st_size}")
+        return 0
+
+    if not (args.db or DB_FILE).exists():
+        _progress(f"Ошибка: база {args.db or DB_FILE} не найдена.")
+        return 2
+
+    def progress(done: int, total: int) -> None:
+        _progress(f"Скопировано страниц: {done}/{total}")
+
+    try:
+        stats = backup.create_snapshot(args.db or DB_FILE, args.dir, keep=args.keep, progress=progress)
+    except backup.BackupBusy as e:
+        _progress(f"Снимок не создан: {e}. Повторите позже.")
+        return 1
+    _progress(f"Создан снимок {stats.summary()}")
+    return 0
+
+
+def cmd_restore(args: argparse.Namespace) -> int:
+    if args.snapshot == "latest":
+        snapshots = backup.list_snapshots(args.dir)
+        if not snapshots:
+            _progress(f"Ошибка: в {args.dir} нет снимков.")
+            return 2
+        snapshot = snapshots[0]
+    else:
+        snapshot = Path(args.snapshot)
+    # The target is not opened before the copy: it may be the damaged file the restore is for.
+    stats = backup.restore_snapshot(snapshot, args.db or DB_FILE)
+    migrate(args.db)  # an older snapshot is brought up to the current schema
+    _progress(f"Восстановлено из {stats.summary()}")
+    return 0
+
+
+def cmd_replicate(args: argparse.Namespace) -> int:
+    # sync only ships change_log deltas: a target made up on the spot would never get the source's existing rows.
+    if args.source.exists() and not args.target.exists():
+        _progress(f"Ошибка: база {args.target} не найдена; базу нового филиала создаёт команда replicate-clone.")
+        return 2
+    if not (_open_existing(args.source) and _open_existing(args.target)):
+        return 2
+    pairs = [(args.source, args.target)]
+    if args.both_ways:
+        pairs.append((args.target, args.source))
+    for src, dst in pairs:
+        stats = replicate.sync(src, dst, batch_size=args.chunk_size)
+        _progress(
+            f"{src} -> {dst}: пакетов {stats.batches}, записей журнала {stats.changes}, "
+            f"применено строк {stats.applied}, позиция {stats.last_seq}"
+        )
+        for c in stats.conflicts:
+            _progress(f"Конфликт: {c}")
+    return 0
+
+
+def cmd_replicate_clone(args: argparse.Namespace) -> int:
+    node = replicate.clone(args.source, args.target)
+    _progress(f"Создана база филиала {args.target} (node_id {node})")
+    return 0
+
+
+def cmd_maintain(args: argparse.Namespace) -> int:
+    stats = maintenance.run_maintenance(args.db or DB_FILE, args.log)
+    _progress(f"Обслуживание: {stats.summary()}")
+    return 0 if stats.ok else 1
+
+
+def cmd_federate(args: argparse.Namespace) -> int:
+    branches = branches_from_paths(args.branches)
+    if args.what == "products":
+        rows = federated_query(branches, lambda s: products_query(args.search, args.supplier, SORT_QTY_NONE, schema=s),
+                               order_by="article")
+    else:
+        rows = federated_query(
+            branches,
+            lambda s: orders_query(status=args.status, date_from=args.date_from, date_to=args.date_to, schema=s),
+            order_by="id",
+        )
+    out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        writer = csv.writer(out)
+        if rows:
+            keys = [k for k in rows[0].keys() if k != "branch_no"]
+            writer.writerow(keys)
+            writer.writerows([r[k] for k in keys] for r in rows)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    _progress(f"Филиалов: {len(branches)}, строк: {len(rows)}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Пакетные операции с базой ООО «Цветы» без графического интерфейса.")
+    parser.add_argument("--db", type=Path, default=None, help="путь к trade.db (по умолчанию — база приложения)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK, help="строк в одной транзакции")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("init", help="создать базу из файлов import_data, если её нет, и применить миграции")
+    p.set_defaults(func=cmd_init, db_use=DB_NONE)
+
+    p = sub.add_parser("dump", help="выгрузить таблицу в CSV")
+    p.add_argument("what", choices=sorted(DUMP_QUERIES))
+    p.add_argument("-o", "--output", help="файл (по умолчанию stdout)")
+    p.add_argument("--format", choices=["csv", "tsv"], default="csv")
+    p.set_defaults(func=cmd_dump)
+
+    def add_input_args(p: argparse.ArgumentParser) -> None:
+        p.add_argument("input", nargs="?", default="-", help="CSV-файл или '-' для stdin")
+        p.add_argument("--delimiter", default=",")
+        p.add_argument("--dry-run", action="store_true", help="проверить и посчитать, но не сохранять")
+
+    p = sub.add_parser("update-products",
+                       help="обновить цены/скидки/остатки (столбцы: article и любые из cost, discount, max_discount, quantity)")
+    add_input_args(p)
+    p.set_defaults(func=cmd_update_products)
+
+    p = sub.add_parser("set-order-status", help="сменить статусы заказов (столбцы: id, status)")
+    add_input_args(p)
+    p.set_defaults(func=cmd_set_order_status)
+
+    p = sub.add_parser("import-orders", help="загрузить заказы из xlsx/CSV (столбцы как в orders_import.xlsx)")
+    p.add_argument("input", help="файл .xlsx/.csv или '-' для stdin")
+    p.add_argument("--dry-run", action="store_true", help="только проверить")
+    p.set_defaults(func=cmd_import_orders)
+
+    p = sub.add_parser("backup", help="снять сжатый снимок базы без остановки приложения")
+    p.add_argument("--dir", type=Path, default=backup.BACKUP_DIR, help="каталог снимков")
+    p.add_argument("--keep", type=int, default=backup.KEEP_SNAPSHOTS, help="сколько последних снимков хранить")
+    p.add_argument("--list", action="store_true", help="показать имеющиеся снимки")
+    p.set_defaults(func=cmd_backup, db_use=DB_NONE)
+
+    p = sub.add_parser("restore", help="восстановить базу из снимка")
+    p.add_argument("snapshot", help="файл .db.gz или 'latest'")
+    p.add_argument("--dir", type=Path, default=backup.BACKUP_DIR, help="каталог снимков")
+    p.set_defaults(func=cmd_restore, db_use=DB_NONE)
+
+    p = sub.add_parser("replicate", help="передать изменения из одной trade.db в другую")
+    p.add_argument("source", type=Path)
+    p.add_argument("target", type=Path)
+    p.add_argument("--both-ways", action="store_true", help="затем передать изменения в обратную сторону")
+    p.set_defaults(func=cmd_replicate, db_use=DB_NONE)
+
+    p = sub.add_parser("replicate-clone", help="создать базу филиала как копию исходной")
+    p.add_argument("source", type=Path)
+    p.add_argument("target", type=Path)
+    p.set_defaults(func=cmd_replicate_clone, db_use=DB_NONE)
+
+    p = sub.add_parser("maintain", help="проверка, возврат свободного места и статистика планировщика (ANALYZE)")
+    p.add_argument("--log", type=Path, default=maintenance.MAINTENANCE_LOG, help="журнал обслуживания")
+    p.set_defaults(func=cmd_maintain)
+
+    p = sub.add_parser("federate", help="товары или заказы сразу по нескольким базам филиалов (только чтение)")
+    p.add_argument("what", choices=["products", "orders"])
+    p.add_argument("branches", type=Path, nargs="+", help="файлы trade.db филиалов")
+    p.add_argument("--search", default="", help="товары: строка поиска")
+    p.add_argument("--supplier", default="", help="товары: поставщик")
+    p.add_argument("--status", default=None, help="заказы: статус")
+    p.add_argument("--from", dest="date_from", default=None, help="заказы: дата выдачи с")
+    p.add_argument("--to", dest="date_to", default=None, help="заказы: дата выдачи по")
+    p.add_argument("-o", "--output", help="файл (по умолчанию stdout)")
+    p.set_defaults(func=cmd_federate, db_use=DB_NONE)
+
+    p = sub.add_parser("refresh-analytics", help="пересчитать аналитику продаж за изменённые дни")
+    p.set_defaults(func=cmd_refresh_analytics)
+
+    p = sub.add_parser("reorder", help="что и сколько дозаказать у поставщиков по прогнозу спроса")
+    p.add_argument("-o", "--output", help="файл .xlsx/.csv (по умолчанию CSV в stdout)")
+    p.set_defaults(func=cmd_reorder)
+
+    p = sub.add_parser("rebuild-pairs", help="пересчитать «часто покупают вместе» заново по всем заказам")
+    p.add_argument("-j", "--workers", type=int, default=None, help="число процессов (по умолчанию по числу ядер)")
+    p.set_defaults(func=cmd_rebuild_pairs)
+
+    p = sub.add_parser("loadtest", help="нагрузочный тест: несколько продавцов работают с одной базой")
+    p.add_argument("-n", "--workers", type=int, default=None,
+                   help=f"число процессов-продавцов (по умолчанию {loadtest.DEFAULT_WORKERS}, при --replay — как в журнале)")
+    p.add_argument("--mix", default=loadtest.DEFAULT_MIX, help="доли операций, например browse=5,search=3,edit_order=1")
+    p.add_argument("--seconds", type=float, default=loadtest.DEFAULT_SECONDS, help="длительность теста")
+    p.add_argument("--ops", type=int, default=None, help="операций на процесс (вместо --seconds)")
+    p.add_argument("--think", type=float, default=loadtest.THINK_TIME,
+                   help="средняя пауза продавца между действиями, с (0 — без пауз)")
+    p.add_argument("--timeout", type=float, default=5.0, help="сколько ждать занятую базу, с")
+    p.add_argument("--seed", type=int, default=None, help="для воспроизводимой последовательности действий")
+    p.add_argument("--record", type=Path, default=None, help="записать действия в журнал JSONL")
+    p.add_argument("--replay", type=Path, default=None, help="воспроизвести записанный журнал вместо смеси операций")
+    p.add_argument("--speed", type=float, default=1.0, help="ускорение воспроизведения журнала")
+    p.add_argument("--in-place", action="store_true", help="работать с самой базой, а не с её временной копией")
+    p.add_argument("-o", "--output", help="сохранить отчёт в JSON")
+    p.set_defaults(func=cmd_loadtest)
+
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.chunk_size <= 0:
+        _progress("Ошибка: --chunk-size должен быть положительным.")
+        return 2
+    if getattr(args, "db_use", DB_MIGRATE) == DB_MIGRATE and not _open_existing(args.db):
+        return 2
+    try:
+        code = args.func(args)
+        sys.stdout.flush()  # inside the try: the last buffered rows may be the ones that hit the closed pipe
+        return code
+    except BrokenPipeError:
+        # The reader of stdout went away (``dump users | head``): stop quietly. Pointing stdout
+        # at devnull keeps the interpreter's final flush from raising the same error again.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return EXIT_BROKEN_PIPE
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,13 +4,17 @@ from __future__ import annotations
 import os
 import re
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import date, datetime
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Callable, Iterable, Sequence
 
 import openpyxl
 
+from images import ImageRejected, ingest_image
+from search import match_sql, refresh_index as refresh_search_index, uses_trigrams
+
 
 DB_FILE = Path(__file__).resolve().parent / "trade.db"
 APP_ROOT = Path(__file__).resolve().parent
@@ -18,31 +22,34 @@ ASSETS_PRODUCTS_DIR = APP_ROOT / "assets" / "products"
 IMPORT_DIR = APP_ROOT / "import_data"
 
 
-def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_FILE)
+def get_conn(path: Path | None = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or DB_FILE)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON;")
     return conn
 
 
-def init_db_if_needed() -> None:
-    """Create schema + import initial data from xlsx if DB doesn't exist yet."""
-    if DB_FILE.exists():
-        return
+def init_db_if_needed(path: Path | None = None) -> None:
+    """Create schema + import initial data from xlsx if DB doesn't exist yet, then apply pending migrations."""
+    if not (path or DB_FILE).exists():
+        ASSETS_PRODUCTS_DIR.mkdir(parents=True, exist_ok=True)
 
-    ASSETS_PRODUCTS_DIR.mkdir(parents=True, exist_ok=True)
+        with get_conn(path) as conn:
+            _create_schema(conn)
+            _import_roles_users(conn, IMPORT_DIR / "user_import.xlsx")
+            _import_products(conn, IMPORT_DIR / "products_import.xlsx")
+            _import_pickup_points(conn, IMPORT_DIR / "pickup_points_import.xlsx")
+            _import_orders(conn, IMPORT_DIR / "orders_import.xlsx")
 
-    with get_conn() as conn:
-        _create_schema(conn)
-        _import_roles_users(conn, IMPORT_DIR / "user_import.xlsx")
-        _import_products(conn, IMPORT_DIR / "products_import.xlsx")
-        _import_pickup_points(conn, IMPORT_DIR / "pickup_points_import.xlsx")
-        _import_orders(conn, IMPORT_DIR / "orders_import.xlsx")
+    migrate(path)
 
 
 def _create_schema(conn: sqlite3.Connection) -> None:
     conn.executescript(
         """
+        -- Must come before the first table; lets maintenance.py return free pages incrementally.
+        PRAGMA auto_vacuum = INCREMENTAL;
+
         CREATE TABLE role (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL UNIQUE
@@ -138,7 +145,7 @@ def _import_roles_users(conn: sqlite3.Connection, xlsx_path: Path) -> None:
 
 
 def _safe_copy_product_image(filename: str) -> str | None:
-    """Copy image from import folder to assets/products, return relative path or None."""
+    """Ingest image from import folder into assets/products, return relative path or None."""
     if not filename:
         return None
     src = IMPORT_DIR / filename
@@ -146,7 +153,10 @@ def _safe_copy_product_image(filename: str) -> str | None:
         return None
     dst = ASSETS_PRODUCTS_DIR / filename
     if not dst.exists():
-        dst.write_bytes(src.read_bytes())
+        try:
+            dst = ingest_image(src, ASSETS_PRODUCTS_DIR).path
+        except ImageRejected:
+            return None
     rel = os.path.relpath(dst, APP_ROOT)
     return rel
 
@@ -212,24 +222,55 @@ def _import_pickup_points(conn: sqlite3.Connection, xlsx_path: Path) -> None:
             conn.execute("INSERT INTO pickup_point(address) VALUES (?)", (str(addr).strip(),))
 
 
-_COMPOSITION_RE = re.compile(r"\s*([A-Za-zА-Яа-я0-9]+)\s*,\s*(\d+)\s*")
+_ARTICLE_RE = re.compile(r"[A-Za-zА-Яа-яЁё0-9]+")
+# One "ART, QTY" pair followed by a separating comma or the end of the text.
+_COMPOSITION_RE = re.compile(r"\s*([A-Za-zА-Яа-яЁё0-9]+)\s*,\s*(\d+)\s*(,|$)")
 
 
-def _parse_composition(text: str) -> list[tuple[str, int]]:
-    # Example: "А112Т4, 2, G843H5, 2"
-    items: list[tuple[str, int]] = []
-    if not text:
-        return items
-    parts = [p.strip() for p in str(text).split(",") if p.strip()]
-    # pairwise
-    for i in range(0, len(parts) - 1, 2):
-        art = parts[i]
-        try:
-            qty = int(parts[i + 1])
-        except Exception:
-            continue
-        items.append((art, qty))
-    return items
+class CompositionError(ValueError):
+    """Malformed order composition; ``position`` is the 1-based character where the problem starts."""
+
+    def __init__(self, message: str, position: int):
+        super().__init__(f"позиция {position}: {message}")
+        self.position = position
+
+
+def parse_composition(text: Any) -> list[tuple[str, int]]:
+    """Parse "А112Т4, 2, G843H5, 2" into [(article, qty), ...].
+
+    Quantities must be positive integers; a repeated article has its quantities
+    summed. Raises CompositionError pointing at the first bad token.
+    """
+    text = str(text or "")
+    items: dict[str, int] = {}
+    pos = 0
+    end = len(text)
+    while pos < end and text[pos:].strip():
+        m = _COMPOSITION_RE.match(text, pos)
+        if not m:
+            _raise_composition_error(text, pos)
+        art, qty = m.group(1), int(m.group(2))
+        if qty <= 0:
+            raise CompositionError(f"количество для «{art}» должно быть больше нуля", m.start(2) + 1)
+        items[art] = items.get(art, 0) + qty
+        pos = m.end()
+    return list(items.items())
+
+
+def _raise_composition_error(text: str, pos: int) -> None:
+    tokens = text[pos:].split(",", 2)
+    art_raw = tokens[0]
+    art = art_raw.strip()
+    art_pos = pos + len(art_raw) - len(art_raw.lstrip()) + 1
+    if not art:
+        raise CompositionError("пропущен артикул", art_pos)
+    if not _ARTICLE_RE.fullmatch(art):
+        raise CompositionError(f"недопустимый артикул «{art}»", art_pos)
+    if len(tokens) < 2 or not tokens[1].strip():
+        raise CompositionError(f"для артикула «{art}» не указано количество", art_pos)
+    qty_raw = tokens[1]
+    qty_pos = pos + len(art_raw) + 1 + len(qty_raw) - len(qty_raw.lstrip()) + 1
+    raise CompositionError(f"количество «{qty_raw.strip()}» для «{art}» должно быть целым числом", qty_pos)
 
 
 def _as_iso_date(value: Any) -> str:
@@ -247,6 +288,21 @@ def _as_iso_date(value: Any) -> str:
     return str(value)
 
 
+def parse_date(value: Any) -> str:
+    """Strictly convert ``value`` to an ISO date (YYYY-MM-DD); raise ValueError if it is not a real date."""
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    v = str(value or "").strip()
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(v, fmt).date().isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f"Некорректная дата: {v!r}")
+
+
 def _import_orders(conn: sqlite3.Connection, xlsx_path: Path) -> None:
     wb = openpyxl.load_workbook(xlsx_path)
     ws = wb.active
@@ -275,7 +331,11 @@ def _import_orders(conn: sqlite3.Connection, xlsx_path: Path) -> None:
             ),
         )
 
-        for art, qty in _parse_composition(str(composition) if composition else ""):
+        try:
+            items = parse_composition(composition)
+        except CompositionError as e:
+            raise ValueError(f"{xlsx_path.name}, заказ {order_id}: {e}") from None
+        for art, qty in items:
             # Skip unknown products (shouldn't happen)
             prod = conn.execute("SELECT 1 FROM product WHERE article=?", (art,)).fetchone()
             if not prod:
@@ -286,6 +346,692 @@ def _import_orders(conn: sqlite3.Connection, xlsx_path: Path) -> None:
             )
 
 
+# --- Schema migrations -------------------------------------------------------
+#
+# _create_schema() is the original schema; everything added later lives in
+# _MIGRATIONS. PRAGMA user_version holds the number of applied steps, so an
+# existing trade.db is upgraded in place the next time the app or CLI starts.
+
+
+def _execute_script(conn: sqlite3.Connection, script: str) -> None:
+    """Run several statements inside the current transaction (executescript would commit)."""
+    stmt = ""
+    for line in script.splitlines(keepends=True):
+        stmt += line
+        if sqlite3.complete_statement(stmt):
+            conn.execute(stmt)
+            stmt = ""
+    if stmt.strip():
+        conn.execute(stmt)
+
+
+def _rebuild_table(conn: sqlite3.Connection, table: str, create_sql: str, copy_select: str) -> None:
+    """Replace ``table`` with the one from ``create_sql`` (which must create ``<table>__new``).
+
+    This is SQLite's "12-step" ALTER TABLE procedure: triggers and views that
+    mention the table are dropped and re-created afterwards, as are the table's
+    own indexes. Must run with foreign_keys OFF (migrate() takes care of it).
+    """
+    quoted = f'"{table}"'
+    deps = conn.execute(
+        """
+        SELECT type, name, tbl_name, sql FROM sqlite_master
+        WHERE sql IS NOT NULL AND (
+            (type = 'index' AND tbl_name = ?)
+            OR (type IN ('trigger', 'view') AND (tbl_name = ? OR sql LIKE ?))
+        )
+        """,
+        (table, table, f"%{table}%"),
+    ).fetchall()
+    for d in deps:
+        if d["type"] in ("trigger", "view"):
+            conn.execute(f'DROP {d["type"].upper()} "{d["name"]}"')
+
+    conn.execute(create_sql)
+    conn.execute(f'INSERT INTO "{table}__new" {copy_select}')
+    old, new = (conn.execute(f"SELECT count(*) FROM {t}").fetchone()[0] for t in (quoted, f'"{table}__new"'))
+    if old != new:
+        raise sqlite3.IntegrityError(f"Rebuilding {table} would keep {new} of {old} rows")
+    conn.execute(f"DROP TABLE {quoted}")
+    conn.execute(f'ALTER TABLE "{table}__new" RENAME TO {quoted}')
+
+    for kind in ("index", "view", "trigger"):
+        for d in deps:
+            if d["type"] == kind:
+                conn.execute(d["sql"])
+
+
+def _migration_sales_analytics(conn: sqlite3.Connection) -> None:
+    _execute_script(
+        conn,
+        """
+        CREATE INDEX IF NOT EXISTS idx_order_order_date ON "order"(order_date);
+
+        -- One row per day/product/pickup point; supplier and category are
+        -- copied from product when the day is (re)built.
+        CREATE TABLE sales_daily (
+            day TEXT NOT NULL,
+            product_article TEXT NOT NULL,
+            pickup_point_id INTEGER NOT NULL,
+            supplier TEXT NOT NULL,
+            category TEXT NOT NULL,
+            units INTEGER NOT NULL,
+            revenue REAL NOT NULL,
+            PRIMARY KEY (day, product_article, pickup_point_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX idx_sales_daily_article ON sales_daily(product_article, day);
+
+        -- Per-day rollups of sales_daily; dim is 'day', 'product', 'supplier',
+        -- 'category' or 'pickup_point'.
+        CREATE TABLE sales_rollup (
+            dim TEXT NOT NULL,
+            day TEXT NOT NULL,
+            key TEXT NOT NULL,
+            units INTEGER NOT NULL,
+            revenue REAL NOT NULL,
+            PRIMARY KEY (dim, day, key)
+        ) WITHOUT ROWID;
+
+        -- Days whose orders changed since the last refresh.
+        CREATE TABLE sales_dirty_day (
+            day TEXT PRIMARY KEY
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER trg_sales_order_ins AFTER INSERT ON "order"
+        BEGIN
+            INSERT OR IGNORE INTO sales_dirty_day(day) VALUES (NEW.order_date);
+        END;
+
+        CREATE TRIGGER trg_sales_order_upd AFTER UPDATE OF order_date, pickup_point_id ON "order"
+        BEGIN
+            INSERT OR IGNORE INTO sales_dirty_day(day) VALUES (OLD.order_date);
+            INSERT OR IGNORE INTO sales_dirty_day(day) VALUES (NEW.order_date);
+        END;
+
+        CREATE TRIGGER trg_sales_order_del AFTER DELETE ON "order"
+        BEGIN
+            INSERT OR IGNORE INTO sales_dirty_day(day) VALUES (OLD.order_date);
+        END;
+
+        CREATE TRIGGER trg_sales_line_ins AFTER INSERT ON order_product
+        BEGIN
+            INSERT OR IGNORE INTO sales_dirty_day(day)
+            SELECT order_date FROM "order" WHERE id = NEW.order_id;
+        END;
+
+        CREATE TRIGGER trg_sales_line_upd AFTER UPDATE ON order_product
+        BEGIN
+            INSERT OR IGNORE INTO sales_dirty_day(day)
+            SELECT order_date FROM "order" WHERE id IN (OLD.order_id, NEW.order_id);
+        END;
+
+        CREATE TRIGGER trg_sales_line_del AFTER DELETE ON order_product
+        BEGIN
+            INSERT OR IGNORE INTO sales_dirty_day(day)
+            SELECT order_date FROM "order" WHERE id = OLD.order_id;
+        END;
+
+        -- Backfill: every existing day gets built on the first refresh.
+        INSERT OR IGNORE INTO sales_dirty_day(day) SELECT DISTINCT order_date FROM "order";
+        """,
+    )
+
+
+def _migration_order_status_and_dates(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE order_status (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        )
+        """
+    )
+    conn.execute("INSERT INTO order_status(name) VALUES ('Новый'), ('Завершен')")
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO order_status(name)
+        SELECT DISTINCT trim(status) FROM "order" WHERE trim(status) <> ''
+        """
+    )
+
+    # Dates were free text; normalise them first so the CHECKs below hold.
+    for row in conn.execute('SELECT id, order_date, delivery_date FROM "order"').fetchall():
+        try:
+            order_date = parse_date(row["order_date"])
+            delivery_date = parse_date(row["delivery_date"])
+        except ValueError as e:
+            raise ValueError(f"Заказ {row['id']}: {e}") from None
+        if (order_date, delivery_date) != (row["order_date"], row["delivery_date"]):
+            conn.execute(
+                'UPDATE "order" SET order_date=?, delivery_date=? WHERE id=?',
+                (order_date, delivery_date, row["id"]),
+            )
+
+    _rebuild_table(
+        conn,
+        "order",
+        """
+        CREATE TABLE "order__new" (
+            id INTEGER PRIMARY KEY,
+            order_date TEXT NOT NULL CHECK(date(order_date, '+0 days') IS order_date),
+            delivery_date TEXT NOT NULL CHECK(date(delivery_date, '+0 days') IS delivery_date),
+            pickup_point_id INTEGER NOT NULL,
+            client_name TEXT,
+            pickup_code INTEGER NOT NULL,
+            status_id INTEGER NOT NULL,
+            FOREIGN KEY (pickup_point_id) REFERENCES pickup_point(id),
+            FOREIGN KEY (status_id) REFERENCES order_status(id)
+        )
+        """,
+        """
+        SELECT o.id, o.order_date, o.delivery_date, o.pickup_point_id, o.client_name, o.pickup_code,
+               COALESCE(s.id, (SELECT id FROM order_status WHERE name = 'Новый'))
+        FROM "order" o
+        -- Orders with a blank status are kept as 'Новый' rather than dropped by the rebuild
+        LEFT JOIN order_status s ON s.name = trim(o.status)
+        """,
+    )
+    _execute_script(
+        conn,
+        """
+        CREATE INDEX idx_order_delivery ON "order"(delivery_date);
+        CREATE INDEX idx_order_point_delivery ON "order"(pickup_point_id, delivery_date);
+        CREATE INDEX idx_order_status_delivery ON "order"(status_id, delivery_date);
+        """,
+    )
+
+
+def _mark_dirty_day(day_sql: str) -> str:
+    # Not INSERT OR IGNORE: an outer UPSERT/OR-clause statement overrides the
+    # conflict policy of statements inside triggers it fires.
+    return f"""
+            INSERT INTO sales_dirty_day(day)
+            SELECT d FROM ({day_sql})
+            WHERE d IS NOT NULL AND NOT EXISTS (SELECT 1 FROM sales_dirty_day WHERE day = d);"""
+
+
+def _migration_sales_triggers_upsert_safe(conn: sqlite3.Connection) -> None:
+    for name in ("order_ins", "order_upd", "order_del", "line_ins", "line_upd", "line_del"):
+        conn.execute(f"DROP TRIGGER trg_sales_{name}")
+    _execute_script(
+        conn,
+        f"""
+        CREATE TRIGGER trg_sales_order_ins AFTER INSERT ON "order"
+        BEGIN{_mark_dirty_day("SELECT NEW.order_date AS d")}
+        END;
+
+        CREATE TRIGGER trg_sales_order_upd AFTER UPDATE OF order_date, pickup_point_id ON "order"
+        BEGIN{_mark_dirty_day("SELECT OLD.order_date AS d UNION SELECT NEW.order_date")}
+        END;
+
+        CREATE TRIGGER trg_sales_order_del AFTER DELETE ON "order"
+        BEGIN{_mark_dirty_day("SELECT OLD.order_date AS d")}
+        END;
+
+        CREATE TRIGGER trg_sales_line_ins AFTER INSERT ON order_product
+        BEGIN{_mark_dirty_day('SELECT order_date AS d FROM "order" WHERE id = NEW.order_id')}
+        END;
+
+        CREATE TRIGGER trg_sales_line_upd AFTER UPDATE ON order_product
+        BEGIN{_mark_dirty_day('SELECT DISTINCT order_date AS d FROM "order" WHERE id IN (OLD.order_id, NEW.order_id)')}
+        END;
+
+        CREATE TRIGGER trg_sales_line_del AFTER DELETE ON order_product
+        BEGIN{_mark_dirty_day('SELECT order_date AS d FROM "order" WHERE id = OLD.order_id')}
+        END;
+        """,
+    )
+
+
+# Tables captured by the change log, with the SQL expression that gives the
+# row key; order_product changes are logged against their order, because the
+# whole line set of an order is shipped as one unit.
+CDC_TABLES = {
+    "pickup_point": "id",
+    "product": "article",
+    "order": "id",
+    "order_product": "order_id",
+}
+
+
+def _cdc_triggers(table: str, key: str) -> str:
+    quoted = f'"{table}"'
+    when = "WHEN (SELECT applying FROM cdc_state WHERE id = 1) = 0"
+    delete_op = "U" if table == "order_product" else "D"
+    return f"""
+        CREATE TRIGGER trg_cdc_{table}_ins AFTER INSERT ON {quoted} {when}
+        BEGIN
+            INSERT INTO change_log(tbl, pk, op) VALUES ('{table}', NEW.{key}, 'U');
+        END;
+
+        CREATE TRIGGER trg_cdc_{table}_upd AFTER UPDATE ON {quoted} {when}
+        BEGIN
+            INSERT INTO change_log(tbl, pk, op)
+            SELECT '{table}', OLD.{key}, '{delete_op}' WHERE OLD.{key} IS NOT NEW.{key};
+            INSERT INTO change_log(tbl, pk, op) VALUES ('{table}', NEW.{key}, 'U');
+        END;
+
+        CREATE TRIGGER trg_cdc_{table}_del AFTER DELETE ON {quoted} {when}
+        BEGIN
+            INSERT INTO change_log(tbl, pk, op) VALUES ('{table}', OLD.{key}, '{delete_op}');
+        END;
+    """
+
+
+def _migration_change_log(conn: sqlite3.Connection) -> None:
+    _execute_script(
+        conn,
+        """
+        -- seq is AUTOINCREMENT so numbers are never reused, even after pruning.
+        CREATE TABLE change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            pk TEXT NOT NULL,
+            op TEXT NOT NULL CHECK(op IN ('U', 'D'))
+        );
+        CREATE INDEX idx_change_log_tbl_seq ON change_log(tbl, seq);
+
+        -- node_id identifies this database to its replication peers; applying
+        -- is set while replicated changes are written so they are not logged again.
+        CREATE TABLE cdc_state (
+            id INTEGER PRIMARY KEY CHECK(id = 1),
+            node_id TEXT NOT NULL,
+            applying INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT INTO cdc_state(id, node_id) VALUES (1, lower(hex(randomblob(16))));
+
+        -- applied_seq: last change of that peer applied here;
+        -- acked_seq: last change of ours the peer confirmed.
+        CREATE TABLE replication_peer (
+            node_id TEXT PRIMARY KEY,
+            applied_seq INTEGER NOT NULL DEFAULT 0,
+            acked_seq INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+    )
+    for table, key in CDC_TABLES.items():
+        _execute_script(conn, _cdc_triggers(table, key))
+
+
+def _migration_product_search(conn: sqlite3.Connection) -> None:
+    # The index itself is built in Python (search.refresh_index): folding and
+    # trigram splitting are not expressible in SQL. Triggers only queue the
+    # products whose searchable text changed.
+    queue_new = """
+            INSERT INTO product_search_dirty(article)
+            SELECT NEW.article WHERE NOT EXISTS (SELECT 1 FROM product_search_dirty WHERE article = NEW.article);"""
+    queue_old = """
+            INSERT INTO product_search_dirty(article)
+            SELECT OLD.article WHERE NOT EXISTS (SELECT 1 FROM product_search_dirty WHERE article = OLD.article);"""
+    _execute_script(
+        conn,
+        f"""
+        -- Folded catalog words, their trigrams, and which products use them.
+        CREATE TABLE search_word (
+            id INTEGER PRIMARY KEY,
+            word TEXT NOT NULL UNIQUE,
+            grams INTEGER NOT NULL
+        );
+        CREATE TABLE search_word_trigram (
+            tri TEXT NOT NULL,
+            word_id INTEGER NOT NULL,
+            PRIMARY KEY (tri, word_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE product_word (
+            word_id INTEGER NOT NULL,
+            article TEXT NOT NULL,
+            PRIMARY KEY (word_id, article)
+        ) WITHOUT ROWID;
+        CREATE INDEX idx_product_word_article ON product_word(article);
+
+        CREATE TABLE product_search_dirty (
+            article TEXT PRIMARY KEY
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER trg_search_product_ins AFTER INSERT ON product
+        BEGIN{queue_new}
+        END;
+
+        CREATE TRIGGER trg_search_product_upd
+        AFTER UPDATE OF article, name, description, category, manufacturer, supplier ON product
+        BEGIN{queue_old}{queue_new}
+        END;
+
+        CREATE TRIGGER trg_search_product_del AFTER DELETE ON product
+        BEGIN{queue_old}
+        END;
+
+        INSERT INTO product_search_dirty(article) SELECT article FROM product;
+        """,
+    )
+
+
+# Product columns that reference a dimension table: table -> column in product.
+DIMENSION_TABLES = {
+    "unit": "unit_id",
+    "manufacturer": "manufacturer_id",
+    "supplier": "supplier_id",
+    "category": "category_id",
+}
+
+
+def _migration_product_dimensions(conn: sqlite3.Connection) -> None:
+    for table in DIMENSION_TABLES:
+        conn.execute(
+            f"""
+            CREATE TABLE {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE
+            )
+            """
+        )
+        conn.execute(f"INSERT INTO {table}(name) SELECT DISTINCT trim({table}) FROM product ORDER BY 1")
+
+    # Its UPDATE OF list names the text columns that are going away.
+    conn.execute("DROP TRIGGER trg_search_product_upd")
+    _rebuild_table(
+        conn,
+        "product",
+        """
+        CREATE TABLE product__new (
+            article TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            unit_id INTEGER NOT NULL REFERENCES unit(id),
+            cost REAL NOT NULL CHECK(cost >= 0),
+            max_discount INTEGER NOT NULL CHECK(max_discount BETWEEN 0 AND 100),
+            manufacturer_id INTEGER NOT NULL REFERENCES manufacturer(id),
+            supplier_id INTEGER NOT NULL REFERENCES supplier(id),
+            category_id INTEGER NOT NULL REFERENCES category(id),
+            discount INTEGER NOT NULL CHECK(discount BETWEEN 0 AND 100),
+            quantity INTEGER NOT NULL CHECK(quantity >= 0),
+            description TEXT NOT NULL,
+            image_path TEXT
+        )
+        """,
+        """
+        SELECT p.article, p.name, u.id, p.cost, p.max_discount, m.id, s.id, c.id,
+               p.discount, p.quantity, p.description, p.image_path
+        FROM product p
+        JOIN unit u ON u.name = trim(p.unit)
+        JOIN manufacturer m ON m.name = trim(p.manufacturer)
+        JOIN supplier s ON s.name = trim(p.supplier)
+        JOIN category c ON c.name = trim(p.category)
+        """,
+    )
+    _execute_script(
+        conn,
+        """
+        CREATE INDEX idx_product_supplier ON product(supplier_id);
+
+        -- The product with its dimension names, as the rest of the app reads it.
+        CREATE VIEW product_view AS
+        SELECT p.article, p.name, u.name AS unit, p.cost, p.max_discount, m.name AS manufacturer,
+               s.name AS supplier, c.name AS category, p.discount, p.quantity, p.description, p.image_path,
+               p.unit_id, p.manufacturer_id, p.supplier_id, p.category_id
+        FROM product p
+        JOIN unit u ON u.id = p.unit_id
+        JOIN manufacturer m ON m.id = p.manufacturer_id
+        JOIN supplier s ON s.id = p.supplier_id
+        JOIN category c ON c.id = p.category_id;
+
+        CREATE TRIGGER trg_search_product_upd
+        AFTER UPDATE OF article, name, description, category_id, manufacturer_id, supplier_id ON product
+        BEGIN
+            INSERT INTO product_search_dirty(article)
+            SELECT OLD.article WHERE NOT EXISTS (SELECT 1 FROM product_search_dirty WHERE article = OLD.article);
+            INSERT INTO product_search_dirty(article)
+            SELECT NEW.article WHERE NOT EXISTS (SELECT 1 FROM product_search_dirty WHERE article = NEW.article);
+        END;
+        """,
+    )
+    # Builds the search index queued by the previous migration (it reads product_view).
+    refresh_search_index(conn)
+
+
+def _pair_delta(article: str, others: str, delta: int) -> str:
+    """Trigger statements adding ``delta`` to the pair counts of ``article`` with each article ``others`` returns.
+
+    Plain UPDATE + INSERT ... WHERE NOT EXISTS rather than an upsert, for the
+    same reason as _mark_dirty_day.
+    """
+    sign = "+" if delta > 0 else "-"
+    sql = f"""
+            UPDATE product_pair SET orders = orders {sign} 1 WHERE a = {article} AND b IN ({others});
+            UPDATE product_pair SET orders = orders {sign} 1 WHERE b = {article} AND a IN ({others});"""
+    if delta > 0:
+        sql += f"""
+            INSERT INTO product_pair(a, b, orders)
+            SELECT {article}, x.art, 1 FROM ({others}) x
+            WHERE NOT EXISTS (SELECT 1 FROM product_pair WHERE a = {article} AND b = x.art)
+            UNION ALL
+            SELECT x.art, {article}, 1 FROM ({others}) x
+            WHERE NOT EXISTS (SELECT 1 FROM product_pair WHERE a = x.art AND b = {article});"""
+    else:
+        sql += f"""
+            DELETE FROM product_pair WHERE a = {article} AND b IN ({others}) AND orders <= 0;
+            DELETE FROM product_pair WHERE b = {article} AND a IN ({others}) AND orders <= 0;"""
+    return sql
+
+
+# Pair counts as a single statement; the migration backfill and recommend.rebuild_pairs use it.
+PAIR_COUNT_SQL = """
+    SELECT x.product_article AS a, y.product_article AS b, COUNT(*) AS orders
+    FROM order_product x
+    JOIN order_product y ON y.order_id = x.order_id AND y.product_article > x.product_article
+    {where}
+    GROUP BY x.product_article, y.product_article
+"""
+
+
+def _migration_product_pairs(conn: sqlite3.Connection) -> None:
+    # product_pair holds every pair in both directions, so "related to X" is
+    # one range of the (a, orders DESC) index however many orders there are.
+    new_others = "SELECT product_article AS art FROM order_product WHERE order_id = NEW.order_id AND product_article <> NEW.product_article"
+    old_others = "SELECT product_article AS art FROM order_product WHERE order_id = OLD.order_id AND product_article <> OLD.product_article"
+    # After an UPDATE the changed row is already in place; it must not pair with the old article.
+    old_others_upd = old_others + " AND NOT (order_id = NEW.order_id AND product_article = NEW.product_article)"
+    _execute_script(
+        conn,
+        f"""
+        -- How many orders contain both a and b; every pair is stored as (a, b) and (b, a).
+        CREATE TABLE product_pair (
+            a TEXT NOT NULL,
+            b TEXT NOT NULL,
+            orders INTEGER NOT NULL,
+            PRIMARY KEY (a, b)
+        ) WITHOUT ROWID;
+        CREATE INDEX idx_product_pair_top ON product_pair(a, orders DESC, b);
+
+        CREATE TRIGGER trg_pair_line_ins AFTER INSERT ON order_product
+        BEGIN{_pair_delta("NEW.product_article", new_others, +1)}
+        END;
+
+        CREATE TRIGGER trg_pair_line_upd AFTER UPDATE OF order_id, product_article ON order_product
+        BEGIN{_pair_delta("OLD.product_article", old_others_upd, -1)}{_pair_delta("NEW.product_article", new_others, +1)}
+        END;
+
+        CREATE TRIGGER trg_pair_line_del AFTER DELETE ON order_product
+        BEGIN{_pair_delta("OLD.product_article", old_others, -1)}
+        END;
+        """,
+    )
+    pairs = PAIR_COUNT_SQL.format(where="")
+    conn.execute(f"INSERT INTO product_pair(a, b, orders) SELECT a, b, orders FROM ({pairs})")
+    conn.execute(f"INSERT INTO product_pair(a, b, orders) SELECT b, a, orders FROM ({pairs})")
+
+
+def _migration_sort_indexes(conn: sqlite3.Connection) -> None:
+    # Header sorting on the product and order lists: each sortable column that
+    # is a plain column (or, for the discounted price, the exact expression
+    # products_query sorts by) gets an index ending in the tiebreaker key, so
+    # the ordered scan needs no sort step. Dimension names (category,
+    # supplier, status, pickup point) live in other tables and are sorted by SQL.
+    _execute_script(
+        conn,
+        """
+        CREATE INDEX idx_product_name ON product(name, article);
+        CREATE INDEX idx_product_cost ON product(cost, article);
+        CREATE INDEX idx_product_discount ON product(discount, article);
+        CREATE INDEX idx_product_final_cost ON product(ROUND(cost * (100 - discount) / 100.0, 2), article);
+        CREATE INDEX idx_product_quantity ON product(quantity, article);
+        CREATE INDEX idx_order_client ON "order"(client_name);
+        """,
+    )
+
+
+def _migration_clients(conn: sqlite3.Connection) -> None:
+    # One client per normalized FIO (see client_key); "order".client_name keeps
+    # the text as typed, client_id points at the client it belongs to.
+    _execute_script(
+        conn,
+        """
+        CREATE TABLE client (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fio_key TEXT NOT NULL UNIQUE,
+            name TEXT NOT NULL,
+            user_id INTEGER REFERENCES user(id)
+        );
+        ALTER TABLE "order" ADD COLUMN client_id INTEGER REFERENCES client(id);
+        CREATE INDEX idx_order_client_id ON "order"(client_id, order_date);
+        """,
+    )
+    # Spellings of the same client collapse into one; the most used one becomes its name.
+    spellings: dict[str, list[tuple[int, str]]] = {}
+    keys: dict[str, str] = {}  # client_name as stored -> its key
+    for name, n in conn.execute('SELECT client_name, count(*) FROM "order" WHERE client_name IS NOT NULL GROUP BY 1'):
+        key = client_key(name)
+        if key:
+            keys[name] = key
+            spellings.setdefault(key, []).append((-n, " ".join(name.split())))
+    users = _client_users(conn)
+    conn.executemany(
+        "INSERT INTO client(fio_key, name, user_id) VALUES (?, ?, ?)",
+        [(key, min(names)[1], users.get(key)) for key, names in sorted(spellings.items())],
+    )
+    ids = {r[0]: r[1] for r in conn.execute("SELECT fio_key, id FROM client")}
+    # client_id is local to each database (every replica runs this migration), so it is not logged.
+    conn.execute("UPDATE cdc_state SET applying = 1 WHERE id = 1")
+    conn.executemany(
+        'UPDATE "order" SET client_id = ? WHERE client_name = ?',
+        [(ids[key], name) for name, key in keys.items()],
+    )
+    conn.execute("UPDATE cdc_state SET applying = 0 WHERE id = 1")
+
+
+# Product columns whose past values are kept in product_history.
+PRODUCT_HISTORY_FIELDS = ("cost", "discount", "quantity")
+_HISTORY_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+
+
+def _history_trigger(field: str) -> str:
+    # The old value is recorded when it is replaced. A second change within the
+    # same millisecond finds its row already there: that value was never in
+    # effect, so there is nothing to keep.
+    return f"""
+        CREATE TRIGGER trg_history_{field} AFTER UPDATE OF {field} ON product
+        WHEN OLD.{field} IS NOT NEW.{field}
+        BEGIN
+            INSERT INTO product_history(article, field, valid_from, valid_to, value)
+            SELECT NEW.article, '{field}',
+                   (SELECT max(valid_to) FROM product_history WHERE article = NEW.article AND field = '{field}'),
+                   {_HISTORY_NOW}, OLD.{field}
+            WHERE NOT EXISTS (
+                SELECT 1 FROM product_history
+                WHERE article = NEW.article AND field = '{field}' AND valid_to = {_HISTORY_NOW}
+            );
+        END;
+    """
+
+
+def _migration_product_history(conn: sqlite3.Connection) -> None:
+    _execute_script(
+        conn,
+        """
+        -- Past values of PRODUCT_HISTORY_FIELDS, one row per changed column:
+        -- value was in effect from valid_from (NULL: before history was kept)
+        -- until valid_to. The current value is the one in product.
+        CREATE TABLE product_history (
+            article TEXT NOT NULL,
+            field TEXT NOT NULL,
+            valid_from TEXT,
+            valid_to TEXT NOT NULL,
+            value NOT NULL,  -- no declared type: stored exactly as the product column had it
+            PRIMARY KEY (article, field, valid_to)
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER trg_history_article AFTER UPDATE OF article ON product
+        WHEN OLD.article IS NOT NEW.article
+        BEGIN
+            UPDATE product_history SET article = NEW.article WHERE article = OLD.article;
+        END;
+
+        CREATE TRIGGER trg_history_product_del AFTER DELETE ON product
+        BEGIN
+            DELETE FROM product_history WHERE article = OLD.article;
+        END;
+        """,
+    )
+    for field in PRODUCT_HISTORY_FIELDS:
+        _execute_script(conn, _history_trigger(field))
+
+
+def _migration_order_status_repair(conn: sqlite3.Connection) -> None:
+    # Migration 2 first joined statuses with an inner JOIN and dropped orders
+    # with a blank status; databases migrated back then cannot get those back.
+    # What can be fixed: orders left pointing at a missing or blank status
+    # (e.g. one replicated in with create=True) become 'Новый' like in migration 2.
+    _execute_script(
+        conn,
+        """
+        INSERT OR IGNORE INTO order_status(name) VALUES ('Новый');
+
+        UPDATE "order" SET status_id = (SELECT id FROM order_status WHERE name = 'Новый')
+        WHERE status_id IS NULL
+           OR status_id NOT IN (SELECT id FROM order_status WHERE trim(name) <> '');
+
+        DELETE FROM order_status WHERE trim(name) = '';
+        """,
+    )
+
+
+_MIGRATIONS = [
+    _migration_sales_analytics,
+    _migration_order_status_and_dates,
+    _migration_sales_triggers_upsert_safe,
+    _migration_change_log,
+    _migration_product_search,
+    _migration_product_dimensions,
+    _migration_product_pairs,
+    _migration_sort_indexes,
+    _migration_clients,
+    _migration_product_history,
+    _migration_order_status_repair,
+]
+
+
+def migrate(path: Path | None = None) -> None:
+    conn = get_conn(path)
+    conn.isolation_level = None  # explicit BEGIN/COMMIT around every step
+    # Table rebuilds must not cascade deletes; integrity is checked per step instead.
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target in range(version + 1, len(_MIGRATIONS) + 1):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                _MIGRATIONS[target - 1](conn)
+                broken = conn.execute("PRAGMA foreign_key_check").fetchall()
+                if broken:
+                    raise sqlite3.IntegrityError(f"Migration {target} broke foreign keys: {[tuple(r) for r in broken[:5]]}")
+                conn.execute(f"PRAGMA user_version = {target}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
+
+
 @dataclass(frozen=True)
 class AuthUser:
     id: int
@@ -310,3 +1056,586 @@ def authenticate(login: str, password: str) -> AuthUser | None:
             return None
         fio = f"{row['surname']} {row['name']} {row['patronymic']}".strip()
         return AuthUser(id=int(row["id"]), fio=fio, role=str(row["role_name"]))
+
+
+# --- Queries shared by the pages, the CLI and exports ---------------------------
+
+ALL_SUPPLIERS = "Все поставщики"
+
+SORT_QTY_NONE = "без сортировки"
+SORT_QTY_ASC = "по возрастанию"
+SORT_QTY_DESC = "по убыванию"
+
+
+# Sort keys are (field, descending) pairs, most significant first; the field
+# names are the result columns of products_query / orders_query.
+SortKey = tuple[str, bool]
+
+_FINAL_COST_SQL = "ROUND(p.cost * (100 - p.discount) / 100.0, 2)"  # must match idx_product_final_cost
+
+PRODUCT_SORT_COLUMNS = {
+    "article": "p.article",
+    "name": "p.name",
+    "category": "p.category",
+    "supplier": "p.supplier",
+    "cost": "p.cost",
+    "discount": "p.discount",
+    "final_cost": _FINAL_COST_SQL,
+    "quantity": "p.quantity",
+}
+
+ORDER_SORT_COLUMNS = {
+    "id": "o.id",
+    "status": "s.name",
+    "order_date": "o.order_date",
+    "delivery_date": "o.delivery_date",
+    "pickup": "p.address",
+    "client_name": "o.client_name",
+    "pickup_code": "o.pickup_code",
+}
+
+
+def order_by_sql(keys: Sequence[SortKey], columns: dict[str, str], tiebreak: str) -> str:
+    """ORDER BY clause for ``keys``, always ending in the unique ``tiebreak`` column so the order is stable."""
+    terms = []
+    used = set()
+    for field, descending in keys:
+        if field not in columns:
+            raise ValueError(f"Unknown sort column: {field}")
+        expr = columns[field]
+        if expr in used:
+            continue
+        used.add(expr)
+        terms.append(f"{expr} {'DESC' if descending else 'ASC'}")
+        if expr == tiebreak:
+            break  # rows are unique from here on; later keys could never apply
+    if tiebreak not in used:
+        terms.append(tiebreak)
+    return "ORDER BY " + ", ".join(terms)
+
+
+_PRODUCT_SEARCH_COLUMNS = ("article", "name", "description", "category", "manufacturer", "supplier")
+
+
+def _product_like(alias: str) -> str:
+    return "(" + " OR ".join(f"lower({alias}.{c}) LIKE ?" for c in _PRODUCT_SEARCH_COLUMNS) + ")"
+
+
+def products_query(
+    search: str = "",
+    supplier: str = "",
+    sort: str = SORT_QTY_NONE,
+    schema: str = "main",
+    order: Sequence[SortKey] = (),
+) -> tuple[str, list[Any]]:
+    """SQL + params for the product list with ProductListPage's search/supplier/sort semantics.
+
+    Searches of MIN_QUERY_LEN characters and more go through the trigram index
+    (typo and homoglyph tolerant, best matches first); shorter ones are plain
+    substring matches. ``order`` (header sorting, see PRODUCT_SORT_COLUMNS)
+    takes precedence over both the relevance order and ``sort``.
+    ``schema`` selects an attached branch database (see federated_query).
+    """
+    search = search.strip().lower()
+    supplier = supplier.strip()
+
+    from_sql = f"{schema}.product_view p"
+    from_params: list[Any] = []
+    where = []
+    params: list[Any] = []
+    order_by = ""
+
+    if supplier and supplier != ALL_SUPPLIERS:
+        where.append("p.supplier = ?")
+        params.append(supplier)
+
+    if search:
+        likes = [f"%{search}%"] * len(_PRODUCT_SEARCH_COLUMNS)
+        if uses_trigrams(search):
+            match, from_params = match_sql(schema, search, _product_like("q"), likes)
+            from_sql = f"""
+                (SELECT article, max(hits) AS hits FROM ({match}) GROUP BY article) m
+                JOIN {schema}.product_view p ON p.article = m.article
+            """
+            order_by = "ORDER BY m.hits DESC, p.article"
+        else:
+            where.append(_product_like("p"))
+            params.extend(likes)
+
+    if not order and sort in (SORT_QTY_ASC, SORT_QTY_DESC):
+        order = [("quantity", sort == SORT_QTY_DESC)]
+    if order:
+        order_by = order_by_sql(order, PRODUCT_SORT_COLUMNS, "p.article")
+
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+    sql = f"""
+        SELECT p.article, p.name, p.unit, p.category, p.supplier, p.manufacturer, p.cost, p.discount,
+               {_FINAL_COST_SQL} AS final_cost, p.quantity
+        FROM {from_sql}
+        {where_sql}
+        {order_by}
+    """
+    return sql, from_params + params
+
+
+ORDER_DATE_FIELDS = ("order_date", "delivery_date")
+
+
+def orders_query(
+    status_id: int | None = None,
+    pickup_point_id: int | None = None,
+    date_field: str = "delivery_date",
+    date_from: str | None = None,
+    date_to: str | None = None,
+    status: str | None = None,
+    schema: str = "main",
+    order: Sequence[SortKey] = (),
+) -> tuple[str, list[Any]]:
+    """SQL + params for OrdersPage; every filter is pushed down to an indexed column.
+
+    Status ids are local to a database, so federated queries filter by ``status`` name instead.
+    ``order`` is header sorting (see ORDER_SORT_COLUMNS); by default orders come by id.
+    """
+    if date_field not in ORDER_DATE_FIELDS:
+        raise ValueError(f"Unknown date field: {date_field}")
+
+    where = []
+    params: list[Any] = []
+    if status_id is not None:
+        where.append("o.status_id = ?")
+        params.append(status_id)
+    if status is not None:
+        where.append("s.name = ?")
+        params.append(status)
+    if pickup_point_id is not None:
+        where.append("o.pickup_point_id = ?")
+        params.append(pickup_point_id)
+    if date_from:
+        where.append(f"o.{date_field} >= ?")
+        params.append(parse_date(date_from))
+    if date_to:
+        where.append(f"o.{date_field} <= ?")
+        params.append(parse_date(date_to))
+
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+    sql = f"""
+        SELECT o.id, s.name AS status, o.order_date, o.delivery_date, p.address AS pickup, o.client_name, o.pickup_code
+        FROM {schema}."order" o
+        JOIN {schema}.order_status s ON s.id = o.status_id
+        JOIN {schema}.pickup_point p ON p.id = o.pickup_point_id
+        {where_sql}
+        {order_by_sql(order, ORDER_SORT_COLUMNS, "o.id")}
+    """
+    return sql, params
+
+
+class DimensionCache:
+    """name -> id lookups in the product dimension tables, adding names that are new.
+
+    Use one cache per transaction: an id handed out for a new name is only
+    valid if that transaction commits.
+    """
+
+    def __init__(self) -> None:
+        self._ids: dict[tuple[str, str], int] = {}
+
+    def id(self, conn: sqlite3.Connection, table: str, name: str) -> int:
+        if table not in DIMENSION_TABLES:
+            raise ValueError(f"Unknown dimension table: {table}")
+        name = name.strip()
+        key = (table, name)
+        if key not in self._ids:
+            row = conn.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                row = (conn.execute(f"INSERT INTO {table}(name) VALUES (?)", (name,)).lastrowid,)
+            self._ids[key] = int(row[0])
+        return self._ids[key]
+
+    def ids(self, conn: sqlite3.Connection, names: dict[str, str]) -> dict[str, int]:
+        """{"supplier": "Цветовик", ...} -> {"supplier_id": 3, ...}"""
+        return {DIMENSION_TABLES[t]: self.id(conn, t, n) for t, n in names.items()}
+
+
+def dimension_names(conn: sqlite3.Connection, table: str) -> list[str]:
+    """Names in ``table`` that some product uses, sorted (for filter comboboxes)."""
+    if table not in DIMENSION_TABLES:
+        raise ValueError(f"Unknown dimension table: {table}")
+    column = DIMENSION_TABLES[table]
+    return [
+        r[0]
+        for r in conn.execute(
+            f"SELECT d.name FROM {table} d WHERE EXISTS (SELECT 1 FROM product p WHERE p.{column} = d.id) ORDER BY d.name"
+        )
+    ]
+
+
+def set_order_lines(conn: sqlite3.Connection, order_id: int, lines: Iterable[tuple[str, int]]) -> None:
+    """Make the order's lines exactly ``lines``, touching only the rows that differ.
+
+    Unchanged lines are left alone, so the triggers that maintain sales and
+    pair statistics only see what actually changed.
+    """
+    wanted = dict(lines)
+    current = {
+        r[0]: r[1]
+        for r in conn.execute("SELECT product_article, quantity FROM order_product WHERE order_id = ?", (order_id,))
+    }
+    conn.executemany(
+        "DELETE FROM order_product WHERE order_id = ? AND product_article = ?",
+        [(order_id, art) for art in current if art not in wanted],
+    )
+    conn.executemany(
+        """
+        INSERT INTO order_product(order_id, product_article, quantity) VALUES (?, ?, ?)
+        ON CONFLICT(order_id, product_article) DO UPDATE SET quantity = excluded.quantity
+        """,
+        [(order_id, art, qty) for art, qty in wanted.items() if current.get(art) != qty],
+    )
+
+
+def save_order(
+    conn: sqlite3.Connection,
+    order_id: int,
+    editing: bool,
+    status: str,
+    order_date: str,
+    delivery_date: str,
+    pickup_point_id: int,
+    client: str | None,
+    pickup_code: int,
+    items: list[tuple[str, int]],
+) -> str | None:
+    """Write an order as OrderEditPage saves it; returns an error message instead when it cannot.
+
+    The caller owns the transaction (``with conn:``).
+    """
+    if items:
+        arts = [art for art, _ in items]
+        marks = ", ".join("?" for _ in arts)
+        known = {r[0] for r in conn.execute(f"SELECT article FROM product WHERE article IN ({marks})", arts)}
+        unknown = [art for art in arts if art not in known]
+        if unknown:
+            return f"Товары не найдены: {', '.join(unknown)}."
+
+    exists = conn.execute('SELECT 1 FROM "order" WHERE id=?', (order_id,)).fetchone()
+    if not editing and exists:
+        return "Заказ с таким номером уже существует."
+
+    try:
+        status_id = order_status_id(conn, status)
+    except ValueError as e:
+        return f"{e}."
+    client_ref = client_id(conn, client)
+    if exists:
+        conn.execute(
+            """
+            UPDATE "order"
+            SET status_id=?, order_date=?, delivery_date=?, pickup_point_id=?, client_name=?, pickup_code=?,
+                client_id=?
+            WHERE id=?
+            """,
+            (status_id, order_date, delivery_date, pickup_point_id, client, pickup_code, client_ref, order_id),
+        )
+    else:
+        conn.execute(
+            """
+            INSERT INTO "order"(id, status_id, order_date, delivery_date, pickup_point_id, client_name, pickup_code,
+                                client_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (order_id, status_id, order_date, delivery_date, pickup_point_id, client, pickup_code, client_ref),
+        )
+
+    # Only the lines that changed, so the sales and pair statistics triggers do no extra work
+    set_order_lines(conn, order_id, items)
+    return None
+
+
+def related_products(conn: sqlite3.Connection, article: str, k: int = 5, schema: str = "main") -> list[sqlite3.Row]:
+    """The ``k`` products most often ordered together with ``article``: article, name, orders.
+
+    Reads k entries of the product_pair index, so the cost does not depend on
+    the number of orders.
+    """
+    return conn.execute(
+        f"""
+        SELECT p.article, p.name, pp.orders
+        FROM {schema}.product_pair pp
+        JOIN {schema}.product_view p ON p.article = pp.b
+        WHERE pp.a = ?
+        ORDER BY pp.orders DESC, pp.b
+        LIMIT ?
+        """,
+        (article, k),
+    ).fetchall()
+
+
+def end_of_day_sql(day: str) -> str:
+    """SQL for the last product_history timestamp of the day ``day`` (an SQL expression) evaluates to."""
+    return f"({day} || ' 23:59:59.999')"
+
+
+def product_as_of_sql(field: str, article: str, at: str, current: str) -> str:
+    """SQL expression for ``field`` of product ``article`` as it was at timestamp ``at``.
+
+    ``article`` and ``at`` are SQL expressions; ``current`` is the column with
+    today's value, used when the field has not changed since ``at``. Each use
+    is one seek on the product_history primary key.
+    """
+    if field not in PRODUCT_HISTORY_FIELDS:
+        raise ValueError(f"No history for product field: {field}")
+    return f"""COALESCE((
+        SELECT h.value FROM product_history h
+        WHERE h.article = {article} AND h.field = '{field}' AND h.valid_to > {at}
+        ORDER BY h.valid_to LIMIT 1
+    ), {current})"""
+
+
+def order_price_sql(article: str, at: str, alias: str = "p") -> str:
+    """SQL expression for the discounted unit price of ``article`` at ``at``; ``alias`` is its product row."""
+    cost = product_as_of_sql("cost", article, at, f"{alias}.cost")
+    discount = product_as_of_sql("discount", article, at, f"{alias}.discount")
+    return f"ROUND({cost} * (100 - {discount}) / 100.0, 2)"
+
+
+def product_as_of(conn: sqlite3.Connection, article: str, at: str) -> sqlite3.Row | None:
+    """cost, discount and quantity of ``article`` at ``at`` ("YYYY-MM-DD HH:MM:SS.SSS", or a day meaning its end)."""
+    if len(at) == 10:
+        at = f"{at} 23:59:59.999"
+    fields = ", ".join(f"{product_as_of_sql(f, 'p.article', '?', f'p.{f}')} AS {f}" for f in PRODUCT_HISTORY_FIELDS)
+    return conn.execute(
+        f"SELECT p.article, {fields} FROM product p WHERE p.article = ?",
+        [at] * len(PRODUCT_HISTORY_FIELDS) + [article],
+    ).fetchone()
+
+
+def order_value(conn: sqlite3.Connection, order_id: int) -> float:
+    """What the order came to at the prices in effect at the end of its order date."""
+    price = order_price_sql("op.product_article", end_of_day_sql("o.order_date"))
+    row = conn.execute(
+        f"""
+        SELECT COALESCE(SUM(op.quantity * {price}), 0)
+        FROM "order" o
+        JOIN order_product op ON op.order_id = o.id
+        JOIN product p ON p.article = op.product_article
+        WHERE o.id = ?
+        """,
+        (order_id,),
+    ).fetchone()
+    return round(float(row[0]), 2)
+
+
+def compact_product_history(conn: sqlite3.Connection, before: str) -> int:
+    """Thin out history older than the day ``before`` to what end-of-day lookups need; returns rows removed.
+
+    Of the values replaced during one day only the first was still in effect
+    at the end of the previous day; the rest lasted part of a day and are
+    dropped, so old history holds at most one row per field and day.
+    """
+    deleted = conn.execute(
+        """
+        DELETE FROM product_history
+        WHERE valid_to < ? AND EXISTS (
+            SELECT 1 FROM product_history e
+            WHERE e.article = product_history.article AND e.field = product_history.field
+              AND e.valid_to < product_history.valid_to AND e.valid_to >= substr(product_history.valid_to, 1, 10)
+        )
+        """,
+        (before,),
+    ).rowcount
+    if deleted:
+        # Rows that followed a dropped one now start where their new predecessor ended.
+        conn.execute(
+            """
+            UPDATE product_history
+            SET valid_from = (
+                SELECT max(e.valid_to) FROM product_history e
+                WHERE e.article = product_history.article AND e.field = product_history.field
+                  AND e.valid_to < product_history.valid_to
+            )
+            WHERE valid_from < ? AND NOT EXISTS (
+                SELECT 1 FROM product_history e
+                WHERE e.article = product_history.article AND e.field = product_history.field
+                  AND e.valid_to = product_history.valid_from
+            )
+            """,
+            (before,),
+        )
+    return deleted
+
+
+def order_status_id(conn: sqlite3.Connection, name: str, create: bool = False) -> int:
+    """Id of the status called ``name``; raises ValueError for an unknown one.
+
+    Only replication passes ``create``: a status the source database has is
+    added here, so its orders arrive with it.
+    """
+    name = name.strip()
+    if create:
+        conn.execute("INSERT OR IGNORE INTO order_status(name) VALUES (?)", (name,))
+    row = conn.execute("SELECT id FROM order_status WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        raise ValueError(f"Неизвестный статус «{name}»")
+    return int(row["id"])
+
+
+_CLIENT_WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+def client_key(name: Any) -> str:
+    """Normalized FIO: lower case, ё as е, words only ("Иванов  И.И." -> "иванов и и")."""
+    return " ".join(_CLIENT_WORD_RE.findall(str(name or "").casefold().replace("ё", "е")))
+
+
+def _client_users(conn: sqlite3.Connection) -> dict[str, int]:
+    """Accounts with the "Клиент" role by client_key of their FIO."""
+    rows = conn.execute(
+        """
+        SELECT u.id, u.surname || ' ' || u.name || ' ' || u.patronymic
+        FROM user u JOIN role r ON r.id = u.role_id
+        WHERE r.name = 'Клиент'
+        """
+    )
+    return {client_key(fio): user_id for user_id, fio in rows}
+
+
+def client_id(conn: sqlite3.Connection, name: str | None) -> int | None:
+    """Id of the client ``name`` refers to, registering a new client if needed; None for an empty name."""
+    key = client_key(name)
+    if not key:
+        return None
+    row = conn.execute("SELECT id FROM client WHERE fio_key = ?", (key,)).fetchone()
+    if row:
+        return int(row[0])
+    cur = conn.execute(
+        "INSERT INTO client(fio_key, name, user_id) VALUES (?, ?, ?)",
+        (key, " ".join(str(name).split()), _client_users(conn).get(key)),
+    )
+    return int(cur.lastrowid)
+
+
+def find_clients(conn: sqlite3.Connection, text: str, limit: int = 50) -> list[sqlite3.Row]:
+    """Clients whose normalized FIO starts with ``text``: id, name, orders; a range scan of the fio_key index."""
+    key = client_key(text)
+    return conn.execute(
+        """
+        SELECT c.id, c.name, (SELECT count(*) FROM "order" o WHERE o.client_id = c.id) AS orders
+        FROM client c
+        WHERE c.fio_key >= ? AND c.fio_key < ?
+        ORDER BY c.fio_key
+        LIMIT ?
+        """,
+        (key, key + "\U0010ffff", limit),
+    ).fetchall()
+
+
+def client_history(conn: sqlite3.Connection, client: int) -> list[sqlite3.Row]:
+    """The client's orders, newest first, with item count and total at the prices of the order date.
+
+    One query over idx_order_client_id and the order_product primary key, so
+    its cost depends on the client's orders, not on the size of the table.
+    """
+    return conn.execute(
+        f"""
+        SELECT o.id, o.order_date, o.delivery_date, s.name AS status, pp.address AS pickup, o.client_name,
+               COALESCE(SUM(op.quantity), 0) AS items,
+               ROUND(COALESCE(SUM(op.quantity * {order_price_sql("op.product_article", end_of_day_sql("o.order_date"))}), 0), 2)
+                   AS total
+        FROM "order" o
+        JOIN order_status s ON s.id = o.status_id
+        JOIN pickup_point pp ON pp.id = o.pickup_point_id
+        LEFT JOIN order_product op ON op.order_id = o.id
+        LEFT JOIN product p ON p.article = op.product_article
+        WHERE o.client_id = ?
+        GROUP BY o.id
+        ORDER BY o.order_date DESC, o.id DESC
+        """,
+        (client,),
+    ).fetchall()
+
+
+# --- Federation: head-office queries over several branch databases --------------
+
+FEDERATION_WORKERS = 4
+
+
+@dataclass(frozen=True)
+class Branch:
+    name: str
+    path: Path
+
+
+def branches_from_paths(paths: Iterable[Path | str]) -> list[Branch]:
+    """One Branch per database file, named after the file (or its folder when names clash)."""
+    paths = [Path(p) for p in paths]
+    stems = [p.stem for p in paths]
+    branches = []
+    for p in paths:
+        name = p.stem if stems.count(p.stem) == 1 else f"{p.parent.name}/{p.stem}"
+        branches.append(Branch(name, p))
+    return branches
+
+
+def _attach_branches(conn: sqlite3.Connection, branches: list[Branch]) -> list[str]:
+    """ATTACH ``branches`` read-only as b0, b1, ... and return the schema names."""
+    schemas = []
+    for i, b in enumerate(branches):
+        if not b.path.exists():
+            raise FileNotFoundError(f"База филиала {b.name} не найдена: {b.path}")
+        schema = f"b{i}"
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (b.path.resolve().as_uri() + "?mode=ro",))
+        version = conn.execute(f"PRAGMA {schema}.user_version").fetchone()[0]
+        if version != len(_MIGRATIONS):
+            raise ValueError(f"База филиала {b.name}: версия схемы {version}, ожидается {len(_MIGRATIONS)}")
+        schemas.append(schema)
+    return schemas
+
+
+def _query_branch_group(
+    branches: list[Branch],
+    build: Callable[[str], tuple[str, list[Any]]],
+    order_by: str,
+) -> list[sqlite3.Row]:
+    conn = sqlite3.connect(":memory:", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA query_only = ON")
+        schemas = _attach_branches(conn, branches)
+        arms = []
+        params: list[Any] = []
+        for i, (b, schema) in enumerate(zip(branches, schemas)):
+            sql, branch_params = build(schema)
+            arms.append(f"SELECT ? AS branch, {i} AS branch_no, * FROM ({sql})")
+            params.append(b.name)
+            params.extend(branch_params)
+        order_sql = ", ".join(["branch_no"] + ([order_by] if order_by else []))
+        return conn.execute(" UNION ALL ".join(arms) + f" ORDER BY {order_sql}", params).fetchall()
+    finally:
+        conn.close()
+
+
+def federated_query(
+    branches: list[Branch],
+    build: Callable[[str], tuple[str, list[Any]]],
+    order_by: str = "",
+    workers: int = FEDERATION_WORKERS,
+) -> list[sqlite3.Row]:
+    """Run ``build(schema)`` in every branch and return the rows as one result with a ``branch`` column.
+
+    ``build`` is one of the shared query builders bound to its filters (e.g.
+    ``lambda s: products_query(search, schema=s)``), so the WHERE clause runs
+    inside each branch database. Branches are attached read-only in groups no
+    larger than SQLite's ATTACH limit, one connection per group, and the groups
+    are scanned in parallel threads. Rows come back in branch order, then by
+    ``order_by`` (a column list of the query's result).
+    """
+    if not branches:
+        return []
+    probe = sqlite3.connect(":memory:")
+    attach_limit = probe.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    probe.close()
+    group_size = max(1, min(attach_limit, -(-len(branches) // workers)))
+    groups = [branches[i:i + group_size] for i in range(0, len(branches), group_size)]
+    with ThreadPoolExecutor(max_workers=min(workers, len(groups)), thread_name_prefix="federation") as pool:
+        results = pool.map(lambda g: _query_branch_group(g, build, order_by), groups)
+        return [row for rows in results for row in rows]
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import csv
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence
+
+import openpyxl
+
+from db import get_conn
+
+
+FETCH_SIZE = 2000
+
+# (column in the query, header in the file)
+PRODUCT_EXPORT_COLUMNS = [
+    ("article", "Артикул"),
+    ("name", "Наименование"),
+    ("unit", "Ед. измерения"),
+    ("category", "Категория"),
+    ("supplier", "Поставщик"),
+    ("manufacturer", "Производитель"),
+    ("cost", "Цена"),
+    ("discount", "Скидка %"),
+    ("final_cost", "Цена со скидкой"),
+    ("quantity", "Остаток"),
+]
+
+ORDER_EXPORT_COLUMNS = [
+    ("id", "№"),
+    ("status", "Статус"),
+    ("order_date", "Дата заказа"),
+    ("delivery_date", "Дата выдачи"),
+    ("pickup", "Пункт выдачи"),
+    ("client_name", "Клиент"),
+    ("pickup_code", "Код"),
+]
+
+
+REORDER_EXPORT_COLUMNS = [
+    ("supplier", "Поставщик"),
+    ("article", "Артикул"),
+    ("name", "Наименование"),
+    ("quantity", "Остаток"),
+    ("rate", "Спрос, шт./день"),
+    ("days_of_cover", "Хватит на, дней"),
+    ("suggested", "Заказать, шт."),
+]
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def _write_atomically(dest: Path, write: Callable[[Path], None]) -> None:
+    """Run ``write`` on a temporary file next to ``dest`` and move it into place only once it succeeded.
+
+    A failed or cancelled export leaves no half-written file that looks finished.
+    """
+    fd, tmp = tempfile.mkstemp(dir=dest.resolve().parent, suffix=".part")
+    os.close(fd)
+    try:
+        write(Path(tmp))
+        os.chmod(tmp, 0o644)  # mkstemp creates the file private to the current user
+        os.replace(tmp, dest)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def _open_writer(path: Path, is_xlsx: bool, headers: list[str]):
+    """(write_row, finish) for a new .xlsx or .csv file at ``path``; finish() saves and closes it."""
+    if is_xlsx:
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(headers)
+        return ws.append, lambda: wb.save(path)
+    fh = open(path, "w", newline="", encoding="utf-8-sig")  # BOM so Excel picks up UTF-8
+    writer = csv.writer(fh, delimiter=";")
+    writer.writerow(headers)
+    return writer.writerow, fh.close
+
+
+def export_query(
+    dest: Path,
+    sql: str,
+    params: Sequence[Any],
+    columns: Sequence[tuple[str, str]],
+    progress: Optional[Callable[[int], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    db_path: Optional[Path] = None,
+) -> int:
+    """Stream the result of ``sql`` into ``dest`` (.xlsx or .csv) and return the row count.
+
+    Rows are pulled with fetchmany and written straight out (openpyxl write-only
+    workbook for xlsx), so memory use does not grow with the result size. Opens
+    its own connection, so it is safe to call from a worker thread.
+    """
+    keys = [c for c, _ in columns]
+    headers = [h for _, h in columns]
+    is_xlsx = dest.suffix.lower() == ".xlsx"
+    total = 0
+
+    def write(path: Path) -> None:
+        nonlocal total
+        write_row, finish = _open_writer(path, is_xlsx, headers)
+        conn = get_conn(db_path)
+        try:
+            cur = conn.execute(sql, list(params))
+            while True:
+                if cancel is not None and cancel.is_set():
+                    raise ExportCancelled()
+                rows = cur.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                for r in rows:
+                    write_row([r[k] for k in keys])
+                total += len(rows)
+                if progress:
+                    progress(total)
+        finally:
+            conn.close()
+            finish()
+
+    _write_atomically(dest, write)
+    return total
+
+
+def export_rows(dest: Path, rows: Sequence[dict[str, Any]], columns: Sequence[tuple[str, str]]) -> int:
+    """Write rows computed in Python (not a query) into ``dest`` (.xlsx or .csv); returns the row count."""
+    keys = [c for c, _ in columns]
+    headers = [h for _, h in columns]
+
+    def write(path: Path) -> None:
+        write_row, finish = _open_writer(path, dest.suffix.lower() == ".xlsx", headers)
+        try:
+            for r in rows:
+                write_row([r[k] for k in keys])
+        finally:
+            finish()
+
+    _write_atomically(dest, write)
+    return len(rows)
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import math
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Optional
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+
+SHORT_WINDOW = 7  # days; recent demand, and the length of the rolling "worst week"
+LONG_WINDOW = 28  # days of history a rate is computed from
+SHORT_WEIGHT = 0.6  # demand rate = weighted mean of the short and long window rates
+LEAD_TIME_DAYS = 3  # from placing an order with a supplier to flowers on the shelf
+TARGET_COVER_DAYS = 7  # a reorder should bring stock up to this many days beyond the lead time
+MAX_AGE = 10 * 60  # seconds; replicated orders do not show up in change_log, so recompute at least this often
+
+
+@dataclass
+class Forecast:
+    article: str
+    name: str
+    supplier: str
+    quantity: int
+    rate: float  # expected units per day
+    peak_rate: float  # units per day in the worst SHORT_WINDOW days of the history
+    reorder_point: float
+    suggested: int  # units to order now; 0 when stock is above the reorder point
+
+    @property
+    def days_of_cover(self) -> Optional[float]:
+        """Days until the stock runs out at the expected rate; None if there is no demand."""
+        return self.quantity / self.rate if self.rate > 0 else None
+
+    @property
+    def low(self) -> bool:
+        return self.quantity > 0 and self.suggested > 0
+
+
+def _rates_numpy(units: list[list[int]]) -> tuple[list[float], list[float]]:
+    u = np.asarray(units, dtype=float)
+    if not u.size:
+        return [], []
+    rate = SHORT_WEIGHT * u[:, -SHORT_WINDOW:].mean(axis=1) + (1 - SHORT_WEIGHT) * u.mean(axis=1)
+    cum = np.concatenate([np.zeros((u.shape[0], 1)), np.cumsum(u, axis=1)], axis=1)
+    weekly = cum[:, SHORT_WINDOW:] - cum[:, :-SHORT_WINDOW]  # every rolling SHORT_WINDOW-day sum
+    peak = weekly.max(axis=1) / SHORT_WINDOW
+    return rate.tolist(), peak.tolist()
+
+
+def _rates_python(units: list[list[int]]) -> tuple[list[float], list[float]]:
+    rates, peaks = [], []
+    for row in units:
+        rates.append(
+            SHORT_WEIGHT * sum(row[-SHORT_WINDOW:]) / SHORT_WINDOW + (1 - SHORT_WEIGHT) * sum(row) / len(row)
+        )
+        week = sum(row[:SHORT_WINDOW])
+        peak = week
+        for i in range(SHORT_WINDOW, len(row)):
+            week += row[i] - row[i - SHORT_WINDOW]
+            peak = max(peak, week)
+        peaks.append(peak / SHORT_WINDOW)
+    return rates, peaks
+
+
+def demand_rates(units: list[list[int]]) -> tuple[list[float], list[float]]:
+    """(rate, peak rate) per row of daily units, oldest day first; rows are LONG_WINDOW long."""
+    return _rates_numpy(units) if np is not None else _rates_python(units)
+
+
+def compute_forecast(conn: sqlite3.Connection) -> list[Forecast]:
+    """Demand rate, days of cover and reorder suggestion for every product.
+
+    Daily demand comes from sales_daily as last refreshed: order saves and
+    maintenance run refresh_sales, so this read never takes the write lock.
+    The rate blends the last SHORT_WINDOW and LONG_WINDOW days up to today, so
+    days without sales count as zero demand; the reorder point covers the lead
+    time at the worst rolling week of the history.
+    """
+    products = conn.execute("SELECT article, name, supplier, quantity FROM product_view ORDER BY article").fetchall()
+    index = {p[0]: i for i, p in enumerate(products)}
+    units = [[0] * LONG_WINDOW for _ in products]
+    today = date.today()
+    start = today - timedelta(days=LONG_WINDOW - 1)
+    for article, day, n in conn.execute(
+        """
+        SELECT product_article, day, SUM(units) FROM sales_daily
+        WHERE day BETWEEN ? AND ?
+        GROUP BY product_article, day
+        """,
+        (start.isoformat(), today.isoformat()),
+    ):
+        if article in index:
+            units[index[article]][(date.fromisoformat(day) - start).days] = n
+
+    rates, peaks = demand_rates(units)
+    result = []
+    for (article, name, supplier, quantity), rate, peak in zip(products, rates, peaks):
+        reorder_point = rate * LEAD_TIME_DAYS + max(peak - rate, 0.0) * LEAD_TIME_DAYS
+        target = reorder_point + rate * TARGET_COVER_DAYS
+        suggested = math.ceil(target - quantity) if rate > 0 and quantity <= reorder_point else 0
+        result.append(Forecast(article, name, supplier, int(quantity), rate, peak, reorder_point, max(suggested, 0)))
+    return result
+
+
+def reorder_report(forecasts: list[Forecast]) -> list[dict]:
+    """Rows of what to order, grouped by supplier, most urgent first within each supplier."""
+    rows = [f for f in forecasts if f.suggested > 0]
+    rows.sort(key=lambda f: (f.supplier, f.days_of_cover or 0.0, f.article))
+    return [
+        {
+            "supplier": f.supplier,
+            "article": f.article,
+            "name": f.name,
+            "quantity": f.quantity,
+            "rate": round(f.rate, 2),
+            "days_of_cover": round(f.days_of_cover, 1) if f.days_of_cover is not None else None,
+            "suggested": f.suggested,
+        }
+        for f in rows
+    ]
+
+
+def _data_key(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT max(seq) FROM change_log WHERE tbl IN ('order', 'order_product', 'product')").fetchone()
+    return int(row[0] or 0)
+
+
+class ForecastCache:
+    """The latest forecast per article, recomputed only when orders or stock changed (or after MAX_AGE).
+
+    Safe to share between worker threads; each caller passes its own connection.
+    """
+
+    def __init__(self, max_age: float = MAX_AGE) -> None:
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._key: Optional[int] = None
+        self._at = 0.0
+        self._forecasts: dict[str, Forecast] = {}
+
+    def get(self, conn: sqlite3.Connection) -> dict[str, Forecast]:
+        key = _data_key(conn)
+        with self._lock:
+            if key == self._key and time.monotonic() - self._at < self.max_age:
+                return self._forecasts
+        forecasts = {f.article: f for f in compute_forecast(conn)}
+        with self._lock:
+            self._key, self._at, self._forecasts = key, time.monotonic(), forecasts
+        return forecasts
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import io
+import os
+import struct
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+try:
+    from PIL import Image, ImageOps
+except Exception:
+    Image = None
+    ImageOps = None
+
+
+MAX_SIDE = 1200  # longer side of a stored product image, px
+JPEG_QUALITY = 85
+MAX_INPUT_BYTES = 30 * 1024 * 1024
+MAX_PIXELS = 50_000_000  # anything bigger is rejected before it is decoded
+
+_EXT = {"jpeg": ".jpg", "png": ".png"}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG chunks that only carry metadata (text, EXIF, timestamp).
+_PNG_METADATA = {b"tEXt", b"zTXt", b"iTXt", b"eXIf", b"tIME"}
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_EXIF_ORIENTATION = 0x0112
+
+
+class ImageRejected(ValueError):
+    """The file is not an image the catalog accepts."""
+
+
+@dataclass
+class IngestResult:
+    path: Path
+    format: str  # "jpeg" or "png"
+    size_in: tuple[int, int]
+    size_out: tuple[int, int]
+    bytes_in: int
+    bytes_out: int
+
+    @property
+    def saved(self) -> int:
+        return self.bytes_in - self.bytes_out
+
+    def summary(self) -> str:
+        dims = f"{self.size_in[0]}×{self.size_in[1]}"
+        if self.size_out != self.size_in:
+            dims += f" → {self.size_out[0]}×{self.size_out[1]}"
+        return (
+            f"{dims}, {_human(self.bytes_in)} → {_human(self.bytes_out)}, "
+            f"сэкономлено {_human(max(self.saved, 0))}"
+        )
+
+
+def _human(n: int) -> str:
+    if n >= 1_000_000:
+        return f"{n / 1_000_000:.2f} МБ"
+    return f"{n / 1000:.0f} КБ" if n >= 1000 else f"{n} Б"
+
+
+def sniff(data: bytes) -> Optional[str]:
+    """Image format by magic bytes, whatever the file is called; None if it is not an image."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if data.startswith(_PNG_SIGNATURE):
+        return "png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:2] == b"BM":
+        return "bmp"
+    return None
+
+
+# --- metadata stripping without decoding ----------------------------------------
+
+def _strip_jpeg(data: bytes) -> tuple[bytes, tuple[int, int]]:
+    """Drop EXIF/XMP/comment segments; keeps JFIF, the ICC profile and Adobe colour info."""
+    out = [data[:2]]
+    size: Optional[tuple[int, int]] = None
+    scan = False
+    pos = 2
+    while pos < len(data):
+        if data[pos] != 0xFF:
+            raise ImageRejected("повреждённый файл JPEG")
+        while pos < len(data) and data[pos] == 0xFF:
+            pos += 1
+        if pos >= len(data):
+            break
+        marker = data[pos]
+        pos += 1
+        if marker == 0xD9 or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            out.append(bytes((0xFF, marker)))
+            continue
+        if pos + 2 > len(data):
+            raise ImageRejected("повреждённый файл JPEG")
+        length = struct.unpack(">H", data[pos:pos + 2])[0]
+        segment = data[pos + 2:pos + length]
+        if marker in _JPEG_SOF and len(segment) >= 5:
+            height, width = struct.unpack(">HH", segment[1:5])
+            size = (width, height)
+        if marker == 0xDA:  # start of scan: the rest is image data
+            if data.rfind(b"\xff\xd9") < pos:  # FF D9 cannot occur inside entropy-coded data, only as EOI
+                raise ImageRejected("файл JPEG обрезан")
+            out.append(b"\xff" + bytes((marker,)) + data[pos:])
+            scan = True
+            break
+        metadata = marker == 0xFE or (
+            0xE1 <= marker <= 0xEF and marker != 0xEE  # APP14 "Adobe" tells decoders the colour transform
+            and not (marker == 0xE2 and segment.startswith(b"ICC_PROFILE\0"))
+        )
+        if not metadata:
+            out.append(b"\xff" + bytes((marker,)) + data[pos:pos + length])
+        pos += length
+    if size is None or not scan:
+        raise ImageRejected("повреждённый файл JPEG")
+    return b"".join(out), size
+
+
+def _strip_png(data: bytes) -> tuple[bytes, tuple[int, int]]:
+    out = [_PNG_SIGNATURE]
+    size: Optional[tuple[int, int]] = None
+    pos = len(_PNG_SIGNATURE)
+    while True:
+        if pos + 8 > len(data):
+            raise ImageRejected("повреждённый файл PNG")
+        length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        end = pos + 12 + length
+        if end > len(data):
+            raise ImageRejected("повреждённый файл PNG")
+        if kind == b"IHDR":
+            size = struct.unpack(">II", data[pos + 8:pos + 16])
+        if kind not in _PNG_METADATA:
+            out.append(data[pos:end])
+        pos = end
+        if kind == b"IEND":
+            break
+    if size is None:
+        raise ImageRejected("повреждённый файл PNG")
+    return b"".join(out), size
+
+
+def strip_metadata(data: bytes, fmt: str) -> tuple[bytes, tuple[int, int]]:
+    """JPEG/PNG without metadata, byte for byte otherwise; also returns the dimensions."""
+    return _strip_jpeg(data) if fmt == "jpeg" else _strip_png(data)
+
+
+# --- re-encoding with PIL ---------------------------------------------------------
+
+def _reencode(data: bytes, fmt: str) -> tuple[bytes, str, tuple[int, int], tuple[int, int]]:
+    """Decode once, orient, downscale to MAX_SIDE and encode as JPEG (or PNG if there is transparency)."""
+    try:
+        img = Image.open(io.BytesIO(data))
+        size_in = img.size
+        if size_in[0] * size_in[1] > MAX_PIXELS:
+            raise ImageRejected(f"слишком большое изображение: {size_in[0]}×{size_in[1]}")
+        img.load()
+    except ImageRejected:
+        raise
+    except Exception as e:  # PIL reports broken and unknown files with a range of exception types
+        raise ImageRejected(f"файл повреждён или не является изображением ({e})") from e
+
+    icc = img.info.get("icc_profile")
+    transposed = img.getexif().get(_EXIF_ORIENTATION, 1) != 1
+    if transposed:
+        img = ImageOps.exif_transpose(img)
+    resized = max(img.size) > MAX_SIDE
+    has_alpha = img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+    extra = {"icc_profile": icc} if icc else {}
+    buf = io.BytesIO()
+    if has_alpha:
+        out_fmt = "png"
+        img = img.convert("RGBA")
+        img.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+        img.save(buf, "PNG", optimize=True, **extra)
+    else:
+        out_fmt = "jpeg"
+        if fmt == "jpeg" and not transposed and not resized:
+            # Same pixels: keep the original quantisation instead of re-quantising.
+            img.save(buf, "JPEG", quality="keep", optimize=True, progressive=True, **extra)
+        else:
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+            img.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True, **extra)
+    return buf.getvalue(), out_fmt, size_in, img.size
+
+
+def ingest_image(src: Path, dest_dir: Path, stem: Optional[str] = None) -> IngestResult:
+    """Validate ``src`` and store a compact, metadata-free copy as ``dest_dir/<stem>.jpg|.png``.
+
+    With PIL the image is decoded once, oriented, downscaled to MAX_SIDE and
+    re-encoded; if that comes out larger than the original stripped of its
+    metadata (an already small, well-compressed file), the stripped original is
+    kept. Without PIL only JPEG and PNG are accepted and stored stripped.
+    Raises ImageRejected for anything that is not an acceptable image.
+    """
+    data = src.read_bytes()
+    if len(data) > MAX_INPUT_BYTES:
+        raise ImageRejected(f"файл больше {_human(MAX_INPUT_BYTES)}")
+    fmt = sniff(data)
+    if fmt is None:
+        raise ImageRejected("файл не является изображением")
+    if Image is None and fmt not in _EXT:
+        raise ImageRejected("поддерживаются только JPEG и PNG")
+
+    if Image is not None:
+        out, out_fmt, size_in, size_out = _reencode(data, fmt)
+        if out_fmt == fmt and size_out == size_in:
+            stripped, _ = strip_metadata(data, fmt)
+            if len(stripped) < len(out):
+                out = stripped
+    else:
+        out, size_in = strip_metadata(data, fmt)
+        out_fmt, size_out = fmt, size_in
+    if size_in[0] * size_in[1] > MAX_PIXELS:
+        raise ImageRejected(f"слишком большое изображение: {size_in[0]}×{size_in[1]}")
+
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    dest = dest_dir / f"{stem or src.stem}{_EXT[out_fmt]}"
+    fd, tmp = tempfile.mkstemp(dir=dest_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(out)
+        os.chmod(tmp, 0o644)  # mkstemp creates the file private to the current user
+        os.replace(tmp, dest)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return IngestResult(dest, out_fmt, size_in, size_out, len(data), len(out))
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import csv
+import io
+import sqlite3
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Sequence
+
+import openpyxl
+
+from db import CompositionError, client_id, parse_composition, parse_date
+
+
+# Same column order as import_data/orders_import.xlsx:
+# Номер заказа, Состав заказа, Дата заказа, Дата доставки, Пункт выдачи,
+# ФИО клиента, Код для получения, Статус заказа
+COLUMNS = 8
+
+_ID_CHUNK = 500
+
+
+@dataclass
+class IntakeResult:
+    orders: int = 0
+    lines: int = 0
+    errors: list[str] = field(default_factory=list)
+
+
+def _is_header(row: Sequence[Any]) -> bool:
+    try:
+        int(str(row[0]).strip())
+        return False
+    except (ValueError, IndexError):
+        return True
+
+
+def _drop_header(rows: Iterable[tuple[int, list]]) -> Iterator[tuple[int, list]]:
+    first = True
+    for line_no, row in rows:
+        if not any(str(v).strip() for v in row if v is not None):
+            continue
+        if first:
+            first = False
+            if _is_header(row):
+                continue
+        yield line_no, row
+
+
+def rows_from_xlsx(path: Path) -> Iterator[tuple[int, list]]:
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = ((i, list(r)) for i, r in enumerate(wb.active.iter_rows(values_only=True), start=1))
+        yield from _drop_header(rows)
+    finally:
+        wb.close()
+
+
+def rows_from_text(text: str) -> Iterator[tuple[int, list]]:
+    """Rows pasted from a spreadsheet (tab-separated) or written as CSV with ';'.
+
+    The composition column contains commas itself, so ',' is only accepted as a
+    delimiter when fields are quoted.
+    """
+    sample = text[:4096]
+    if "\t" in sample:
+        delimiter = "\t"
+    elif ";" in sample:
+        delimiter = ";"
+    else:
+        delimiter = ","
+    reader = csv.reader(io.StringIO(text), delimiter=delimiter)
+    yield from _drop_header((i, row) for i, row in enumerate(reader, start=1))
+
+
+def rows_from_file(path: Path) -> Iterator[tuple[int, list]]:
+    if path.suffix.lower() == ".xlsx":
+        return rows_from_xlsx(path)
+    return rows_from_text(path.read_text(encoding="utf-8-sig"))
+
+
+def _existing_ids(conn: sqlite3.Connection, ids: list[int]) -> set[int]:
+    found: set[int] = set()
+    for i in range(0, len(ids), _ID_CHUNK):
+        chunk = ids[i:i + _ID_CHUNK]
+        marks = ", ".join("?" for _ in chunk)
+        found.update(r[0] for r in conn.execute(f'SELECT id FROM "order" WHERE id IN ({marks})', chunk))
+    return found
+
+
+def intake_orders(conn: sqlite3.Connection, rows: Iterable[tuple[int, list]], dry_run: bool = False) -> IntakeResult:
+    """Validate every row and insert all orders in one transaction, or nothing if any row is bad.
+
+    Article, pickup point and status checks are set lookups against tables
+    loaded once, so the cost is linear in the number of rows.
+    """
+    result = IntakeResult()
+    articles = {r[0] for r in conn.execute("SELECT article FROM product")}
+    points = {r[0] for r in conn.execute("SELECT id FROM pickup_point")}
+    statuses = {r[1]: r[0] for r in conn.execute("SELECT id, name FROM order_status")}
+
+    orders: list[tuple] = []
+    lines: list[tuple] = []
+    seen: dict[int, int] = {}
+    for line_no, row in rows:
+        row = list(row) + [None] * (COLUMNS - len(row))
+        raw_id, composition, order_date, delivery_date, point, client, code, status = row[:COLUMNS]
+        where = f"строка {line_no}"
+        try:
+            order_id = int(str(raw_id).strip())
+        except ValueError:
+            result.errors.append(f"{where}: некорректный номер заказа «{raw_id}»")
+            continue
+        where = f"строка {line_no} (заказ {order_id})"
+        if order_id in seen:
+            result.errors.append(f"{where}: номер уже встречался в строке {seen[order_id]}")
+            continue
+        seen[order_id] = line_no
+
+        try:
+            order_date = parse_date(order_date)
+            delivery_date = parse_date(delivery_date)
+        except ValueError as e:
+            result.errors.append(f"{where}: {e}")
+            continue
+        if delivery_date < order_date:
+            result.errors.append(f"{where}: дата доставки раньше даты заказа")
+            continue
+        try:
+            point_id = int(str(point).strip())
+        except ValueError:
+            point_id = None
+        if point_id not in points:
+            result.errors.append(f"{where}: неизвестный пункт выдачи «{point}»")
+            continue
+        try:
+            pickup_code = int(str(code).strip())
+        except ValueError:
+            result.errors.append(f"{where}: некорректный код для получения «{code}»")
+            continue
+        status_name = str(status or "").strip()
+        if status_name not in statuses:
+            result.errors.append(f"{where}: неизвестный статус «{status_name}»")
+            continue
+        try:
+            items = parse_composition(composition)
+        except CompositionError as e:
+            result.errors.append(f"{where}: состав заказа, {e}")
+            continue
+        unknown = [art for art, _ in items if art not in articles]
+        if unknown:
+            result.errors.append(f"{where}: неизвестные артикулы {', '.join(unknown)}")
+            continue
+
+        client_name = str(client).strip() if client is not None and str(client).strip() else None
+        orders.append((order_id, order_date, delivery_date, point_id, client_name, pickup_code, statuses[status_name]))
+        lines.extend((order_id, art, qty) for art, qty in items)
+
+    for order_id in sorted(_existing_ids(conn, list(seen))):
+        result.errors.append(f"заказ {order_id} уже есть в базе (строка {seen[order_id]})")
+
+    if result.errors:
+        return result
+
+    result.orders = len(orders)
+    result.lines = len(lines)
+    if dry_run:
+        return result
+    with conn:
+        clients: dict[str | None, int | None] = {}
+        for order in orders:
+            if order[4] not in clients:
+                clients[order[4]] = client_id(conn, order[4])
+        conn.executemany(
+            """
+            INSERT INTO "order"(id, order_date, delivery_date, pickup_point_id, client_name, pickup_code, status_id, client_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(*order, clients[order[4]]) for order in orders],
+        )
+        conn.executemany("INSERT INTO order_product(order_id, product_article, quantity) VALUES (?, ?, ?)", lines)
+    return result
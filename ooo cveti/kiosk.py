@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import search
+from db import DB_FILE, DIMENSION_TABLES
+
+
+CHECK_INTERVAL = 10  # seconds between cheap "did the catalog change?" checks
+MAX_AGE = 15 * 60  # rebuild at least this often; replicated changes are not in change_log
+
+# Everything the guest product list reads; users, orders etc. never leave trade.db.
+# The schema is copied from trade.db itself, so the copy always matches products_query.
+_CATALOG_TABLES = (
+    *DIMENSION_TABLES, "product", "product_pair",
+    "search_word", "search_word_trigram", "product_word", "product_search_dirty",
+)
+_CATALOG_VIEWS = ("product_view",)
+
+CatalogVersion = tuple[int, ...]
+
+
+def _copy_catalog(mem: sqlite3.Connection) -> None:
+    names = _CATALOG_TABLES + _CATALOG_VIEWS
+    marks = ", ".join("?" for _ in names)
+    ddl = mem.execute(
+        f"""
+        SELECT type, tbl_name, sql FROM src.sqlite_master
+        WHERE tbl_name IN ({marks}) AND sql IS NOT NULL
+        ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END
+        """,
+        names,
+    ).fetchall()
+    for kind, _name, sql in ddl:
+        if kind in ("table", "index", "view"):
+            mem.execute(sql)
+    for table in _CATALOG_TABLES:
+        mem.execute(f"INSERT INTO main.{table} SELECT * FROM src.{table}")
+
+
+def catalog_version(conn: sqlite3.Connection, schema: str = "main") -> CatalogVersion:
+    """Changes whenever the catalog is edited locally: compare two results for equality only.
+
+    Products are covered by their last change_log entry. The dimension tables
+    are not logged, so their last rowid and row count stand in for them.
+    """
+    row = conn.execute(f"SELECT max(seq) FROM {schema}.change_log WHERE tbl = 'product'").fetchone()
+    version = [int(row[0] or 0)]
+    for table in DIMENSION_TABLES:
+        last, count = conn.execute(f"SELECT max(rowid), count(*) FROM {schema}.{table}").fetchone()
+        version += [int(last or 0), int(count)]
+    return tuple(version)
+
+
+def build_snapshot(db_path: Path = DB_FILE) -> tuple[bytes, CatalogVersion]:
+    """Copy the catalog of ``db_path`` into a fresh in-memory database; returns it serialized, with its version.
+
+    The copy and the version are read in one read transaction, so the snapshot
+    is consistent. The bytes can be handed to another thread and loaded with
+    Connection.deserialize there.
+    """
+    mem = sqlite3.connect(":memory:", uri=True)
+    try:
+        mem.execute("ATTACH DATABASE ? AS src", (db_path.resolve().as_uri() + "?mode=ro",))
+        mem.execute("BEGIN")
+        version = catalog_version(mem, "src")
+        _copy_catalog(mem)
+        mem.execute("COMMIT")
+        mem.execute("DETACH DATABASE src")
+        with mem:
+            search.refresh_index(mem)  # the copy is writable until it is serialized
+        return mem.serialize(), version
+    finally:
+        mem.close()
+
+
+def _snapshot_connection(data: bytes) -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    conn.deserialize(data)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+class KioskCatalog:
+    """Read-only in-memory copy of the catalog for guest terminals.
+
+    Guest queries run against the copy and never touch trade.db. The copy is
+    rebuilt in a background thread when the catalog changed or it is older than
+    MAX_AGE, and swapped in by ``poll()`` on the UI thread.
+    """
+
+    def __init__(self, db_path: Path = DB_FILE, snapshot: Optional[tuple[bytes, CatalogVersion]] = None) -> None:
+        # ``snapshot`` is a build_snapshot() result made off the UI thread; without it the copy is built here.
+        self.db_path = db_path
+        data, self.version = snapshot if snapshot is not None else build_snapshot(db_path)
+        self.conn = _snapshot_connection(data)
+        self.loaded_at = time.monotonic()
+        self._checked_at = self.loaded_at
+        self._ready: Optional[tuple[bytes, CatalogVersion]] = None
+        self.error: Optional[Exception] = None
+        self._worker: Optional[threading.Thread] = None
+
+    def poll(self) -> bool:
+        """Call from the UI thread on a timer. True means a new copy was swapped in."""
+        ready, self._ready = self._ready, None
+        if ready is not None:
+            data, self.version = ready
+            old, self.conn = self.conn, _snapshot_connection(data)
+            old.close()
+            self.loaded_at = time.monotonic()
+            return True
+
+        now = time.monotonic()
+        if self._worker is None or not self._worker.is_alive():
+            if now - self._checked_at >= CHECK_INTERVAL:
+                self._checked_at = now
+                force = now - self.loaded_at >= MAX_AGE
+                self._worker = threading.Thread(target=self._rebuild, args=(force,), name="kiosk", daemon=True)
+                self._worker.start()
+        return False
+
+    def _rebuild(self, force: bool) -> None:
+        try:
+            if not force:
+                conn = sqlite3.connect(self.db_path)
+                try:
+                    if catalog_version(conn) == self.version:
+                        return
+                finally:
+                    conn.close()
+            self._ready = build_snapshot(self.db_path)
+            self.error = None
+        except sqlite3.Error as e:
+            self.error = e  # keep serving the old copy; the next poll tries again
@@ -0,0 +1,539 @@
+from __future__ import annotations
+
+import json
+import random
+import sqlite3
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
+
+import analytics
+from db import (
+    DB_FILE,
+    ORDER_SORT_COLUMNS,
+    PRODUCT_SORT_COLUMNS,
+    SORT_QTY_ASC,
+    SORT_QTY_DESC,
+    SORT_QTY_NONE,
+    dimension_names,
+    get_conn,
+    orders_query,
+    products_query,
+    save_order,
+)
+
+
+# What a clerk does, in the proportions of an ordinary shop day.
+DEFAULT_MIX = "browse=40,search=25,orders=15,open_order=10,edit_order=8,new_order=2"
+DEFAULT_WORKERS = 4
+DEFAULT_SECONDS = 10.0
+THINK_TIME = 0.5  # seconds; mean pause between two actions of one clerk
+START_DELAY = 1.0  # seconds; lets every worker process start before the clock runs
+ORDER_SAMPLE = 5000  # orders a worker picks from for opening and editing
+NEW_ORDER_BASE = 1_000_000_000  # ids of orders created by the test; each worker gets its own range
+NEW_ORDER_RANGE = 1_000_000
+
+OK = "ok"
+REJECTED = "rejected"  # save_order refused (an id taken, an unknown article), as the form would show it
+LOCKED = "locked"  # "database is locked" / "busy": what clerks see when the workstations get in each other's way
+ERROR = "error"
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    """"browse=5,search=3" -> {"browse": 5.0, "search": 3.0}; raises ValueError on unknown operations."""
+    mix: dict[str, float] = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Неизвестная операция: {name!r} (есть: {', '.join(OPERATIONS)})")
+        mix[name] = float(weight) if weight.strip() else 1.0
+        if mix[name] < 0:
+            raise ValueError(f"Отрицательный вес операции {name!r}")
+    if not any(mix.values()):
+        raise ValueError("В смеси операций нет ни одной операции с ненулевым весом")
+    return mix
+
+
+# --- operations -------------------------------------------------------------------
+# Each operation runs what the page runs, on its own connection like a page's
+# background task: the product list query, the orders query, loading an order
+# into OrderEditPage, and OrderEditPage.save through db.save_order. ``args`` is
+# everything the clerk typed, so a recorded action replays exactly.
+
+def _browse(conn: sqlite3.Connection, args: dict) -> Optional[str]:
+    sql, params = products_query("", args["supplier"], args["sort"], order=[tuple(k) for k in args["order"]])
+    conn.execute(sql, params).fetchall()
+    dimension_names(conn, "supplier")
+    return None
+
+
+def _search(conn: sqlite3.Connection, args: dict) -> Optional[str]:
+    sql, params = products_query(args["text"], args["supplier"])
+    conn.execute(sql, params).fetchall()
+    return None
+
+
+def _orders(conn: sqlite3.Connection, args: dict) -> Optional[str]:
+    filters = dict(args, order=[tuple(k) for k in args["order"]])
+    sql, params = orders_query(**filters)
+    conn.execute(sql, params).fetchall()
+    return None
+
+
+def _open_order(conn: sqlite3.Connection, args: dict) -> Optional[str]:
+    conn.execute("SELECT id, address FROM pickup_point ORDER BY id").fetchall()
+    conn.execute("SELECT name FROM order_status ORDER BY id").fetchall()
+    conn.execute(
+        'SELECT o.*, s.name AS status FROM "order" o JOIN order_status s ON s.id = o.status_id WHERE o.id=?',
+        (args["id"],),
+    ).fetchone()
+    conn.execute("SELECT product_article, quantity FROM order_product WHERE order_id=?", (args["id"],)).fetchall()
+    return None
+
+
+def _save_order(editing: bool) -> Callable[[sqlite3.Connection, dict], Optional[str]]:
+    def run(conn: sqlite3.Connection, args: dict) -> Optional[str]:
+        err = save_order(
+            conn, args["id"], editing, args["status"], args["order_date"], args["delivery_date"],
+            args["pickup_point_id"], args["client"], args["pickup_code"], [tuple(i) for i in args["items"]],
+        )
+        if err is None:
+            analytics.refresh_sales(conn)  # as OrderEditPage.save does
+        return err
+    return run
+
+
+OPERATIONS: dict[str, Callable[[sqlite3.Connection, dict], Optional[str]]] = {
+    "browse": _browse,
+    "search": _search,
+    "orders": _orders,
+    "open_order": _open_order,
+    "edit_order": _save_order(True),
+    "new_order": _save_order(False),
+}
+
+
+def _is_lock_error(e: sqlite3.OperationalError) -> bool:
+    text = str(e).lower()
+    return "locked" in text or "busy" in text
+
+
+def run_action(db_path: Path, op: str, args: dict, timeout: float) -> str:
+    """One action on a fresh connection, committed like a page's task; returns its outcome (OK, LOCKED, ...)."""
+    try:
+        with closing(get_conn(db_path)) as conn:
+            conn.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+            with conn:
+                err = OPERATIONS[op](conn, args)
+        return OK if err is None else REJECTED
+    except sqlite3.OperationalError as e:
+        return LOCKED if _is_lock_error(e) else ERROR
+    except sqlite3.Error:
+        return ERROR
+
+
+# --- generating actions -------------------------------------------------------------
+
+@dataclass
+class _Catalog:
+    """What a worker picks its actions from, read once when it starts."""
+
+    articles: list[str]
+    words: list[str]
+    suppliers: list[str]
+    statuses: list[tuple[int, str]]
+    points: list[int]
+    clients: list[str]
+    orders: list[int]
+    first_day: date
+    last_day: date
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection) -> _Catalog:
+        names = conn.execute("SELECT article, name FROM product").fetchall()
+        words = sorted({w.lower() for _, name in names for w in str(name).split() if len(w) >= 3})
+        days = conn.execute('SELECT min(delivery_date), max(delivery_date) FROM "order"').fetchone()
+        today = date.today()
+        return cls(
+            articles=[r[0] for r in names],
+            words=words or ["роза"],
+            suppliers=dimension_names(conn, "supplier"),
+            statuses=[(r[0], r[1]) for r in conn.execute("SELECT id, name FROM order_status ORDER BY id")],
+            points=[r[0] for r in conn.execute("SELECT id FROM pickup_point ORDER BY id")],
+            clients=[r[0] for r in conn.execute(
+                'SELECT DISTINCT client_name FROM "order" WHERE client_name IS NOT NULL LIMIT 1000'
+            )],
+            orders=[r[0] for r in conn.execute(
+                'SELECT id FROM "order" WHERE id < ? ORDER BY random() LIMIT ?', (NEW_ORDER_BASE, ORDER_SAMPLE)
+            )],
+            first_day=date.fromisoformat(days[0]) if days[0] else today,
+            last_day=date.fromisoformat(days[1]) if days[1] else today,
+        )
+
+
+class _Clerk:
+    """Makes up the next action of one simulated clerk."""
+
+    def __init__(self, catalog: _Catalog, worker: int, rng: random.Random) -> None:
+        self.catalog = catalog
+        self.rng = rng
+        self.next_id = NEW_ORDER_BASE + worker * NEW_ORDER_RANGE
+
+    def _sort(self, columns: Iterable[str]) -> list[list]:
+        if self.rng.random() < 0.5:
+            return []
+        return [[self.rng.choice(sorted(columns)), self.rng.random() < 0.5]]
+
+    def _supplier(self) -> str:
+        c = self.catalog
+        return self.rng.choice(c.suppliers) if c.suppliers and self.rng.random() < 0.3 else ""
+
+    def _items(self, current: list[tuple[str, int]]) -> list[list]:
+        # Change one quantity, sometimes add a product or drop one, never leave the order empty.
+        items = dict(current)
+        arts = self.catalog.articles
+        if items and self.rng.random() < 0.7:
+            art = self.rng.choice(sorted(items))
+            items[art] = max(1, items[art] + self.rng.choice((-1, 1, 2)))
+        if arts and (not items or self.rng.random() < 0.3):
+            items[self.rng.choice(arts)] = self.rng.randint(1, 5)
+        if len(items) > 1 and self.rng.random() < 0.2:
+            del items[self.rng.choice(sorted(items))]
+        return [[a, q] for a, q in items.items()]
+
+    def possible(self, op: str) -> bool:
+        """Whether this database has anything to do ``op`` on at all."""
+        c = self.catalog
+        if op in ("open_order", "edit_order"):
+            return bool(c.orders)
+        if op == "new_order":
+            return bool(c.statuses and c.points)
+        return True
+
+    def action(self, conn: sqlite3.Connection, op: str) -> Optional[dict]:
+        """Arguments for ``op``; None when there is nothing to do it on (no orders to open, say)."""
+        c, rng = self.catalog, self.rng
+        if op == "browse":
+            return {
+                "supplier": self._supplier(),
+                "sort": rng.choice((SORT_QTY_NONE, SORT_QTY_NONE, SORT_QTY_ASC, SORT_QTY_DESC)),
+                "order": self._sort(PRODUCT_SORT_COLUMNS),
+            }
+        if op == "search":
+            word = rng.choice(c.words)
+            if rng.random() < 0.25:
+                word = word[:2]  # short queries take the plain substring path
+            return {"text": word, "supplier": self._supplier()}
+        if op == "orders":
+            span = max((c.last_day - c.first_day).days, 0)
+            start = c.first_day + timedelta(days=rng.randint(0, span))
+            return {
+                "status_id": rng.choice(c.statuses)[0] if c.statuses and rng.random() < 0.5 else None,
+                "pickup_point_id": rng.choice(c.points) if c.points and rng.random() < 0.3 else None,
+                "date_field": rng.choice(("order_date", "delivery_date")),
+                "date_from": start.isoformat() if rng.random() < 0.5 else None,
+                "date_to": (start + timedelta(days=30)).isoformat() if rng.random() < 0.5 else None,
+                "order": self._sort(ORDER_SORT_COLUMNS),
+            }
+        if op == "open_order":
+            return {"id": rng.choice(c.orders)} if c.orders else None
+        if op == "edit_order":
+            if not c.orders:
+                return None
+            # The clerk opens the order first; that read is not part of the timed save.
+            order_id = rng.choice(c.orders)
+            row = conn.execute(
+                'SELECT o.*, s.name AS status FROM "order" o JOIN order_status s ON s.id = o.status_id WHERE o.id=?',
+                (order_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            items = conn.execute(
+                "SELECT product_article, quantity FROM order_product WHERE order_id=?", (order_id,)
+            ).fetchall()
+            return {
+                "id": order_id,
+                "status": rng.choice(c.statuses)[1] if c.statuses and rng.random() < 0.3 else row["status"],
+                "order_date": row["order_date"],
+                "delivery_date": row["delivery_date"],
+                "pickup_point_id": row["pickup_point_id"],
+                "client": row["client_name"],
+                "pickup_code": row["pickup_code"],
+                "items": self._items([(r[0], r[1]) for r in items]),
+            }
+        if op == "new_order":
+            if not (c.statuses and c.points):
+                return None
+            self.next_id += 1
+            today = date.today()
+            return {
+                "id": self.next_id,
+                "status": c.statuses[0][1],
+                "order_date": today.isoformat(),
+                "delivery_date": (today + timedelta(days=rng.randint(1, 7))).isoformat(),
+                "pickup_point_id": rng.choice(c.points),
+                "client": rng.choice(c.clients) if c.clients else None,
+                "pickup_code": rng.randint(100, 999),
+                "items": self._items([]),
+            }
+        raise ValueError(f"Неизвестная операция: {op!r}")
+
+
+# --- workers ------------------------------------------------------------------------
+
+@dataclass
+class _WorkerResult:
+    samples: list[tuple[str, str, float]] = field(default_factory=list)  # (op, outcome, seconds)
+    actions: list[dict] = field(default_factory=list)  # what was done, when recording
+
+
+def _wait_until(at: float) -> None:
+    delay = at - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _timed(db_path: Path, op: str, args: dict, timeout: float, result: _WorkerResult) -> None:
+    started = time.perf_counter()
+    outcome = run_action(db_path, op, args, timeout)
+    result.samples.append((op, outcome, time.perf_counter() - started))
+
+
+def _mix_worker(
+    db_path: str, start_at: float, worker: int, mix: dict[str, float], seconds: Optional[float],
+    ops: Optional[int], think: float, timeout: float, seed: Optional[int], record: bool,
+) -> _WorkerResult:
+    # Runs in a worker process: one simulated clerk, no shared state with the others.
+    rng = random.Random(None if seed is None else seed * 1000 + worker)
+    path = Path(db_path)
+    with closing(get_conn(path)) as conn:
+        clerk = _Clerk(_Catalog.load(conn), worker, rng)
+        mix = {op: w for op, w in mix.items() if w > 0 and clerk.possible(op)}
+        if not mix:
+            raise ValueError("Ни одну операцию смеси не на чем выполнить: в базе нет заказов, статусов или пунктов выдачи")
+        names, weights = list(mix), list(mix.values())
+        result = _WorkerResult()
+        _wait_until(start_at)
+        done = 0
+        while (ops is None or done < ops) and (seconds is None or time.time() - start_at < seconds):
+            op = rng.choices(names, weights)[0]
+            args = clerk.action(conn, op)
+            if args is None:
+                done += 1  # the order was deleted meanwhile: an action all the same, just not timed
+                continue
+            if record:
+                result.actions.append({"t": round(time.time() - start_at, 4), "worker": worker, "op": op, "args": args})
+            _timed(path, op, args, timeout, result)
+            done += 1
+            if think > 0:
+                time.sleep(rng.expovariate(1 / think))
+    return result
+
+
+def _replay_worker(db_path: str, start_at: float, actions: list[dict], speed: float, timeout: float) -> _WorkerResult:
+    path = Path(db_path)
+    result = _WorkerResult()
+    for action in actions:
+        _wait_until(start_at + action["t"] / speed)
+        _timed(path, action["op"], action["args"], timeout, result)
+    return result
+
+
+# --- report -------------------------------------------------------------------------
+
+def _percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+@dataclass
+class OpStats:
+    op: str
+    count: int
+    ok: int
+    rejected: int
+    locked: int
+    errors: int
+    per_second: float
+    p50_ms: float
+    p99_ms: float
+    max_ms: float
+
+    @property
+    def lock_rate(self) -> float:
+        return self.locked / self.count if self.count else 0.0
+
+
+@dataclass
+class LoadReport:
+    workers: int
+    seconds: float
+    ops: list[OpStats]
+
+    def summary(self) -> str:
+        lines = [
+            f"Процессов: {self.workers}, {self.seconds:.1f} с",
+            f"{'операция':<12} {'всего':>7} {'оп/с':>8} {'p50 мс':>8} {'p99 мс':>8} {'макс мс':>8} "
+            f"{'блокир.':>8} {'отказ':>6} {'ошибки':>6}",
+        ]
+        for s in self.ops:
+            lines.append(
+                f"{s.op:<12} {s.count:>7} {s.per_second:>8.1f} {s.p50_ms:>8.1f} {s.p99_ms:>8.1f} {s.max_ms:>8.1f} "
+                f"{s.lock_rate:>7.1%} {s.rejected:>6} {s.errors:>6}"
+            )
+        return "\n".join(lines)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "seconds": self.seconds,
+            "ops": [dict(vars(s), lock_rate=s.lock_rate) for s in self.ops],
+        }
+
+
+def _op_stats(op: str, samples: list[tuple[str, float]], seconds: float) -> OpStats:
+    # Latency counts every attempt, failed ones included: a lock error costs the clerk the whole busy timeout.
+    times = sorted(t * 1000 for _, t in samples)
+    outcomes = [o for o, _ in samples]
+    return OpStats(
+        op=op,
+        count=len(samples),
+        ok=outcomes.count(OK),
+        rejected=outcomes.count(REJECTED),
+        locked=outcomes.count(LOCKED),
+        errors=outcomes.count(ERROR),
+        per_second=len(samples) / seconds if seconds else 0.0,
+        p50_ms=_percentile(times, 50),
+        p99_ms=_percentile(times, 99),
+        max_ms=times[-1] if times else 0.0,
+    )
+
+
+def _report(workers: int, seconds: float, results: list[_WorkerResult]) -> LoadReport:
+    by_op: dict[str, list[tuple[str, float]]] = defaultdict(list)
+    for r in results:
+        for op, outcome, t in r.samples:
+            by_op[op].append((outcome, t))
+    stats = [_op_stats(op, by_op[op], seconds) for op in OPERATIONS if op in by_op]
+    stats.append(_op_stats("всего", [s for op in by_op for s in by_op[op]], seconds))
+    return LoadReport(workers, seconds, stats)
+
+
+# --- entry points -------------------------------------------------------------------
+
+def _scratch_copy(db_path: Path, directory: str) -> Path:
+    """Consistent copy of ``db_path`` made with the online backup API, so a test never touches the real data."""
+    copy = Path(directory) / "loadtest.db"
+    with closing(sqlite3.connect(db_path)) as src, closing(sqlite3.connect(copy)) as dst:
+        src.backup(dst)
+    return copy
+
+
+def _run(db_path: Path, in_place: bool, jobs: list[tuple[Callable, tuple]]) -> tuple[float, list[_WorkerResult]]:
+    # Every job is fn(db_path, start_at, *args); all of them start on the same wall clock second.
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as tmp:
+        target = str(db_path if in_place else _scratch_copy(db_path, tmp))
+        with ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+            start_at = time.time() + START_DELAY
+            futures = [pool.submit(fn, target, start_at, *args) for fn, args in jobs]
+            results = [f.result() for f in futures]
+        return time.time() - start_at, results
+
+
+def run_load(
+    db_path: Path = DB_FILE,
+    workers: int = DEFAULT_WORKERS,
+    mix: Optional[dict[str, float]] = None,
+    seconds: Optional[float] = DEFAULT_SECONDS,
+    ops: Optional[int] = None,
+    think: float = THINK_TIME,
+    timeout: float = 5.0,
+    seed: Optional[int] = None,
+    record: Optional[Path] = None,
+    in_place: bool = False,
+) -> LoadReport:
+    """``workers`` processes act as clerks sharing ``db_path``, each picking actions from ``mix``.
+
+    Every action runs the same queries and writes as the application pages, on
+    its own connection with a ``timeout`` second busy timeout, as the pages'
+    background tasks do. Each clerk stops after ``seconds`` or ``ops`` actions,
+    whichever comes first, and pauses ``think`` seconds on average between
+    actions (0 for flat out). By default the run is against a scratch copy of
+    the database; ``in_place`` runs against the file itself. ``record`` writes
+    every action to a JSONL log that replay_log can play back.
+    """
+    if workers < 1:
+        raise ValueError("Нужен хотя бы один процесс")
+    mix = mix or parse_mix(DEFAULT_MIX)
+    jobs = [
+        (_mix_worker, (w, mix, seconds, ops, think, timeout, seed, record is not None))
+        for w in range(workers)
+    ]
+    elapsed, results = _run(db_path, in_place, jobs)
+    if record is not None:
+        actions = sorted((a for r in results for a in r.actions), key=lambda a: a["t"])
+        with open(record, "w", encoding="utf-8") as f:
+            for a in actions:
+                f.write(json.dumps(a, ensure_ascii=False) + "\n")
+    return _report(workers, elapsed, results)
+
+
+def read_log(path: Path) -> list[dict]:
+    """Actions of a recorded log, checked; raises ValueError on a line that is not an action."""
+    actions = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                a = json.loads(line)
+                ok = a["op"] in OPERATIONS and isinstance(a["args"], dict) and float(a["t"]) >= 0
+                int(a["worker"])
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"{path}, строка {n}: не действие ({e})") from e
+            if not ok:
+                raise ValueError(f"{path}, строка {n}: неизвестная операция или неверное время")
+            actions.append(a)
+    return actions
+
+
+def replay_log(
+    log: Path,
+    db_path: Path = DB_FILE,
+    workers: Optional[int] = None,
+    speed: float = 1.0,
+    timeout: float = 5.0,
+    in_place: bool = False,
+) -> LoadReport:
+    """Play a recorded action log back with its original timing (``speed`` 2 is twice as fast).
+
+    Each recorded clerk is one process; ``workers`` folds them onto fewer
+    (round robin). A clerk's actions always stay in one process, in order, so
+    there can be no more processes than recorded clerks. A process that falls
+    behind the log runs its next action at once.
+    """
+    if speed <= 0 or (workers is not None and workers < 1):
+        raise ValueError("Скорость и число процессов должны быть положительными")
+    actions = read_log(log)
+    if not actions:
+        raise ValueError(f"{log}: в журнале нет действий")
+    clerks = {w: i for i, w in enumerate(sorted({int(a["worker"]) for a in actions}))}
+    if workers is not None and workers > len(clerks):
+        raise ValueError(f"{log}: в журнале продавцов {len(clerks)}, процессов не может быть больше")
+    n = workers or len(clerks)
+    lanes: list[list[dict]] = [[] for _ in range(n)]
+    for a in sorted(actions, key=lambda a: float(a["t"])):
+        lanes[clerks[int(a["worker"])] % n].append(a)
+    jobs = [(_replay_worker, (lane, speed, timeout)) for lane in lanes]
+    elapsed, results = _run(db_path, in_place, jobs)
+    return _report(len(jobs), elapsed, results)
@@ -2,18 +2,48 @@
 from __future__ import annotations
 
 import os
+import sqlite3
 import tkinter as tk
+from datetime import date
 from tkinter import ttk, messagebox, filedialog
 from pathlib import Path
-from typing import Optional
-
+from typing import Any, Callable, Optional
+
+import analytics
+import backup
+import export
+import forecast
+import images
+import intake
+import kiosk
+import maintenance
+import search
+import tasks
 from db import (
+    ALL_SUPPLIERS,
     APP_ROOT,
     ASSETS_PRODUCTS_DIR,
+    SORT_QTY_ASC,
+    SORT_QTY_DESC,
+    SORT_QTY_NONE,
     AuthUser,
+    CompositionError,
+    DimensionCache,
+    SortKey,
     authenticate,
+    branches_from_paths,
+    client_history,
+    dimension_names,
+    federated_query,
+    find_clients,
     get_conn,
     init_db_if_needed,
+    orders_query,
+    parse_composition,
+    parse_date,
+    products_query,
+    related_products,
+    save_order,
 )
 
 try:
@@ -24,6 +54,10 @@ except Exception:
 
 
 PLACEHOLDER_IMG = APP_ROOT / "assets" / "ui" / "picture.png"
+BACKUP_INTERVAL = 4 * 60 * 60  # seconds between automatic snapshots
+KIOSK_POLL_MS = 2000  # guest catalog: how often to swap in / ask for a fresh in-memory copy
+MAINTENANCE_POLL_MS = 60 * 1000  # how often the App checks whether idle maintenance is due
+BRANCHES_FILE = APP_ROOT / "branches.txt"  # branch trade.db paths for the head-office screen, one per line
 
 print('База данных ипортирована.')
 
@@ -31,6 +65,130 @@ def discounted_price(cost: float, discount: int) -> float:
     return round(cost * (1 - discount / 100.0), 2)
 
 
+def validate_product(fields: dict[str, str]) -> Optional[str]:
+    """First problem with the product form fields in ``fields`` (raw text), or None.
+
+    Shared by ProductEditPage and grid editing on ProductListPage; fields that
+    are not in ``fields`` are not checked.
+    """
+    if "name" in fields and not fields["name"].strip():
+        return "Не заполнено поле «Наименование»."
+    if "cost" in fields:
+        try:
+            cost = float(fields["cost"].strip())
+            if cost < 0:
+                return "Стоимость не может быть отрицательной."
+        except Exception:
+            return "Некорректная стоимость."
+    if "quantity" in fields:
+        try:
+            qty = int(fields["quantity"].strip())
+            if qty < 0:
+                return "Количество не может быть отрицательным."
+        except Exception:
+            return "Некорректное количество."
+    for key, label in [("discount", "Действующая скидка"), ("max_discount", "Макс. скидка")]:
+        if key in fields:
+            try:
+                v = int(fields[key].strip())
+                if v < 0 or v > 100:
+                    return f"Поле «{label}» должно быть в диапазоне 0..100."
+            except Exception:
+                return f"Некорректное значение в поле «{label}»."
+    return None
+
+
+def error_box(text: str, parent: Optional[tk.Misc] = None) -> Callable[[Exception], None]:
+    """on_error callback for the task runner: shows ``text: <exception>``."""
+    def show(e: Exception) -> None:
+        messagebox.showerror("Ошибка", f"{text}: {e}", parent=parent)
+    return show
+
+
+def start_export(app: App, dest: Path, sql: str, params: list, columns) -> None:
+    """Runs export.export_query on the app's task runner; progress and cancel are in the status bar."""
+    def work(task: tasks.Task) -> int:
+        return export.export_query(
+            dest, sql, params, columns, progress=lambda rows: task.report(f"{rows} строк"), cancel=task.cancel_event
+        )
+
+    app.tasks.submit(
+        "Экспорт",
+        work,
+        on_done=lambda rows: messagebox.showinfo("Экспорт", f"Выгружено строк: {rows}\n{dest}"),
+        on_error=error_box("Не удалось выполнить экспорт"),
+    )
+
+
+def ask_export_path(initial_name: str) -> Optional[Path]:
+    path = filedialog.asksaveasfilename(
+        title="Сохранить как",
+        initialfile=initial_name,
+        defaultextension=".xlsx",
+        filetypes=[("Excel files", "*.xlsx"), ("CSV files", "*.csv")],
+    )
+    return Path(path) if path else None
+
+
+class HeaderSort:
+    """Server-side sorting by Treeview column headers.
+
+    A click sorts by the column, clicking it again reverses and then clears it;
+    shift-click adds the column as the next key, or flips / drops it. Only
+    keeps the sort keys and the header arrows: the page passes ``keys`` to its
+    query builder, so rows come back from SQL already in order.
+    """
+
+    ARROWS = {False: "▲", True: "▼"}
+
+    def __init__(self, tree: ttk.Treeview, fields: dict[str, str], on_change: Callable[[], None]) -> None:
+        # ``fields`` maps tree column ids to the query's sort fields; other columns are not sortable.
+        self.tree = tree
+        self.fields = fields
+        self.on_change = on_change
+        self.titles = {col: tree.heading(col, "text") for col in fields}
+        self.keys: list[SortKey] = []
+        tree.bind("<Button-1>", self._clicked, add="+")
+
+    def _clicked(self, event: tk.Event) -> None:
+        if self.tree.identify_region(event.x, event.y) != "heading":
+            return
+        field = self.fields.get(self.tree.column(self.tree.identify_column(event.x), "id"))
+        if field is not None:
+            self.toggle(field, additive=bool(event.state & 0x0001))  # Shift
+
+    def toggle(self, field: str, additive: bool = False) -> None:
+        current = dict(self.keys)
+        if additive:
+            if field not in current:
+                self.keys.append((field, False))
+            elif not current[field]:
+                self.keys = [(f, True if f == field else d) for f, d in self.keys]
+            else:
+                self.keys = [(f, d) for f, d in self.keys if f != field]
+        elif self.keys == [(field, False)]:
+            self.keys = [(field, True)]
+        elif self.keys == [(field, True)]:
+            self.keys = []
+        else:
+            self.keys = [(field, False)]
+        self._show()
+        self.on_change()
+
+    def clear(self) -> None:
+        self.keys = []
+        self._show()
+
+    def _show(self) -> None:
+        position = {f: i for i, (f, _) in enumerate(self.keys)}
+        for col, field in self.fields.items():
+            text = self.titles[col]
+            if field in position:
+                i = position[field]
+                text += f" {self.ARROWS[self.keys[i][1]]}" + (str(i + 1) if len(self.keys) > 1 else "")
+            self.tree.heading(col, text=text)
+
+
 class App(tk.Tk):
     def __init__(self) -> None:
         super().__init__()
@@ -39,18 +197,76 @@ class App(tk.Tk):
         self.minsize(980, 600)
 
         self.current_user: Optional[AuthUser] = None
+        self.kiosk: Optional[kiosk.KioskCatalog] = None
+        self.tasks = tasks.TaskRunner(self)
+        self.forecast = forecast.ForecastCache()
 
+        tasks.TaskStatusBar(self, self.tasks).pack(side="bottom", fill="x")
         container = ttk.Frame(self)
         container.pack(fill="both", expand=True)
 
         self.frames: dict[type[ttk.Frame], ttk.Frame] = {}
-        for F in (LoginPage, ProductListPage, ProductEditPage, OrdersPage, OrderEditPage):
+        for F in (LoginPage, ProductListPage, ProductEditPage, OrdersPage, OrderEditPage, ClientHistoryPage, ReportsPage,
+                  BranchStockPage):
             frame = F(parent=container, app=self)
             self.frames[F] = frame
             frame.grid(row=0, column=0, sticky="nsew")
 
         self.show(LoginPage)
 
+        self.maintenance = maintenance.MaintenanceScheduler(on_done=self.report_maintenance)
+        for event in ("<Any-KeyPress>", "<Any-ButtonPress>", "<Motion>"):
+            self.bind_all(event, lambda _e: self.maintenance.touch(), add="+")
+        self.after(MAINTENANCE_POLL_MS, self._maintenance_tick)
+
+    def report_backup(self, stats: Optional[backup.BackupStats], err: Optional[Exception]) -> None:
+        # Called from the backup thread: notify() only queues the text for the UI thread.
+        # The details of every run are in backup.log next to the snapshots.
+        if err:
+            self.tasks.notify(f"Резервная копия не создана: {err}")
+        else:
+            self.tasks.notify(f"Резервная копия создана: {stats.path.name}")
+
+    def report_maintenance(self, stats: Optional[maintenance.MaintenanceStats], err: Optional[Exception]) -> None:
+        # Called from the maintenance thread; the details of every run are in maintenance.log.
+        if err:
+            self.tasks.notify(f"Обслуживание базы не выполнено: {err}")
+        elif not stats.ok:
+            self.tasks.notify(f"Обслуживание базы: проверка нашла ошибки: {stats.check}")
+        else:
+            self.tasks.notify("Обслуживание базы выполнено.")
+
+    def start_kiosk(self) -> None:
+        """Serve guest browsing from an in-memory catalog copy once it is built."""
+        if self.kiosk is None:
+            self.tasks.submit(
+                "Подготовка каталога",
+                lambda _task: kiosk.build_snapshot(),
+                on_done=self._kiosk_ready,
+                # Guests still browse the live database, so a status bar note is enough here.
+                on_error=lambda e: self.tasks.notify(f"Каталог для гостей не подготовлен: {e}"),
+                key="kiosk",
+            )
+
+    def _kiosk_ready(self, snapshot: tuple[bytes, kiosk.CatalogVersion]) -> None:
+        # The connection is opened here, on the UI thread that will use it.
+        if self.kiosk is None:
+            self.kiosk = kiosk.KioskCatalog(snapshot=snapshot)
+            self.after(KIOSK_POLL_MS, self._kiosk_tick)
+            if self.current_user is None:
+                page: ProductListPage = self.frames[ProductListPage]  # type: ignore[assignment]
+                page.refresh()
+
+    def _kiosk_tick(self) -> None:
+        if self.current_user is None and self.kiosk.poll():
+            page: ProductListPage = self.frames[ProductListPage]  # type: ignore[assignment]
+            page.refresh()
+        self.after(KIOSK_POLL_MS, self._kiosk_tick)
+
+    def _maintenance_tick(self) -> None:
+        self.maintenance.tick()
+        self.after(MAINTENANCE_POLL_MS, self._maintenance_tick)
+
     def show(self, frame_cls: type[ttk.Frame]) -> None:
         frame = self.frames[frame_cls]
         if hasattr(frame, "on_show"):
@@ -112,7 +328,16 @@ class LoginPage(ttk.Frame):
         ent_login.focus_set()
 
     def do_login(self) -> None:
-        user = authenticate(self.var_login.get(), self.var_pass.get())
+        login, password = self.var_login.get(), self.var_pass.get()
+        self.app.tasks.submit(
+            "Вход",
+            lambda _task: authenticate(login, password),
+            on_done=self._logged_in,
+            on_error=error_box("Не удалось выполнить вход"),
+            key="login",
+        )
+
+    def _logged_in(self, user: Optional[AuthUser]) -> None:
         if not user:
             messagebox.showerror("Ошибка авторизации", "Неверный логин или пароль.")
             return
@@ -121,10 +346,16 @@ class LoginPage(ttk.Frame):
 
     def go_guest(self) -> None:
         self.app.current_user = None
+        self.app.start_kiosk()
         self.app.show(ProductListPage)
 
 
 class ProductListPage(ttk.Frame):
+    # Grid editing: tree column -> product column, and how its text is parsed and shown.
+    GRID_FIELDS = {"cost": "cost", "disc": "discount", "qty": "quantity"}
+    GRID_PARSE = {"cost": float, "discount": int, "quantity": int}
+    GRID_FORMAT = {"cost": "{:.2f}", "discount": "{}", "quantity": "{}"}
+
     def __init__(self, parent: ttk.Frame, app: App):
         super().__init__(parent)
         self.app = app
@@ -141,14 +372,14 @@ class ProductListPage(ttk.Frame):
         ent_search.grid(row=0, column=1, padx=6)
 
         ttk.Label(controls, text="Поставщик:").grid(row=0, column=2, sticky="w", padx=(10, 0))
-        self.var_supplier = tk.StringVar(value="Все поставщики")
+        self.var_supplier = tk.StringVar(value=ALL_SUPPLIERS)
         self.cmb_supplier = ttk.Combobox(controls, textvariable=self.var_supplier, width=28, state="readonly")
         self.cmb_supplier.grid(row=0, column=3, padx=6)
 
         ttk.Label(controls, text="Сортировка по остатку:").grid(row=0, column=4, sticky="w", padx=(10, 0))
-        self.var_sort = tk.StringVar(value="без сортировки")
+        self.var_sort = tk.StringVar(value=SORT_QTY_NONE)
         self.cmb_sort = ttk.Combobox(controls, textvariable=self.var_sort, width=18, state="readonly",
-                                     values=["без сортировки", "по возрастанию", "по убыванию"])
+                                     values=[SORT_QTY_NONE, SORT_QTY_ASC, SORT_QTY_DESC])
         self.cmb_sort.grid(row=0, column=5, padx=6)
 
         self.btn_add = ttk.Button(controls, text="Добавить товар", command=self.add_product)
@@ -160,6 +391,34 @@ class ProductListPage(ttk.Frame):
         self.btn_orders = ttk.Button(controls, text="Заказы", command=lambda: self.app.show(OrdersPage))
         self.btn_orders.grid(row=0, column=7, padx=6)
 
+        self.btn_reports = ttk.Button(controls, text="Отчёты", command=lambda: self.app.show(ReportsPage))
+        self.btn_reports.grid(row=0, column=9, padx=6)
+
+        self.btn_export = ttk.Button(controls, text="Экспорт", command=self.export)
+        self.btn_export.grid(row=0, column=10, padx=6)
+
+        self.btn_branches = ttk.Button(controls, text="Филиалы", command=lambda: self.app.show(BranchStockPage))
+        self.btn_branches.grid(row=0, column=11, padx=6)
+
+        self.btn_reorder = ttk.Button(controls, text="Дозаказ", command=self.export_reorder)
+        self.btn_reorder.grid(row=0, column=12, padx=6)
+
+        self.btn_grid = ttk.Button(controls, text="Правка в таблице", command=self.toggle_grid)
+        self.btn_grid.grid(row=0, column=13, padx=6)
+
+        # Shown in grid mode: staged edits are kept here until saved in one transaction.
+        self.grid_mode = False
+        self.staged: dict[str, dict[str, Any]] = {}  # article -> {product column: new value}
+        self.originals: dict[str, dict[str, Any]] = {}  # article -> values as loaded, for the listed rows
+        self.low: set[str] = set()  # listed articles the forecast says will run out within the lead time
+        self._editor: Optional[ttk.Entry] = None
+        self.grid_bar = ttk.Frame(self)
+        self.lbl_grid = ttk.Label(self.grid_bar, text="")
+        self.lbl_grid.pack(side="left")
+        self.btn_grid_save = ttk.Button(self.grid_bar, text="Сохранить изменения", command=self.save_grid)
+        self.btn_grid_save.pack(side="right")
+        ttk.Button(self.grid_bar, text="Отменить правки", command=self.discard_grid).pack(side="right", padx=8)
+
         self.tree = ttk.Treeview(
             self,
             columns=("article", "name", "category", "supplier", "cost", "disc", "final", "qty"),
@@ -178,19 +437,43 @@ class ProductListPage(ttk.Frame):
         ]:
             self.tree.heading(col, text=title)
             self.tree.column(col, width=w, anchor="w")
-        self.tree.pack(fill="both", expand=True, padx=10, pady=10)
+        self.tree.pack(fill="both", expand=True, padx=10, pady=(10, 6))
+        self.sorter = HeaderSort(
+            self.tree,
+            {"article": "article", "name": "name", "category": "category", "supplier": "supplier",
+             "cost": "cost", "disc": "discount", "final": "final_cost", "qty": "quantity"},
+            self._header_sorted,
+        )
 
         # Row tags for highlight
+        self.tree.tag_configure("low_stock", background="#FFD27F")  # will run out within the supplier lead time
         self.tree.tag_configure("big_discount", background="#2E8B57")
         self.tree.tag_configure("out_of_stock", background="#87CEFA")  # light blue
+        self.tree.tag_configure("edited", background="#E6E6FA")  # staged in grid mode, not saved yet
 
         # reactive updates
         self.var_search.trace_add("write", lambda *_: self.refresh())
         self.var_supplier.trace_add("write", lambda *_: self.refresh())
-        self.var_sort.trace_add("write", lambda *_: self.refresh())
+        self.var_sort.trace_add("write", lambda *_: self._qty_sort_changed())
 
         self.tree.bind("<Double-1>", self.open_for_edit)
 
+    def _qty_sort_changed(self) -> None:
+        if self.var_sort.get() != SORT_QTY_NONE:
+            self.sorter.clear()  # the combobox and the headers are two ways to pick one order
+        self.refresh()
+
+    def _header_sorted(self) -> None:
+        if self.var_sort.get() != SORT_QTY_NONE:
+            self.var_sort.set(SORT_QTY_NONE)  # refreshes through the trace
+        else:
+            self.refresh()
+
+    def _query(self) -> tuple[str, list]:
+        return products_query(
+            self.var_search.get(), self.var_supplier.get(), self.var_sort.get(), order=self.sorter.keys
+        )
+
     def fake_import(self) -> None:
         role = self.app.current_user.role if self.app.current_user else "Гость"
         if role != "Администратор":
@@ -216,80 +499,284 @@ class ProductListPage(ttk.Frame):
             self.btn_add.state(["!disabled"])
             self.btn_orders.state(["!disabled"])
             self.btn_import.state(["!disabled"])
+            self.btn_reports.state(["!disabled"])
+            self.btn_export.state(["!disabled"])
+            self.btn_branches.state(["!disabled"])
+            self.btn_reorder.state(["!disabled"])
+            self.btn_grid.state(["!disabled"])
         elif role == "Менеджер":
             self.btn_add.state(["disabled"])
             self.btn_orders.state(["!disabled"])
+            self.btn_reports.state(["!disabled"])
+            self.btn_export.state(["!disabled"])
+            self.btn_branches.state(["!disabled"])
+            self.btn_reorder.state(["!disabled"])
+            self.btn_grid.state(["disabled"])
         else:
             self.btn_add.state(["disabled"])
             self.btn_orders.state(["disabled"])
             self.btn_import.state(["disabled"])
+            self.btn_reports.state(["disabled"])
+            self.btn_export.state(["disabled"])
+            self.btn_branches.state(["disabled"])
+            self.btn_reorder.state(["disabled"])
+            self.btn_grid.state(["disabled"])
+        if role != "Администратор" and self.grid_mode:
+            self._set_grid_mode(False)
+
+        self.refresh(with_suppliers=True)
+
+    @staticmethod
+    def _load(conn: sqlite3.Connection, sql: str, params: list, with_suppliers: bool, forecasts=None):
+        suppliers = dimension_names(conn, "supplier") if with_suppliers else None
+        low = {a for a, f in forecasts.get(conn).items() if f.low} if forecasts is not None else set()
+        return conn.execute(sql, params).fetchall(), suppliers, low
+
+    def refresh(self, with_suppliers: bool = False) -> None:
+        sql, params = self._query()
+        if self.app.current_user is None and self.app.kiosk is not None:
+            # Guests read the in-memory kiosk copy: no disk I/O, and its connection belongs to this thread.
+            self._fill(self._load(self.app.kiosk.conn, sql, params, with_suppliers))
+            return
 
-        # suppliers list
-        with get_conn() as conn:
-            rows = conn.execute("SELECT DISTINCT supplier FROM product ORDER BY supplier").fetchall()
-        values = ["Все поставщики"] + [r["supplier"] for r in rows]
-        self.cmb_supplier["values"] = values
-        if self.var_supplier.get() not in values:
-            self.var_supplier.set("Все поставщики")
-
-        self.refresh()
-
-    def _query_products(self):
-        search = self.var_search.get().strip().lower()
-        supplier = self.var_supplier.get().strip()
-        sort = self.var_sort.get()
-
-        where = []
-        params = []
+        def work(_task: tasks.Task):
+            with get_conn() as conn:
+                return self._load(conn, sql, params, with_suppliers, self.app.forecast)
 
-        if supplier and supplier != "Все поставщики":
-            where.append("supplier = ?")
-            params.append(supplier)
+        self.app.tasks.submit(
+            "Загрузка товаров", work, on_done=self._fill, on_error=error_box("Не удалось загрузить товары"),
+            key="products",
+        )
 
-        if search:
-            like = f"%{search}%"
-            where.append("(lower(article) LIKE ? OR lower(name) LIKE ? OR lower(description) LIKE ? OR lower(category) LIKE ? OR lower(manufacturer) LIKE ? OR lower(supplier) LIKE ?)")
-            params.extend([like, like, like, like, like, like])
+    def _fill(self, loaded) -> None:
+        rows, suppliers, low = loaded
+        if suppliers is not None:
+            values = [ALL_SUPPLIERS] + suppliers
+            self.cmb_supplier["values"] = values
+            if self.var_supplier.get() not in values:
+                self.var_supplier.set(ALL_SUPPLIERS)  # refreshes again through the trace
+                return
 
-        order_by = ""
-        if sort == "по возрастанию":
-            order_by = "ORDER BY quantity ASC"
-        elif sort == "по убыванию":
-            order_by = "ORDER BY quantity DESC"
+        self._close_editor()
+        for iid in self.tree.get_children():
+            self.tree.delete(iid)
+        self.originals = {}
+        self.low = set()
+        for r in rows:
+            self.tree.insert("", "end", iid=r["article"])
+            self._show_row(r, low)
+
+    def _show_row(self, r: sqlite3.Row, low: set[str]) -> None:
+        """Puts a product row into its tree item, with staged grid edits on top."""
+        article = r["article"]
+        self.originals[article] = {"cost": float(r["cost"]), "discount": int(r["discount"]), "quantity": int(r["quantity"])}
+        staged = self.staged.get(article, {})
+        cost = staged.get("cost", float(r["cost"]))
+        disc = staged.get("discount", int(r["discount"]))
+        qty = staged.get("quantity", int(r["quantity"]))
+        final = discounted_price(cost, disc) if disc > 0 else cost
+        if article in low:
+            self.low.add(article)
+        else:
+            self.low.discard(article)
+        self.tree.item(
+            article,
+            values=(article, r["name"], r["category"], r["supplier"], f"{cost:.2f}", f"{disc}", f"{final:.2f}", qty),
+            tags=self._row_tags(article, qty, disc),
+        )
 
-        where_sql = ("WHERE " + " AND ".join(where)) if where else ""
-        sql = f"""
-            SELECT article, name, category, supplier, cost, discount, quantity
-            FROM product
-            {where_sql}
-            {order_by}
-        """
+    def _row_tags(self, article: str, qty: int, disc: int) -> list[str]:
+        """Highlighting for a row showing ``qty`` and ``disc`` (staged values included)."""
+        tags = []
+        if qty == 0:
+            tags.append("out_of_stock")
+        elif article in self.low:
+            tags.append("low_stock")
+        if disc > 15:
+            tags.append("big_discount")
+        if article in self.staged:
+            tags.append("edited")
+        return tags
+
+    # --- grid editing -----------------------------------------------------------
+
+    def toggle_grid(self) -> None:
+        if not self.grid_mode and not self._require_admin():
+            return
+        if self.grid_mode and self.staged and not messagebox.askyesno(
+            "Правка в таблице", f"Несохранённых изменений: {len(self.staged)}. Отменить их?"
+        ):
+            return
+        self._set_grid_mode(not self.grid_mode)
+
+    def _set_grid_mode(self, on: bool) -> None:
+        self._close_editor()
+        had_edits = bool(self.staged)
+        self.grid_mode = on
+        self.staged = {}
+        if on:
+            self.btn_grid.config(text="Закончить правку")
+            self.grid_bar.pack(fill="x", padx=10, before=self.tree)
+        else:
+            self.btn_grid.config(text="Правка в таблице")
+            self.grid_bar.pack_forget()
+        self._update_grid_bar()
+        if had_edits:
+            self.refresh()
+
+    def discard_grid(self) -> None:
+        if self.staged and messagebox.askyesno("Правка в таблице", f"Отменить изменения ({len(self.staged)})?"):
+            self._close_editor()
+            self.staged = {}
+            self._update_grid_bar()
+            self.refresh()
+
+    def _update_grid_bar(self, message: str = "") -> None:
+        text = f"Двойной щелчок по цене, скидке или остатку — правка, Enter — следующая строка. Изменено строк: {len(self.staged)}"
+        self.lbl_grid.config(text=f"{message}   {text}" if message else text)
+        self.btn_grid_save.state(["!disabled"] if self.staged else ["disabled"])
+
+    def _edit_cell(self, evt) -> None:
+        iid = self.tree.identify_row(evt.y)
+        col = self.tree.column(self.tree.identify_column(evt.x), "id")
+        if iid and col in self.GRID_FIELDS:
+            self._open_editor(iid, col)
+
+    def _open_editor(self, iid: str, col: str) -> None:
+        self._close_editor()
+        self.tree.see(iid)
+        bbox = self.tree.bbox(iid, col)
+        if not bbox:
+            return
+        x, y, w, h = bbox
+        ent = ttk.Entry(self.tree)
+        ent.place(x=x, y=y, width=w, height=h)
+        ent.insert(0, self.tree.set(iid, col))
+        ent.select_range(0, "end")
+        ent.focus_set()
+        ent.bind("<Return>", lambda _e: self._commit_cell(iid, col, move=True))
+        ent.bind("<KP_Enter>", lambda _e: self._commit_cell(iid, col, move=True))
+        ent.bind("<FocusOut>", lambda _e: self._commit_cell(iid, col))
+        ent.bind("<Escape>", lambda _e: self._close_editor())
+        self.tree.selection_set(iid)
+        self._editor = ent
+
+    def _close_editor(self) -> None:
+        if self._editor is not None:
+            ent, self._editor = self._editor, None
+            ent.destroy()
+
+    def _commit_cell(self, article: str, col: str, move: bool = False) -> None:
+        ent = self._editor
+        if ent is None or not self.tree.exists(article):
+            self._close_editor()
+            return
+        field = self.GRID_FIELDS[col]
+        raw = ent.get().strip()
+        err = validate_product({field: raw})
+        if err:
+            # Not a messagebox: it would take the focus and fire FocusOut again.
+            self.bell()
+            self._update_grid_bar(f"{article}: {err}")
+            return
+        self._close_editor()
+        value = self.GRID_PARSE[field](raw)
+        fields = self.staged.setdefault(article, {})
+        if value == self.originals[article][field]:
+            fields.pop(field, None)
+        else:
+            fields[field] = value
+        if not fields:
+            del self.staged[article]
+        self._show_staged(article)
+        self._update_grid_bar()
+        if move:
+            nxt = self.tree.next(article)
+            if nxt:
+                self.tree.after_idle(lambda: self._open_editor(nxt, col))
+
+    def _show_staged(self, article: str) -> None:
+        values = {**self.originals[article], **self.staged.get(article, {})}
+        for col, field in self.GRID_FIELDS.items():
+            self.tree.set(article, col, self.GRID_FORMAT[field].format(values[field]))
+        disc = values["discount"]
+        final = discounted_price(values["cost"], disc) if disc > 0 else values["cost"]
+        self.tree.set(article, "final", f"{final:.2f}")
+        self.tree.item(article, tags=self._row_tags(article, values["quantity"], disc))
+
+    def save_grid(self) -> None:
+        self._close_editor()
+        if not self.staged:
+            return
+        for article, fields in self.staged.items():
+            err = validate_product({k: str(v) for k, v in fields.items()})
+            if err:
+                messagebox.showerror("Ошибка ввода", f"{article}: {err}")
+                return
+        staged = {a: dict(f) for a, f in self.staged.items()}
+        params = [(f.get("cost"), f.get("discount"), f.get("quantity"), a) for a, f in staged.items()]
+        marks = ", ".join("?" for _ in staged)
+
+        def work(_task: tasks.Task):
+            """Writes every staged row in one transaction, then reads back just those rows."""
+            with get_conn() as conn:
+                with conn:
+                    conn.executemany(
+                        """
+                        UPDATE product
+                        SET cost = COALESCE(?, cost), discount = COALESCE(?, discount), quantity = COALESCE(?, quantity)
+                        WHERE article = ?
+                        """,
+                        params,
+                    )
+                rows = conn.execute(f"SELECT * FROM product_view WHERE article IN ({marks})", list(staged)).fetchall()
+                forecasts = self.app.forecast.get(conn)
+            return rows, {a for a in staged if a in forecasts and forecasts[a].low}
+
+        def done(result) -> None:
+            rows, low = result
+            self.btn_grid_save.state(["!disabled"])
+            for article, fields in staged.items():
+                if self.staged.get(article) == fields:
+                    del self.staged[article]  # edits made while saving stay staged
+            for r in rows:
+                if self.tree.exists(r["article"]):
+                    self._show_row(r, low)
+            missing = sorted(set(staged) - {r["article"] for r in rows})
+            self._update_grid_bar(f"Сохранено строк: {len(rows)}.")
+            if missing:
+                messagebox.showwarning("Правка в таблице", f"Товары удалены другим пользователем: {', '.join(missing)}")
+
+        def failed(e: Exception) -> None:
+            self._update_grid_bar()
+            messagebox.showerror("Ошибка", f"Не удалось сохранить изменения, ничего не записано: {e}")
+
+        self.btn_grid_save.state(["disabled"])  # no second save while this one runs
+        self.app.tasks.submit("Сохранение правок", work, on_done=done, on_error=failed, cancellable=False)
+
+    def export(self) -> None:
+        dest = ask_export_path("products.xlsx")
+        if not dest:
+            return
+        sql, params = self._query()
+        start_export(self.app, dest, sql, params, export.PRODUCT_EXPORT_COLUMNS)
 
-        with get_conn() as conn:
-            return conn.execute(sql, params).fetchall()
+    def export_reorder(self) -> None:
+        dest = ask_export_path("reorder.xlsx")
+        if not dest:
+            return
 
-    def refresh(self) -> None:
-        for iid in self.tree.get_children():
-            self.tree.delete(iid)
+        def work(_task: tasks.Task) -> int:
+            with get_conn() as conn:
+                forecasts = self.app.forecast.get(conn)
+            return export.export_rows(dest, forecast.reorder_report(list(forecasts.values())), export.REORDER_EXPORT_COLUMNS)
 
-        rows = self._query_products()
-        for r in rows:
-            cost = float(r["cost"])
-            disc = int(r["discount"])
-            qty = int(r["quantity"])
-            final = discounted_price(cost, disc) if disc > 0 else cost
-            tags = []
-            if qty == 0:
-                tags.append("out_of_stock")
-            if disc > 15:
-                tags.append("big_discount")
-            self.tree.insert(
-                "",
-                "end",
-                iid=r["article"],
-                values=(r["article"], r["name"], r["category"], r["supplier"], f"{cost:.2f}", f"{disc}", f"{final:.2f}", qty),
-                tags=tags,
-            )
+        self.app.tasks.submit(
+            "Отчёт по дозаказу",
+            work,
+            on_done=lambda rows: messagebox.showinfo("Дозаказ", f"Позиций к заказу: {rows}\n{dest}"),
+            on_error=error_box("Не удалось построить отчёт по дозаказу"),
+        )
 
     def _require_admin(self) -> bool:
         role = self.app.current_user.role if self.app.current_user else "Гость"
@@ -305,7 +792,10 @@ class ProductListPage(ttk.Frame):
         edit_page.set_product(article=None)
         self.app.show(ProductEditPage)
 
-    def open_for_edit(self, _evt=None) -> None:
+    def open_for_edit(self, evt=None) -> None:
+        if self.grid_mode and evt is not None:
+            self._edit_cell(evt)
+            return
         if not self._require_admin():
             return
         sel = self.tree.selection()
@@ -374,9 +864,13 @@ class ProductEditPage(ttk.Frame):
         self.lbl_img.pack(side="left")
         ttk.Button(img_row, text="Выбрать...", command=self.pick_image).pack(side="left", padx=8)
 
+        self.lbl_related = ttk.Label(form, text="", wraplength=600, justify="left")
+        self.lbl_related.grid(row=12, column=1, sticky="w", pady=(8, 0), padx=5)
+
         btns = ttk.Frame(self)
         btns.pack(fill="x", padx=10, pady=(0, 10))
-        ttk.Button(btns, text="Сохранить", command=self.save).pack(side="left")
+        self.btn_save = ttk.Button(btns, text="Сохранить", command=self.save)
+        self.btn_save.pack(side="left")
         ttk.Button(btns, text="Удалить", command=self.delete).pack(side="left", padx=8)
         ttk.Button(btns, text="Назад", command=lambda: self.app.show(ProductListPage)).pack(side="right")
 
@@ -384,10 +878,13 @@ class ProductEditPage(ttk.Frame):
         self.top.refresh_user()
 
     def set_product(self, article: Optional[str]) -> None:
+        self.app.tasks.cancel("product_edit")  # a product still loading must not fill this form
+        self.btn_save.state(["!disabled"])
         self.article = article
         self.image_rel = None
         self.txt_desc.delete("1.0", "end")
         self.lbl_img.config(text="Изображение: (не выбрано)")
+        self.lbl_related.config(text="")
 
         if article is None:
             self.top.lbl_title.config(text="Товар — добавление")
@@ -397,8 +894,19 @@ class ProductEditPage(ttk.Frame):
             return
 
         self.top.lbl_title.config(text="Товар — редактирование")
-        with get_conn() as conn:
-            row = conn.execute("SELECT * FROM product WHERE article=?", (article,)).fetchone()
+        self.btn_save.state(["disabled"])  # until the form is filled
+
+        def work(_task: tasks.Task):
+            with get_conn() as conn:
+                row = conn.execute("SELECT * FROM product_view WHERE article=?", (article,)).fetchone()
+                return row, related_products(conn, article)
+
+        self.app.tasks.submit(
+            "Загрузка товара", work, on_done=lambda result: self._fill(*result), on_error=error_box("Не удалось загрузить товар"),
+            key="product_edit",
+        )
+
+    def _fill(self, row: Optional[sqlite3.Row], related: list[sqlite3.Row]) -> None:
         if not row:
             messagebox.showerror("Ошибка", "Товар не найден в базе.")
             self.app.show(ProductListPage)
@@ -418,8 +926,12 @@ class ProductEditPage(ttk.Frame):
         self.image_rel = row["image_path"]
         if self.image_rel:
             self.lbl_img.config(text=f"Изображение: {self.image_rel}")
+        if related:
+            names = ", ".join(f"{r['name']} ({r['article']}, заказов: {r['orders']})" for r in related)
+            self.lbl_related.config(text=f"Часто покупают вместе: {names}")
         self.var_article_entry_state(True)
         self.delete_button_state(True)
+        self.btn_save.state(["!disabled"])
 
     def var_article_entry_state(self, readonly: bool) -> None:
         # Hack: find the entry bound to var_article (first child after label)
@@ -433,51 +945,42 @@ class ProductEditPage(ttk.Frame):
 
     def pick_image(self) -> None:
         path = filedialog.askopenfilename(
-            title="Выберите изображение (jpg/png)",
-            filetypes=[("Images", "*.jpg *.jpeg *.png"), ("All files", "*.*")],
+            title="Выберите изображение",
+            filetypes=[("Images", "*.jpg *.jpeg *.png *.webp *.gif *.bmp"), ("All files", "*.*")],
         )
         if not path:
             return
         src = Path(path)
-        dst = ASSETS_PRODUCTS_DIR / src.name
-        try:
-            dst.write_bytes(src.read_bytes())
-            rel = os.path.relpath(dst, APP_ROOT)
-            self.image_rel = rel
-            self.lbl_img.config(text=f"Изображение: {rel}")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось сохранить изображение: {e}")
+
+        self.app.tasks.submit(
+            "Обработка изображения", lambda _task: images.ingest_image(src, ASSETS_PRODUCTS_DIR), on_done=self._image_saved,
+            on_error=error_box("Не удалось сохранить изображение"), key="product_image", cancellable=False,
+        )
+
+    def _image_saved(self, result: images.IngestResult) -> None:
+        self.image_rel = os.path.relpath(result.path, APP_ROOT)
+        self.lbl_img.config(text=f"Изображение: {self.image_rel} ({result.summary()})")
 
     def _validate(self) -> Optional[str]:
-        if not self.var_name.get().strip():
-            return "Не заполнено поле «Наименование»."
-        try:
-            cost = float(self.var_cost.get().strip())
-            if cost < 0:
-                return "Стоимость не может быть отрицательной."
-        except Exception:
-            return "Некорректная стоимость."
-        try:
-            qty = int(self.var_qty.get().strip())
-            if qty < 0:
-                return "Количество не может быть отрицательным."
-        except Exception:
-            return "Некорректное количество."
-        for fld, label in [(self.var_discount, "Действующая скидка"), (self.var_max_disc, "Макс. скидка")]:
-            try:
-                v = int(fld.get().strip())
-                if v < 0 or v > 100:
-                    return f"Поле «{label}» должно быть в диапазоне 0..100."
-            except Exception:
-                return f"Некорректное значение в поле «{label}»."
-        return None
+        return validate_product({
+            "name": self.var_name.get(),
+            "cost": self.var_cost.get(),
+            "quantity": self.var_qty.get(),
+            "discount": self.var_discount.get(),
+            "max_discount": self.var_max_disc.get(),
+        })
 
     def save(self) -> None:
         err = self._validate()
         if err:
             messagebox.showerror("Ошибка ввода", err)
             return
+        if self.article is None and not self.var_article.get().strip():
+            messagebox.showerror("Ошибка ввода", "Артикул обязателен при добавлении товара.")
+            return
 
+        article = self.article
+        new_article = self.var_article.get().strip()
         name = self.var_name.get().strip()
         unit = self.var_unit.get().strip() or "шт."
         cost = float(self.var_cost.get().strip())
@@ -488,69 +991,105 @@ class ProductEditPage(ttk.Frame):
         discount = int(self.var_discount.get().strip() or "0")
         qty = int(self.var_qty.get().strip())
         desc = self.txt_desc.get("1.0", "end").strip()
+        image_rel = self.image_rel
 
-        with get_conn() as conn:
-            if self.article is None:
-                article = self.var_article.get().strip()
-                if not article:
-                    messagebox.showerror("Ошибка ввода", "Артикул обязателен при добавлении товара.")
-                    return
-                # ensure unique
-                exists = conn.execute("SELECT 1 FROM product WHERE article=?", (article,)).fetchone()
-                if exists:
-                    messagebox.showerror("Ошибка", "Товар с таким артикулом уже существует.")
-                    return
-                conn.execute(
-                    """
-                    INSERT INTO product(article, name, unit, cost, max_discount, manufacturer, supplier, category,
-                                        discount, quantity, description, image_path)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (article, name, unit, cost, max_disc, manufacturer, supplier, category, discount, qty, desc, self.image_rel),
-                )
-                self.article = article
-            else:
-                conn.execute(
-                    """
-                    UPDATE product
-                    SET name=?, unit=?, cost=?, max_discount=?, manufacturer=?, supplier=?, category=?, discount=?, quantity=?,
-                        description=?, image_path=?
-                    WHERE article=?
-                    """,
-                    (name, unit, cost, max_disc, manufacturer, supplier, category, discount, qty, desc, self.image_rel, self.article),
+        def work(_task: tasks.Task) -> Optional[str]:
+            """Writes the product; returns an error message instead when it cannot."""
+            with get_conn() as conn:
+                dims = DimensionCache().ids(
+                    conn, {"unit": unit, "manufacturer": manufacturer, "supplier": supplier, "category": category}
                 )
+                if article is None:
+                    # ensure unique
+                    exists = conn.execute("SELECT 1 FROM product WHERE article=?", (new_article,)).fetchone()
+                    if exists:
+                        return "Товар с таким артикулом уже существует."
+                    conn.execute(
+                        """
+                        INSERT INTO product(article, name, unit_id, cost, max_discount, manufacturer_id, supplier_id, category_id,
+                                            discount, quantity, description, image_path)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        (new_article, name, dims["unit_id"], cost, max_disc, dims["manufacturer_id"], dims["supplier_id"],
+                         dims["category_id"], discount, qty, desc, image_rel),
+                    )
+                else:
+                    conn.execute(
+                        """
+                        UPDATE product
+                        SET name=?, unit_id=?, cost=?, max_discount=?, manufacturer_id=?, supplier_id=?, category_id=?,
+                            discount=?, quantity=?, description=?, image_path=?
+                        WHERE article=?
+                        """,
+                        (name, dims["unit_id"], cost, max_disc, dims["manufacturer_id"], dims["supplier_id"],
+                         dims["category_id"], discount, qty, desc, image_rel, article),
+                    )
+                search.refresh_index(conn)
+            return None
 
-        messagebox.showinfo("Сохранено", "Данные товара сохранены.")
-        self.app.show(ProductListPage)
+        def done(err: Optional[str]) -> None:
+            self.btn_save.state(["!disabled"])
+            if err:
+                messagebox.showerror("Ошибка", err)
+                return
+            self.article = article if article is not None else new_article
+            messagebox.showinfo("Сохранено", "Данные товара сохранены.")
+            self.app.show(ProductListPage)
+
+        def failed(e: Exception) -> None:
+            self.btn_save.state(["!disabled"])
+            messagebox.showerror("Ошибка", f"Не удалось сохранить товар: {e}")
+
+        self.btn_save.state(["disabled"])  # no second save while this one runs
+        self.app.tasks.submit("Сохранение товара", work, on_done=done, on_error=failed, cancellable=False)
 
     def delete(self) -> None:
         if self.article is None:
             return
         if not messagebox.askyesno("Подтверждение", "Удалить товар?"):
             return
-        with get_conn() as conn:
-            # cannot delete if used in orders
-            used = conn.execute("SELECT 1 FROM order_product WHERE product_article=? LIMIT 1", (self.article,)).fetchone()
-            if used:
+        article = self.article
+
+        def work(_task: tasks.Task) -> bool:
+            """Deletes the product; False if it is used in orders and was kept."""
+            with get_conn() as conn:
+                # cannot delete if used in orders
+                used = conn.execute("SELECT 1 FROM order_product WHERE product_article=? LIMIT 1", (article,)).fetchone()
+                if used:
+                    return False
+
+                # remove image file if exists
+                row = conn.execute("SELECT image_path FROM product WHERE article=?", (article,)).fetchone()
+                if row and row["image_path"]:
+                    try:
+                        img_path = (APP_ROOT / row["image_path"]).resolve()
+                        if img_path.exists():
+                            img_path.unlink()
+                    except Exception:
+                        pass
+
+                conn.execute("DELETE FROM product WHERE article=?", (article,))
+                search.refresh_index(conn)
+            return True
+
+        def done(deleted: bool) -> None:
+            if not deleted:
                 messagebox.showwarning("Удаление запрещено", "Товар присутствует в заказе — удалить нельзя.")
                 return
+            messagebox.showinfo("Удалено", "Товар удалён.")
+            self.app.show(ProductListPage)
 
-            # remove image file if exists
-            row = conn.execute("SELECT image_path FROM product WHERE article=?", (self.article,)).fetchone()
-            if row and row["image_path"]:
-                try:
-                    img_path = (APP_ROOT / row["image_path"]).resolve()
-                    if img_path.exists():
-                        img_path.unlink()
-                except Exception:
-                    pass
-
-            conn.execute("DELETE FROM product WHERE article=?", (self.article,))
-        messagebox.showinfo("Удалено", "Товар удалён.")
-        self.app.show(ProductListPage)
+        self.app.tasks.submit(
+            "Удаление товара", work, on_done=done, on_error=error_box("Не удалось удалить товар"), cancellable=False
+        )
 
 
 class OrdersPage(ttk.Frame):
+    ALL_STATUSES = "Все статусы"
+    ALL_POINTS = "Все пункты выдачи"
+    DATE_FIELDS = {"Дата выдачи": "delivery_date", "Дата заказа": "order_date"}
+    DATE_FIELD_TITLES = list(DATE_FIELDS)
+
     def __init__(self, parent: ttk.Frame, app: App):
         super().__init__(parent)
         self.app = app
@@ -564,8 +1103,52 @@ class OrdersPage(ttk.Frame):
         self.btn_add = ttk.Button(controls, text="Добавить заказ", command=self.add_order)
         self.btn_add.pack(side="left")
 
+        self.btn_intake = ttk.Button(controls, text="Загрузка заказов", command=self.open_intake)
+        self.btn_intake.pack(side="left", padx=(8, 0))
+
+        ttk.Button(controls, text="Экспорт", command=self.export).pack(side="left", padx=8)
+
+        ttk.Button(controls, text="История клиента", command=self.open_client).pack(side="left")
+
         ttk.Button(controls, text="Назад к товарам", command=lambda: self.app.show(ProductListPage)).pack(side="right")
 
+        filters = ttk.Frame(self)
+        filters.pack(fill="x", padx=10, pady=(0, 5))
+
+        self.status_ids: dict[str, int] = {}
+        self.point_ids: dict[str, int] = {}
+
+        ttk.Label(filters, text="Статус:").grid(row=0, column=0, sticky="w")
+        self.var_status = tk.StringVar(value=self.ALL_STATUSES)
+        self.cmb_status = ttk.Combobox(filters, textvariable=self.var_status, width=14, state="readonly")
+        self.cmb_status.grid(row=0, column=1, padx=6)
+
+        ttk.Label(filters, text="Пункт выдачи:").grid(row=0, column=2, sticky="w", padx=(10, 0))
+        self.var_point = tk.StringVar(value=self.ALL_POINTS)
+        self.cmb_point = ttk.Combobox(filters, textvariable=self.var_point, width=36, state="readonly")
+        self.cmb_point.grid(row=0, column=3, padx=6)
+
+        self.var_date_field = tk.StringVar(value=self.DATE_FIELD_TITLES[0])
+        ttk.Combobox(filters, textvariable=self.var_date_field, width=12, state="readonly",
+                     values=self.DATE_FIELD_TITLES).grid(row=0, column=4, padx=(10, 6))
+        ttk.Label(filters, text="с").grid(row=0, column=5)
+        self.var_date_from = tk.StringVar()
+        ent_from = ttk.Entry(filters, textvariable=self.var_date_from, width=11)
+        ent_from.grid(row=0, column=6, padx=4)
+        ttk.Label(filters, text="по").grid(row=0, column=7)
+        self.var_date_to = tk.StringVar()
+        ent_to = ttk.Entry(filters, textvariable=self.var_date_to, width=11)
+        ent_to.grid(row=0, column=8, padx=4)
+
+        ttk.Button(filters, text="Сегодня", command=self.filter_today).grid(row=0, column=9, padx=(10, 0))
+        ttk.Button(filters, text="Применить", command=self.refresh).grid(row=0, column=10, padx=6)
+        ttk.Button(filters, text="Сбросить", command=self.reset_filters).grid(row=0, column=11)
+
+        for ent in (ent_from, ent_to):
+            ent.bind("<Return>", lambda _e: self.refresh())
+        self.var_status.trace_add("write", lambda *_: self.refresh())
+        self.var_point.trace_add("write", lambda *_: self.refresh())
+
         self.tree = ttk.Treeview(
             self,
             columns=("id", "status", "order_date", "delivery_date", "pickup", "client", "code"),
@@ -583,30 +1166,94 @@ class OrdersPage(ttk.Frame):
         ]:
             self.tree.heading(col, text=title)
             self.tree.column(col, width=w, anchor="w")
-        self.tree.pack(fill="both", expand=True, padx=10, pady=10)
+        self.tree.pack(fill="both", expand=True, padx=10, pady=(10, 6))
         self.tree.bind("<Double-1>", self.open_for_edit)
+        self.sorter = HeaderSort(
+            self.tree,
+            {"id": "id", "status": "status", "order_date": "order_date", "delivery_date": "delivery_date",
+             "pickup": "pickup", "client": "client_name", "code": "pickup_code"},
+            self.refresh,
+        )
 
     def on_show(self) -> None:
         self.top.refresh_user()
         role = self.app.current_user.role if self.app.current_user else "Гость"
         if role == "Администратор":
             self.btn_add.state(["!disabled"])
+            self.btn_intake.state(["!disabled"])
         else:
             self.btn_add.state(["disabled"])
+            self.btn_intake.state(["disabled"])
+
+        def work(_task: tasks.Task):
+            with get_conn() as conn:
+                statuses = conn.execute("SELECT id, name FROM order_status ORDER BY id").fetchall()
+                points = conn.execute("SELECT id, address FROM pickup_point ORDER BY id").fetchall()
+            return statuses, points
+
+        self.app.tasks.submit(
+            "Загрузка справочников", work, on_done=self._fill_filters,
+            on_error=error_box("Не удалось загрузить справочники"), key="orders_filters",
+        )
+
+    def _fill_filters(self, loaded) -> None:
+        statuses, points = loaded
+        self.status_ids = {r["name"]: r["id"] for r in statuses}
+        self.point_ids = {f"{p['id']}: {p['address']}": p["id"] for p in points}
+        self.cmb_status["values"] = [self.ALL_STATUSES] + list(self.status_ids)
+        self.cmb_point["values"] = [self.ALL_POINTS] + list(self.point_ids)
+        if self.var_status.get() not in self.status_ids:
+            self.var_status.set(self.ALL_STATUSES)
+        if self.var_point.get() not in self.point_ids:
+            self.var_point.set(self.ALL_POINTS)
+
+        self.refresh()
+
+    def _filters(self) -> dict:
+        """orders_query() keyword arguments for the current filters and sorting; raises ValueError on a bad date."""
+        return dict(
+            status_id=self.status_ids.get(self.var_status.get()),
+            pickup_point_id=self.point_ids.get(self.var_point.get()),
+            date_field=self.DATE_FIELDS[self.var_date_field.get()],
+            date_from=parse_date(self.var_date_from.get()) if self.var_date_from.get().strip() else None,
+            date_to=parse_date(self.var_date_to.get()) if self.var_date_to.get().strip() else None,
+            order=self.sorter.keys,
+        )
+
+    def filter_today(self) -> None:
+        today = date.today().isoformat()
+        self.var_date_field.set(self.DATE_FIELD_TITLES[0])
+        self.var_date_from.set(today)
+        self.var_date_to.set(today)
+        self.refresh()
+
+    def reset_filters(self) -> None:
+        self.var_date_from.set("")
+        self.var_date_to.set("")
+        self.var_status.set(self.ALL_STATUSES)
+        self.var_point.set(self.ALL_POINTS)
         self.refresh()
 
     def refresh(self) -> None:
+        try:
+            filters = self._filters()
+        except ValueError as e:
+            messagebox.showerror("Ошибка ввода", f"{e}. Используйте YYYY-MM-DD.")
+            return
+        sql, params = orders_query(**filters)
+
+        def work(_task: tasks.Task):
+            with get_conn() as conn:
+                return conn.execute(sql, params).fetchall()
+
+        self.app.tasks.submit(
+            "Загрузка заказов", work, on_done=self._fill, on_error=error_box("Не удалось загрузить заказы"),
+            key="orders",
+        )
+
+    def _fill(self, rows: list[sqlite3.Row]) -> None:
         for iid in self.tree.get_children():
             self.tree.delete(iid)
-        with get_conn() as conn:
-            rows = conn.execute(
-                """
-                SELECT o.id, o.status, o.order_date, o.delivery_date, p.address AS pickup, o.client_name, o.pickup_code
-                FROM "order" o
-                JOIN pickup_point p ON p.id = o.pickup_point_id
-                ORDER BY o.id
-                """
-            ).fetchall()
         for r in rows:
             self.tree.insert("", "end", iid=str(r["id"]), values=(r["id"], r["status"], r["order_date"], r["delivery_date"], r["pickup"], r["client_name"] or "", r["pickup_code"]))
 
@@ -617,6 +1264,23 @@ class OrdersPage(ttk.Frame):
             return False
         return True
 
+    def export(self) -> None:
+        try:
+            filters = self._filters()
+        except ValueError as e:
+            messagebox.showerror("Ошибка ввода", f"{e}. Используйте YYYY-MM-DD.")
+            return
+        dest = ask_export_path("orders.xlsx")
+        if not dest:
+            return
+        sql, params = orders_query(**filters)
+        start_export(self.app, dest, sql, params, export.ORDER_EXPORT_COLUMNS)
+
+    def open_intake(self) -> None:
+        if not self._require_admin():
+            return
+        OrderIntakeDialog(self, self.app.tasks, on_done=self.refresh)
+
     def add_order(self) -> None:
         if not self._require_admin():
             return
@@ -624,6 +1288,12 @@ class OrdersPage(ttk.Frame):
         edit_page.set_order(order_id=None)
         self.app.show(OrderEditPage)
 
+    def open_client(self) -> None:
+        sel = self.tree.selection()
+        page: ClientHistoryPage = self.app.frames[ClientHistoryPage]  # type: ignore[assignment]
+        page.set_client(self.tree.set(sel[0], "client") if sel else "")
+        self.app.show(ClientHistoryPage)
+
     def open_for_edit(self, _evt=None) -> None:
         if not self._require_admin():
             return
@@ -636,6 +1306,92 @@ class OrdersPage(ttk.Frame):
         self.app.show(OrderEditPage)
 
 
+class OrderIntakeDialog(tk.Toplevel):
+    """Bulk order intake from an xlsx/CSV file or text pasted from a spreadsheet."""
+
+    def __init__(self, parent: ttk.Frame, runner: tasks.TaskRunner, on_done) -> None:
+        super().__init__(parent)
+        self.title("Загрузка заказов")
+        self.geometry("900x520")
+        self.runner = runner
+        self.on_done = on_done
+        self.path: Optional[Path] = None
+
+        ttk.Label(
+            self,
+            text="Вставьте строки из таблицы (столбцы как в orders_import.xlsx: номер, состав, дата заказа, "
+                 "дата доставки, пункт выдачи, ФИО, код, статус) или выберите файл.",
+            wraplength=860,
+        ).pack(anchor="w", padx=10, pady=(10, 4))
+
+        self.txt = tk.Text(self, height=14)
+        self.txt.pack(fill="both", expand=True, padx=10)
+
+        btns = ttk.Frame(self)
+        btns.pack(fill="x", padx=10, pady=6)
+        ttk.Button(btns, text="Из файла...", command=self.pick_file).pack(side="left")
+        self.lbl_file = ttk.Label(btns, text="")
+        self.lbl_file.pack(side="left", padx=8)
+        ttk.Button(btns, text="Закрыть", command=self.destroy).pack(side="right")
+        self.btn_load = ttk.Button(btns, text="Загрузить", command=self.load)
+        self.btn_load.pack(side="right", padx=8)
+
+        self.txt_errors = tk.Text(self, height=8, foreground="#B22222")
+        self.txt_errors.pack(fill="both", padx=10, pady=(0, 10))
+
+        self.transient(parent.winfo_toplevel())
+        self.grab_set()
+
+    def pick_file(self) -> None:
+        path = filedialog.askopenfilename(
+            parent=self,
+            title="Выберите файл с заказами",
+            filetypes=[("Excel files", "*.xlsx"), ("CSV files", "*.csv *.txt"), ("All files", "*.*")],
+        )
+        if path:
+            self.path = Path(path)
+            self.lbl_file.config(text=str(self.path))
+
+    def load(self) -> None:
+        text = self.txt.get("1.0", "end").strip()
+        path = self.path
+        if path is None and not text:
+            messagebox.showwarning("Загрузка заказов", "Нет данных для загрузки.", parent=self)
+            return
+
+        def work(_task: tasks.Task) -> intake.IntakeResult:
+            rows = intake.rows_from_file(path) if path is not None else intake.rows_from_text(text)
+            with get_conn() as conn:
+                return intake.intake_orders(conn, rows)
+
+        def failed(e: Exception) -> None:
+            if self.winfo_exists():
+                self.btn_load.state(["!disabled"])
+                messagebox.showerror("Ошибка", f"Не удалось загрузить заказы: {e}", parent=self)
+
+        self.btn_load.state(["disabled"])
+        self.runner.submit("Загрузка заказов", work, on_done=self._loaded, on_error=failed, cancellable=False)
+
+    def _loaded(self, result: intake.IntakeResult) -> None:
+        if not self.winfo_exists():  # closed while loading: the orders are in, just refresh the list
+            if not result.errors:
+                self.on_done()
+            return
+        self.btn_load.state(["!disabled"])
+        self.txt_errors.delete("1.0", "end")
+        if result.errors:
+            self.txt_errors.insert("1.0", "\n".join(result.errors))
+            messagebox.showerror(
+                "Загрузка заказов",
+                f"Найдено ошибок: {len(result.errors)}. Ни один заказ не загружен.",
+                parent=self,
+            )
+            return
+        messagebox.showinfo("Загрузка заказов", f"Загружено заказов: {result.orders}, позиций: {result.lines}.", parent=self)
+        self.on_done()
+        self.destroy()
+
+
 class OrderEditPage(ttk.Frame):
     def __init__(self, parent: ttk.Frame, app: App):
         super().__init__(parent)
@@ -663,7 +1419,8 @@ class OrderEditPage(ttk.Frame):
             widget.grid(row=r, column=1, sticky="ew", padx=5, pady=3)
 
         row(0, "Номер заказа:", ttk.Entry(form, textvariable=self.var_id))
-        row(1, "Статус:", ttk.Entry(form, textvariable=self.var_status))
+        self.cmb_status = ttk.Combobox(form, textvariable=self.var_status, state="readonly")
+        row(1, "Статус:", self.cmb_status)
         row(2, "Дата заказа (YYYY-MM-DD):", ttk.Entry(form, textvariable=self.var_order_date))
         row(3, "Дата выдачи (YYYY-MM-DD):", ttk.Entry(form, textvariable=self.var_delivery_date))
 
@@ -676,7 +1433,8 @@ class OrderEditPage(ttk.Frame):
 
         btns = ttk.Frame(self)
         btns.pack(fill="x", padx=10, pady=(0, 10))
-        ttk.Button(btns, text="Сохранить", command=self.save).pack(side="left")
+        self.btn_save = ttk.Button(btns, text="Сохранить", command=self.save)
+        self.btn_save.pack(side="left")
         ttk.Button(btns, text="Удалить", command=self.delete).pack(side="left", padx=8)
         ttk.Button(btns, text="Назад", command=lambda: self.app.show(OrdersPage)).pack(side="right")
 
@@ -686,30 +1444,50 @@ class OrderEditPage(ttk.Frame):
     def set_order(self, order_id: Optional[int]) -> None:
         self.order_id = order_id
 
-        with get_conn() as conn:
-            points = conn.execute("SELECT id, address FROM pickup_point ORDER BY id").fetchall()
-        pickup_values = [f"{p['id']}: {p['address']}" for p in points]
-        self.cmb_pickup["values"] = pickup_values
-
         # reset
         for v in (self.var_id, self.var_status, self.var_order_date, self.var_delivery_date, self.var_pickup, self.var_client, self.var_code, self.var_items):
             v.set("")
+        self.top.lbl_title.config(text="Заказ — добавление" if order_id is None else "Заказ — редактирование")
+        self.btn_save.state(["disabled"])  # until the form is filled
+
+        def work(_task: tasks.Task):
+            with get_conn() as conn:
+                points = conn.execute("SELECT id, address FROM pickup_point ORDER BY id").fetchall()
+                statuses = conn.execute("SELECT name FROM order_status ORDER BY id").fetchall()
+                if order_id is None:
+                    return points, statuses, None, []
+                row = conn.execute(
+                    'SELECT o.*, s.name AS status FROM "order" o JOIN order_status s ON s.id = o.status_id WHERE o.id=?',
+                    (order_id,),
+                ).fetchone()
+                items = conn.execute('SELECT product_article, quantity FROM order_product WHERE order_id=?', (order_id,)).fetchall()
+            return points, statuses, row, items
+
+        self.app.tasks.submit(
+            "Загрузка заказа", work, on_done=self._fill, on_error=error_box("Не удалось загрузить заказ"),
+            key="order_edit",
+        )
 
-        if order_id is None:
-            self.top.lbl_title.config(text="Заказ — добавление")
+    def _fill(self, loaded) -> None:
+        points, statuses, row, items = loaded
+        pickup_values = {p["id"]: f"{p['id']}: {p['address']}" for p in points}
+        self.cmb_pickup["values"] = list(pickup_values.values())
+        self.cmb_status["values"] = [r["name"] for r in statuses]
+        self.btn_save.state(["!disabled"])
+
+        if row is None:
+            if self.order_id is not None:
+                messagebox.showerror("Ошибка", "Заказ не найден в базе.")
+                self.app.show(OrdersPage)
+            elif statuses:
+                self.var_status.set(statuses[0]["name"])  # the status list is read-only; new orders start in the first
             return
 
-        self.top.lbl_title.config(text="Заказ — редактирование")
-        with get_conn() as conn:
-            row = conn.execute('SELECT * FROM "order" WHERE id=?', (order_id,)).fetchone()
-            items = conn.execute('SELECT product_article, quantity FROM order_product WHERE order_id=?', (order_id,)).fetchall()
-            pickup = conn.execute("SELECT id, address FROM pickup_point WHERE id=?", (row["pickup_point_id"],)).fetchone()
-
         self.var_id.set(str(row["id"]))
         self.var_status.set(row["status"])
         self.var_order_date.set(row["order_date"])
         self.var_delivery_date.set(row["delivery_date"])
-        self.var_pickup.set(f"{pickup['id']}: {pickup['address']}")
+        self.var_pickup.set(pickup_values[row["pickup_point_id"]])
         self.var_client.set(row["client_name"] or "")
         self.var_code.set(str(row["pickup_code"]))
         flat = []
@@ -727,17 +1505,7 @@ class OrderEditPage(ttk.Frame):
             return None
 
     def _parse_items(self) -> list[tuple[str, int]]:
-        parts = [p.strip() for p in self.var_items.get().split(",") if p.strip()]
-        items = []
-        for i in range(0, len(parts) - 1, 2):
-            art = parts[i]
-            try:
-                qty = int(parts[i + 1])
-            except Exception:
-                continue
-            if qty > 0:
-                items.append((art, qty))
-        return items
+        return parse_composition(self.var_items.get())
 
     def _validate(self) -> Optional[str]:
         try:
@@ -748,21 +1516,22 @@ class OrderEditPage(ttk.Frame):
             return "Не заполнен статус."
         for fld, label in [(self.var_order_date, "Дата заказа"), (self.var_delivery_date, "Дата выдачи")]:
             try:
-                # basic ISO
-                parts = fld.get().strip().split("-")
-                if len(parts) != 3:
-                    raise ValueError
-                y, m, d = map(int, parts)
-                _ = (y, m, d)
-            except Exception:
+                parse_date(fld.get())
+            except ValueError:
                 return f"Некорректное значение в поле «{label}». Используйте YYYY-MM-DD."
+        if parse_date(self.var_delivery_date.get()) < parse_date(self.var_order_date.get()):
+            return "Дата выдачи не может быть раньше даты заказа."
         if not self._parse_pickup_id():
             return "Не выбран пункт выдачи."
         try:
             _ = int(self.var_code.get().strip())
         except Exception:
             return "Код получения должен быть целым числом."
-        # Items optional
+        # Items optional, but must be well-formed; that they exist is checked when saving
+        try:
+            self._parse_items()
+        except CompositionError as e:
+            return f"Ошибка в составе заказа, {e}."
         return None
 
     def save(self) -> None:
@@ -773,63 +1542,385 @@ class OrderEditPage(ttk.Frame):
 
         order_id = int(self.var_id.get().strip())
         status = self.var_status.get().strip()
-        order_date = self.var_order_date.get().strip()
-        delivery_date = self.var_delivery_date.get().strip()
+        order_date = parse_date(self.var_order_date.get())
+        delivery_date = parse_date(self.var_delivery_date.get())
         pickup_id = self._parse_pickup_id()
         client = self.var_client.get().strip() or None
         code = int(self.var_code.get().strip())
         items = self._parse_items()
+        editing = self.order_id is not None
 
-        with get_conn() as conn:
-            exists = conn.execute('SELECT 1 FROM "order" WHERE id=?', (order_id,)).fetchone()
-            if self.order_id is None and exists:
-                messagebox.showerror("Ошибка", "Заказ с таким номером уже существует.")
-                return
-
-            if exists:
-                conn.execute(
-                    """
-                    UPDATE "order"
-                    SET status=?, order_date=?, delivery_date=?, pickup_point_id=?, client_name=?, pickup_code=?
-                    WHERE id=?
-                    """,
-                    (status, order_date, delivery_date, pickup_id, client, code, order_id),
-                )
-                conn.execute("DELETE FROM order_product WHERE order_id=?", (order_id,))
-            else:
-                conn.execute(
-                    """
-                    INSERT INTO "order"(id, status, order_date, delivery_date, pickup_point_id, client_name, pickup_code)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (order_id, status, order_date, delivery_date, pickup_id, client, code),
+        def work(_task: tasks.Task) -> Optional[str]:
+            with get_conn() as conn:
+                err = save_order(
+                    conn, order_id, editing, status, order_date, delivery_date, pickup_id, client, code, items
                 )
+                if err is None:
+                    analytics.refresh_sales(conn)  # in the same transaction, so reports and forecasts see the order
+                return err
+
+        def done(err: Optional[str]) -> None:
+            self.btn_save.state(["!disabled"])
+            if err:
+                messagebox.showerror("Ошибка ввода", err)
+                return
+            messagebox.showinfo("Сохранено", "Данные заказа сохранены.")
+            self.app.show(OrdersPage)
 
-            for art, qty in items:
-                prod = conn.execute("SELECT 1 FROM product WHERE article=?", (art,)).fetchone()
-                if not prod:
-                    messagebox.showwarning("Предупреждение", f"Товар {art} не найден — пропущен в составе заказа.")
-                    continue
-                conn.execute("INSERT INTO order_product(order_id, product_article, quantity) VALUES (?, ?, ?)", (order_id, art, qty))
+        def failed(e: Exception) -> None:
+            self.btn_save.state(["!disabled"])
+            messagebox.showerror("Ошибка", f"Не удалось сохранить заказ: {e}")
 
-        messagebox.showinfo("Сохранено", "Данные заказа сохранены.")
-        self.app.show(OrdersPage)
+        self.btn_save.state(["disabled"])  # no second save while this one runs
+        self.app.tasks.submit("Сохранение заказа", work, on_done=done, on_error=failed, cancellable=False)
 
     def delete(self) -> None:
         if self.order_id is None:
             return
         if not messagebox.askyesno("Подтверждение", "Удалить заказ?"):
             return
-        with get_conn() as conn:
-            conn.execute('DELETE FROM "order" WHERE id=?', (self.order_id,))
-        messagebox.showinfo("Удалено", "Заказ удалён.")
-        self.app.show(OrdersPage)
+        order_id = self.order_id
+
+        def work(_task: tasks.Task) -> None:
+            with get_conn() as conn:
+                conn.execute('DELETE FROM "order" WHERE id=?', (order_id,))
+
+        def done(_result: None) -> None:
+            messagebox.showinfo("Удалено", "Заказ удалён.")
+            self.app.show(OrdersPage)
+
+        self.app.tasks.submit(
+            "Удаление заказа", work, on_done=done, on_error=error_box("Не удалось удалить заказ"), cancellable=False
+        )
+
+
+class ClientHistoryPage(ttk.Frame):
+    def __init__(self, parent: ttk.Frame, app: App):
+        super().__init__(parent)
+        self.app = app
+
+        self.top = TopBar(self, app, "История клиента")
+        self.top.pack(fill="x")
+
+        controls = ttk.Frame(self)
+        controls.pack(fill="x", padx=10, pady=5)
+        ttk.Label(controls, text="Клиент (ФИО):").pack(side="left")
+        self.var_search = tk.StringVar()
+        ttk.Entry(controls, textvariable=self.var_search, width=40).pack(side="left", padx=6)
+        ttk.Button(controls, text="Назад к заказам", command=lambda: self.app.show(OrdersPage)).pack(side="right")
+
+        body = ttk.Frame(self)
+        body.pack(fill="both", expand=True, padx=10, pady=(10, 0))
+
+        self.tree_clients = ttk.Treeview(body, columns=("name", "orders"), show="headings", height=20)
+        for col, title, w in [("name", "Клиент", 240), ("orders", "Заказов", 70)]:
+            self.tree_clients.heading(col, text=title)
+            self.tree_clients.column(col, width=w, anchor="w")
+        self.tree_clients.pack(side="left", fill="y")
+
+        self.tree = ttk.Treeview(
+            body,
+            columns=("id", "order_date", "delivery_date", "status", "pickup", "items", "total"),
+            show="headings",
+            height=20,
+        )
+        for col, title, w in [
+            ("id", "№", 60),
+            ("order_date", "Дата заказа", 100),
+            ("delivery_date", "Дата выдачи", 100),
+            ("status", "Статус", 110),
+            ("pickup", "Пункт выдачи", 240),
+            ("items", "Товаров, шт.", 90),
+            ("total", "Сумма", 100),
+        ]:
+            self.tree.heading(col, text=title)
+            self.tree.column(col, width=w, anchor="w")
+        self.tree.pack(side="left", fill="both", expand=True, padx=(10, 0))
+
+        self.lbl_total = ttk.Label(self, text="")
+        self.lbl_total.pack(anchor="w", padx=10, pady=8)
+
+        self.var_search.trace_add("write", lambda *_: self.search())
+        self.tree_clients.bind("<<TreeviewSelect>>", lambda _e: self.load_history())
+        self.tree.bind("<Double-1>", self.open_order)
+
+    def on_show(self) -> None:
+        self.top.refresh_user()
+        self.search()
+
+    def set_client(self, name: str) -> None:
+        """Opens the page on the client called ``name``; it is selected if the name is unambiguous."""
+        self.var_search.set(name)  # searches through the trace
+
+    def search(self) -> None:
+        text = self.var_search.get()
+
+        def work(_task: tasks.Task):
+            with get_conn() as conn:
+                return find_clients(conn, text)
+
+        self.app.tasks.submit(
+            "Поиск клиентов", work, on_done=self._fill_clients, on_error=error_box("Не удалось найти клиентов"),
+            key="clients",
+        )
+
+    def _fill_clients(self, rows: list[sqlite3.Row]) -> None:
+        for iid in self.tree_clients.get_children():
+            self.tree_clients.delete(iid)
+        for r in rows:
+            self.tree_clients.insert("", "end", iid=str(r["id"]), values=(r["name"], r["orders"]))
+        if len(rows) == 1:
+            self.tree_clients.selection_set(str(rows[0]["id"]))  # loads the history through <<TreeviewSelect>>
+        else:
+            self._fill_history([])
+
+    def load_history(self) -> None:
+        sel = self.tree_clients.selection()
+        if not sel:
+            return
+        client = int(sel[0])
+
+        def work(_task: tasks.Task):
+            with get_conn() as conn:
+                return client_history(conn, client)
+
+        self.app.tasks.submit(
+            "Загрузка истории клиента", work, on_done=self._fill_history,
+            on_error=error_box("Не удалось загрузить историю клиента"), key="client_history",
+        )
+
+    def _fill_history(self, rows: list[sqlite3.Row]) -> None:
+        for iid in self.tree.get_children():
+            self.tree.delete(iid)
+        for r in rows:
+            self.tree.insert(
+                "", "end", iid=str(r["id"]),
+                values=(r["id"], r["order_date"], r["delivery_date"], r["status"], r["pickup"], r["items"], f"{r['total']:.2f}"),
+            )
+        if rows:
+            total = sum(r["total"] for r in rows)
+            self.lbl_total.config(text=f"Заказов: {len(rows)}, товаров: {sum(r['items'] for r in rows)}, на сумму: {total:.2f}")
+        else:
+            self.lbl_total.config(text="")
+
+    def open_order(self, _evt=None) -> None:
+        role = self.app.current_user.role if self.app.current_user else "Гость"
+        if role != "Администратор":
+            messagebox.showwarning("Доступ запрещён", "Действие доступно только Администратору.")
+            return
+        sel = self.tree.selection()
+        if not sel:
+            return
+        edit_page: OrderEditPage = self.app.frames[OrderEditPage]  # type: ignore[assignment]
+        edit_page.set_order(order_id=int(sel[0]))
+        self.app.show(OrderEditPage)
+
+
+class ReportsPage(ttk.Frame):
+    def __init__(self, parent: ttk.Frame, app: App):
+        super().__init__(parent)
+        self.app = app
+
+        self.top = TopBar(self, app, "Отчёты по продажам")
+        self.top.pack(fill="x")
+
+        controls = ttk.Frame(self)
+        controls.pack(fill="x", padx=10, pady=5)
+
+        ttk.Label(controls, text="Группировка:").grid(row=0, column=0, sticky="w")
+        self.dim_by_title = {title: dim for dim, title in analytics.DIMENSIONS.items()}
+        self.var_dim = tk.StringVar(value=analytics.DIMENSIONS["product"])
+        ttk.Combobox(controls, textvariable=self.var_dim, width=16, state="readonly",
+                     values=list(self.dim_by_title)).grid(row=0, column=1, padx=6)
+
+        ttk.Label(controls, text="С (YYYY-MM-DD):").grid(row=0, column=2, sticky="w", padx=(10, 0))
+        self.var_from = tk.StringVar()
+        ttk.Entry(controls, textvariable=self.var_from, width=12).grid(row=0, column=3, padx=6)
+        ttk.Label(controls, text="По:").grid(row=0, column=4, sticky="w")
+        self.var_to = tk.StringVar()
+        ttk.Entry(controls, textvariable=self.var_to, width=12).grid(row=0, column=5, padx=6)
+
+        ttk.Button(controls, text="Показать", command=self.refresh).grid(row=0, column=6, padx=(10, 0))
+        ttk.Button(controls, text="Пересчитать", command=self.recalculate).grid(row=0, column=7, padx=6)
+        ttk.Button(controls, text="Назад к товарам", command=lambda: self.app.show(ProductListPage)).grid(row=0, column=8, padx=6)
+
+        self.tree = ttk.Treeview(self, columns=("key", "units", "revenue"), show="headings", height=20)
+        for col, title, w in [
+            ("key", "Значение", 420),
+            ("units", "Продано, шт.", 120),
+            ("revenue", "Выручка", 140),
+        ]:
+            self.tree.heading(col, text=title)
+            self.tree.column(col, width=w, anchor="w")
+        self.tree.pack(fill="both", expand=True, padx=10, pady=(10, 0))
+
+        self.lbl_total = ttk.Label(self, text="")
+        self.lbl_total.pack(anchor="w", padx=10, pady=8)
+
+        self.var_dim.trace_add("write", lambda *_: self.refresh())
+
+    def on_show(self) -> None:
+        self.top.refresh_user()
+        self.refresh()
+
+    def refresh(self) -> None:
+        dim = self.dim_by_title.get(self.var_dim.get(), "product")
+        date_from = self.var_from.get().strip() or None
+        date_to = self.var_to.get().strip() or None
+
+        def work(_task: tasks.Task):
+            # A plain read: orders refresh their days when saved, maintenance picks up the rest.
+            with get_conn() as conn:
+                return analytics.sales_report(conn, dim, date_from, date_to)
+
+        self.app.tasks.submit(
+            "Построение отчёта", work, on_done=self._fill, on_error=error_box("Не удалось построить отчёт"),
+            key="report",
+        )
+
+    def recalculate(self) -> None:
+        """Rebuild the days queued by imports and replication now instead of at the next maintenance run."""
+
+        def work(_task: tasks.Task):
+            with get_conn() as conn:
+                return analytics.refresh_sales(conn)
+
+        self.app.tasks.submit(
+            "Пересчёт продаж", work, on_done=lambda _days: self.refresh(),
+            on_error=error_box("Не удалось пересчитать продажи"), key="report-refresh", cancellable=False,
+        )
+
+    def _fill(self, rows: list[sqlite3.Row]) -> None:
+        for iid in self.tree.get_children():
+            self.tree.delete(iid)
+
+        total_units = 0
+        total_revenue = 0.0
+        for r in rows:
+            total_units += int(r["units"])
+            total_revenue += float(r["revenue"])
+            self.tree.insert("", "end", values=(r["label"], r["units"], f"{float(r['revenue']):.2f}"))
+        self.lbl_total.config(text=f"Итого: {total_units} шт., {total_revenue:.2f} руб.")
+
+
+class BranchStockPage(ttk.Frame):
+    """Head office: stock of every product side by side across the branch databases."""
+
+    def __init__(self, parent: ttk.Frame, app: App):
+        super().__init__(parent)
+        self.app = app
+
+        self.top = TopBar(self, app, "Остатки по филиалам")
+        self.top.pack(fill="x")
+
+        controls = ttk.Frame(self)
+        controls.pack(fill="x", padx=10, pady=5)
+
+        ttk.Label(controls, text="Поиск:").grid(row=0, column=0, sticky="w")
+        self.var_search = tk.StringVar()
+        ttk.Entry(controls, textvariable=self.var_search, width=35).grid(row=0, column=1, padx=6)
+
+        ttk.Button(controls, text="Показать", command=self.refresh).grid(row=0, column=2, padx=(10, 0))
+        ttk.Button(controls, text="Базы филиалов...", command=self.pick_branches).grid(row=0, column=3, padx=6)
+        ttk.Button(controls, text="Назад к товарам", command=lambda: self.app.show(ProductListPage)).grid(row=0, column=4, padx=6)
+
+        self.tree = ttk.Treeview(self, show="headings", height=20)
+        self.tree.pack(fill="both", expand=True, padx=10, pady=(10, 0))
+        self.tree.tag_configure("out_of_stock", background="#87CEFA")
+
+        self.lbl_status = ttk.Label(self, text="")
+        self.lbl_status.pack(anchor="w", padx=10, pady=(2, 6))
+
+    def _branch_paths(self) -> list[Path]:
+        if not BRANCHES_FILE.exists():
+            return []
+        lines = BRANCHES_FILE.read_text(encoding="utf-8").splitlines()
+        return [Path(line.strip()) for line in lines if line.strip()]
+
+    def pick_branches(self) -> None:
+        paths = filedialog.askopenfilenames(
+            title="Базы филиалов",
+            filetypes=[("SQLite", "*.db"), ("All files", "*.*")],
+        )
+        if not paths:
+            return
+        self.app.tasks.submit(
+            "Сохранение списка филиалов",
+            lambda _task: BRANCHES_FILE.write_text("\n".join(paths) + "\n", encoding="utf-8"),
+            on_done=lambda _n: self.refresh(),
+            on_error=error_box("Не удалось сохранить список филиалов"),
+            cancellable=False,
+        )
+
+    def on_show(self) -> None:
+        self.top.refresh_user()
+        self.refresh()
+
+    def refresh(self) -> None:
+        search = self.var_search.get()
+
+        def work(_task: tasks.Task):
+            branches = branches_from_paths(self._branch_paths())
+            if not branches:
+                return branches, []
+            return branches, federated_query(branches, lambda s: products_query(search, schema=s), order_by="article")
+
+        self.lbl_status.config(text="")
+        self.app.tasks.submit(
+            "Чтение баз филиалов", work, on_done=self._fill, on_error=error_box("Не удалось прочитать базы филиалов"),
+            key="branch_stock",
+        )
+
+    def _fill(self, loaded) -> None:
+        branches, rows = loaded
+        for iid in self.tree.get_children():
+            self.tree.delete(iid)
+        if not branches:
+            self.tree["columns"] = ()
+            self.lbl_status.config(text="Выберите базы филиалов.")
+            return
+
+        names = [b.name for b in branches]
+        stock: dict[str, dict[str, int]] = {}
+        titles: dict[str, str] = {}
+        for r in rows:
+            stock.setdefault(r["article"], {})[r["branch"]] = int(r["quantity"])
+            titles.setdefault(r["article"], r["name"])
+
+        columns = ["article", "name"] + [f"b{i}" for i in range(len(names))] + ["total"]
+        self.tree["columns"] = columns
+        for col, title, w in [("article", "Артикул", 90), ("name", "Наименование", 220)]:
+            self.tree.heading(col, text=title)
+            self.tree.column(col, width=w, anchor="w", stretch=False)
+        for i, name in enumerate(names):
+            self.tree.heading(f"b{i}", text=name)
+            self.tree.column(f"b{i}", width=70, anchor="e", stretch=False)
+        self.tree.heading("total", text="Итого")
+        self.tree.column("total", width=80, anchor="e", stretch=False)
+
+        for article in sorted(stock):
+            per_branch = stock[article]
+            qty = [per_branch.get(name) for name in names]
+            tags = ["out_of_stock"] if any(q == 0 for q in qty) else []
+            self.tree.insert(
+                "",
+                "end",
+                values=[article, titles[article]] + ["—" if q is None else q for q in qty] + [sum(q or 0 for q in qty)],
+                tags=tags,
+            )
+        self.lbl_status.config(text=f"Филиалов: {len(names)}, товаров: {len(stock)}")
 
 
 def main() -> None:
     init_db_if_needed()
     app = App()
-    app.mainloop()
+    backups = backup.BackupScheduler(BACKUP_INTERVAL, on_done=app.report_backup)
+    backups.start()
+    try:
+        app.mainloop()
+    finally:
+        app.tasks.shutdown()
+        backups.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Callable, Optional
+
+import analytics
+import search
+from db import APP_ROOT, DB_FILE, compact_product_history, orders_query, products_query
+
+
+MAINTENANCE_LOG = APP_ROOT / "maintenance.log"
+MAINTENANCE_INTERVAL = 24 * 60 * 60  # seconds between runs
+IDLE_BEFORE_RUN = 10 * 60  # the App only starts a run after this long without input
+
+# incremental_vacuum holds the write lock while it runs, so free pages are
+# returned in small steps with commits (and a chance for writers) in between.
+VACUUM_STEP_PAGES = 500
+ANALYSIS_LIMIT = 1000  # rows sampled per index by ANALYZE
+HISTORY_DETAIL_DAYS = 90  # older price/stock history is thinned out to one value per day
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+# Queries timed before and after each run, to see whether the app slows down over time.
+_TIMED_QUERIES = {
+    "товары": products_query(),
+    "поиск товаров": products_query("цвет"),
+    "заказы": orders_query(),
+    "заказы по дате": orders_query(date_from="2000-01-01", date_to="2100-12-31"),
+}
+
+
+@dataclass
+class MaintenanceStats:
+    started: datetime
+    size_before: int = 0
+    size_after: int = 0
+    freed_pages: int = 0
+    history_compacted: int = 0
+    converted: bool = False
+    check: str = ""
+    steps: dict[str, float] = field(default_factory=dict)  # step -> seconds
+    queries_before: dict[str, float] = field(default_factory=dict)  # query -> ms
+    queries_after: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return self.check == "ok"
+
+    def summary(self) -> str:
+        steps = ", ".join(f"{k} {v:.2f} с" for k, v in self.steps.items())
+        queries = ", ".join(
+            f"{k} {self.queries_before[k]:.1f}→{self.queries_after.get(k, 0.0):.1f} мс" for k in self.queries_before
+        )
+        return (
+            f"проверка: {self.check}; размер {self.size_before / 1_000_000:.2f} → {self.size_after / 1_000_000:.2f} МБ, "
+            f"освобождено страниц {self.freed_pages}{' (переведена на auto_vacuum=INCREMENTAL)' if self.converted else ''}, "
+            f"строк истории цен сжато {self.history_compacted}; "
+            f"{steps}; запросы: {queries}"
+        )
+
+
+def _time_queries(conn: sqlite3.Connection) -> dict[str, float]:
+    timings = {}
+    for name, (sql, params) in _TIMED_QUERIES.items():
+        t = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        timings[name] = (time.perf_counter() - t) * 1000
+    return timings
+
+
+def _file_size(path: Path) -> int:
+    return path.stat().st_size if path.exists() else 0
+
+
+def run_maintenance(db_path: Path = DB_FILE, log_path: Optional[Path] = MAINTENANCE_LOG) -> MaintenanceStats:
+    """quick_check, thin out old price history, return free pages to the file system, refresh planner statistics.
+
+    A database created before auto_vacuum was enabled is converted once with a
+    full VACUUM; after that only incremental_vacuum runs. Stops before touching
+    anything if quick_check reports damage. Appends the summary, or the error
+    of a failed run, to ``log_path``.
+    """
+    stats = MaintenanceStats(started=datetime.now(), size_before=_file_size(db_path))
+    try:
+        _maintain(db_path, stats)
+    except Exception as e:
+        _append_log(log_path, stats.started, db_path, f"не выполнено: {e}")
+        raise
+    _append_log(log_path, stats.started, db_path, stats.summary())
+    return stats
+
+
+def _append_log(log_path: Optional[Path], started: datetime, db_path: Path, text: str) -> None:
+    if log_path is not None:
+        with open(log_path, "a", encoding="utf-8") as log:
+            log.write(f"{started:%Y-%m-%d %H:%M:%S} {db_path.name}: {text}\n")
+
+
+def _maintain(db_path: Path, stats: MaintenanceStats) -> None:
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.isolation_level = None  # VACUUM and the vacuum steps must run outside a transaction
+    try:
+        stats.queries_before = _time_queries(conn)
+
+        t = time.perf_counter()
+        stats.check = "; ".join(r[0] for r in conn.execute("PRAGMA quick_check").fetchall())
+        stats.steps["quick_check"] = time.perf_counter() - t
+
+        if stats.ok:
+            t = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            stats.history_compacted = compact_product_history(
+                conn, (date.today() - timedelta(days=HISTORY_DETAIL_DAYS)).isoformat()
+            )
+            conn.execute("COMMIT")
+            stats.steps["history"] = time.perf_counter() - t
+
+            t = time.perf_counter()
+            analytics.refresh_sales(conn)  # days queued by imports and replication, which do not refresh themselves
+            stats.steps["sales"] = time.perf_counter() - t
+
+            t = time.perf_counter()
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+                conn.execute("VACUUM")
+                stats.converted = True
+            else:
+                while True:
+                    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                    if not free:
+                        break
+                    conn.execute(f"PRAGMA incremental_vacuum({min(free, VACUUM_STEP_PAGES)})").fetchall()
+                    freed = free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+                    if freed <= 0:
+                        break
+                    stats.freed_pages += freed
+            stats.steps["vacuum"] = time.perf_counter() - t
+
+            t = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            search.refresh_index(conn)
+            search.prune_vocabulary(conn)
+            conn.execute("COMMIT")
+            stats.steps["search_index"] = time.perf_counter() - t
+
+            t = time.perf_counter()
+            conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+            conn.execute("ANALYZE")
+            conn.execute("PRAGMA optimize")
+            stats.steps["analyze"] = time.perf_counter() - t
+
+            stats.queries_after = _time_queries(conn)
+    finally:
+        conn.close()
+    stats.size_after = _file_size(db_path)
+
+
+def last_run(log_path: Path = MAINTENANCE_LOG) -> Optional[float]:
+    """Time of the last logged run (log file mtime), or None if there was none."""
+    return log_path.stat().st_mtime if log_path.exists() else None
+
+
+class MaintenanceScheduler:
+    """Runs maintenance in a background thread once the user has been idle long enough.
+
+    The App reports input through ``touch()`` and calls ``tick()`` from a Tk
+    timer; a run starts when nothing happened for IDLE_BEFORE_RUN seconds and
+    the last run is older than MAINTENANCE_INTERVAL.
+    """
+
+    def __init__(
+        self,
+        db_path: Path = DB_FILE,
+        log_path: Path = MAINTENANCE_LOG,
+        on_done: Optional[Callable[[Optional[MaintenanceStats], Optional[Exception]], None]] = None,
+    ) -> None:
+        self.db_path = db_path
+        self.log_path = log_path
+        self.on_done = on_done
+        self.last_input = time.time()
+        self._last_attempt = 0.0  # a run whose log entry could not be written still waits for the next interval
+        self._running = threading.Event()
+
+    def touch(self) -> None:
+        self.last_input = time.time()
+
+    def due(self) -> bool:
+        now = time.time()
+        if self._running.is_set() or now - self.last_input < IDLE_BEFORE_RUN:
+            return False
+        if now - self._last_attempt < MAINTENANCE_INTERVAL:
+            return False
+        last = last_run(self.log_path)
+        return last is None or now - last >= MAINTENANCE_INTERVAL
+
+    def tick(self) -> None:
+        if self.due():
+            self._last_attempt = time.time()
+            self._running.set()
+            threading.Thread(target=self._run, name="maintenance", daemon=True).start()
+
+    def _run(self) -> None:
+        try:
+            stats = run_maintenance(self.db_path, self.log_path)
+            err = None
+        except Exception as e:
+            stats, err = None, e
+        finally:
+            self._running.clear()
+        if self.on_done:
+            self.on_done(stats, err)
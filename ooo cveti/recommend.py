@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+from db import DB_FILE, PAIR_COUNT_SQL
+
+
+CHUNK_ORDERS = 50_000  # order ids per worker job; pairs never span orders, so chunks add up exactly
+INSERT_BATCH = 50_000
+ATTEMPTS = 3  # optimistic rebuilds before the last one is done holding the write lock
+
+
+@dataclass
+class RebuildStats:
+    orders: int
+    pairs: int
+    seconds: float
+    attempts: int
+
+
+def _count_pairs(db_path: str, lo: int, hi: int) -> list[tuple[str, str, int]]:
+    # Runs in a worker process: its own read-only connection, no Tk, no shared state.
+    conn = sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+    try:
+        sql = PAIR_COUNT_SQL.format(where="WHERE x.order_id BETWEEN ? AND ?")
+        return conn.execute(sql, (lo, hi)).fetchall()
+    finally:
+        conn.close()
+
+
+def _count_all(db_path: Path, lo: int, hi: int, workers: Optional[int], chunk_orders: int,
+               progress: Optional[Callable[[int, int], None]]) -> Counter:
+    ranges = [(start, min(start + chunk_orders - 1, hi)) for start in range(lo, hi + 1, chunk_orders)]
+    counts: Counter = Counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        jobs = [pool.submit(_count_pairs, str(db_path), a, b) for a, b in ranges]
+        for done, job in enumerate(jobs, 1):
+            for a, b, n in job.result():
+                counts[(a, b)] += n
+            if progress:
+                progress(done, len(jobs))
+    return counts
+
+
+def _replace_pairs(conn: sqlite3.Connection, counts: Counter) -> None:
+    conn.execute("DELETE FROM product_pair")
+    rows = [(a, b, n) for (a, b), n in counts.items()]
+    for i in range(0, len(rows), INSERT_BATCH):
+        batch = rows[i:i + INSERT_BATCH]
+        conn.executemany("INSERT INTO product_pair(a, b, orders) VALUES (?, ?, ?)", batch)
+        conn.executemany("INSERT INTO product_pair(a, b, orders) VALUES (?, ?, ?)", [(b, a, n) for a, b, n in batch])
+
+
+def rebuild_pairs(
+    db_path: Path = DB_FILE,
+    workers: Optional[int] = None,
+    chunk_orders: int = CHUNK_ORDERS,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> RebuildStats:
+    """Recount product_pair from scratch over all of order_product.
+
+    The triggers keep product_pair current on every order change, so this is
+    only needed after bulk loads with triggers bypassed or to check the counts.
+    Order id ranges are counted in parallel by worker processes and summed;
+    the table is then replaced in one transaction. If anything was committed
+    while the workers ran, the count is repeated, and the last attempt holds
+    the write lock throughout so it cannot be overtaken.
+    """
+    started = time.monotonic()
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        for attempt in range(1, ATTEMPTS + 1):
+            last = attempt == ATTEMPTS
+            if last:
+                conn.execute("BEGIN IMMEDIATE")  # readers (the workers) still get through
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            lo, hi, orders = conn.execute("SELECT min(id), max(id), count(*) FROM \"order\"").fetchone()
+            counts = _count_all(db_path, lo or 0, hi or -1, workers, chunk_orders, progress)
+            if not last:
+                conn.execute("BEGIN IMMEDIATE")
+                if conn.execute("PRAGMA data_version").fetchone()[0] != version:
+                    conn.execute("ROLLBACK")
+                    continue
+            try:
+                _replace_pairs(conn, counts)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return RebuildStats(orders, len(counts), time.monotonic() - started, attempt)
+        raise AssertionError("unreachable")
+    finally:
+        conn.close()
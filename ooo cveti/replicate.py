@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import sqlite3
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+from db import DIMENSION_TABLES, DimensionCache, client_id, get_conn, order_status_id, set_order_lines
+
+
+DEFAULT_BATCH = 500
+
+PRODUCT_COLUMNS = (
+    "article", "name", "unit", "cost", "max_discount", "manufacturer", "supplier", "category",
+    "discount", "quantity", "description", "image_path",
+)
+
+# Upserts go parents first, deletes children first.
+_APPLY_ORDER = ("pickup_point", "product", "order", "order_product")
+
+
+@dataclass
+class Change:
+    tbl: str
+    pk: str
+    seq: int
+    row: Optional[dict[str, Any]]  # None means the row no longer exists at the source
+
+
+@dataclass
+class SyncStats:
+    batches: int = 0
+    changes: int = 0
+    applied: int = 0
+    last_seq: int = 0
+    conflicts: list[str] = field(default_factory=list)
+
+
+def node_id(conn: sqlite3.Connection) -> str:
+    return str(conn.execute("SELECT node_id FROM cdc_state WHERE id = 1").fetchone()[0])
+
+
+def _peer_seq(conn: sqlite3.Connection, peer: str, column: str) -> int:
+    row = conn.execute(f"SELECT {column} FROM replication_peer WHERE node_id = ?", (peer,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def _set_peer_seq(conn: sqlite3.Connection, peer: str, column: str, seq: int) -> None:
+    conn.execute("INSERT OR IGNORE INTO replication_peer(node_id) VALUES (?)", (peer,))
+    conn.execute(f"UPDATE replication_peer SET {column} = max({column}, ?) WHERE node_id = ?", (seq, peer))
+
+
+# --- reading changes at the source ----------------------------------------------
+
+def _read_row(conn: sqlite3.Connection, tbl: str, pk: str) -> Optional[dict[str, Any]]:
+    if tbl == "pickup_point":
+        r = conn.execute("SELECT id, address FROM pickup_point WHERE id = ?", (int(pk),)).fetchone()
+        return dict(r) if r else None
+    if tbl == "product":
+        r = conn.execute(f"SELECT {', '.join(PRODUCT_COLUMNS)} FROM product_view WHERE article = ?", (pk,)).fetchone()
+        return dict(r) if r else None
+    if tbl == "order":
+        r = conn.execute(
+            """
+            SELECT o.id, o.order_date, o.delivery_date, o.pickup_point_id, o.client_name, o.pickup_code,
+                   s.name AS status
+            FROM "order" o
+            JOIN order_status s ON s.id = o.status_id
+            WHERE o.id = ?
+            """,
+            (int(pk),),
+        ).fetchone()
+        return dict(r) if r else None
+    if tbl == "order_product":
+        lines = conn.execute(
+            "SELECT product_article, quantity FROM order_product WHERE order_id = ? ORDER BY product_article",
+            (int(pk),),
+        ).fetchall()
+        return {"order_id": int(pk), "lines": [(r["product_article"], r["quantity"]) for r in lines]}
+    raise ValueError(f"Unknown replicated table: {tbl}")
+
+
+def read_changes(conn: sqlite3.Connection, after_seq: int, limit: int) -> tuple[list[Change], int, int]:
+    """Up to ``limit`` log entries after ``after_seq``, coalesced per row, with the rows' current state.
+
+    Returns the changes, the highest seq they cover and the number of log
+    entries read. Shipping row state rather than individual statements makes
+    applying a batch idempotent.
+    """
+    conn.execute("BEGIN")  # one snapshot for the log and the rows it points to
+    try:
+        log = conn.execute(
+            "SELECT seq, tbl, pk FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?",
+            (after_seq, limit),
+        ).fetchall()
+        latest: dict[tuple[str, str], int] = {}
+        for r in log:
+            latest[(r["tbl"], r["pk"])] = r["seq"]
+        changes = [Change(tbl, pk, seq, _read_row(conn, tbl, pk)) for (tbl, pk), seq in latest.items()]
+    finally:
+        conn.rollback()
+    last = log[-1]["seq"] if log else after_seq
+    return changes, last, len(log)
+
+
+# --- applying changes at the target ---------------------------------------------
+
+def _upsert(conn: sqlite3.Connection, ch: Change, dims: DimensionCache) -> None:
+    row = ch.row
+    assert row is not None
+    if ch.tbl == "pickup_point":
+        conn.execute(
+            "INSERT INTO pickup_point(id, address) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET address = excluded.address",
+            (row["id"], row["address"]),
+        )
+    elif ch.tbl == "product":
+        # Dimensions travel by name; ids are local to each database.
+        values = {c: row[c] for c in PRODUCT_COLUMNS if c not in DIMENSION_TABLES}
+        values.update(dims.ids(conn, {t: row[t] for t in DIMENSION_TABLES}))
+        cols = ", ".join(values)
+        marks = ", ".join("?" for _ in values)
+        sets = ", ".join(f"{c} = excluded.{c}" for c in values if c != "article")
+        conn.execute(
+            f"INSERT INTO product({cols}) VALUES ({marks}) ON CONFLICT(article) DO UPDATE SET {sets}",
+            list(values.values()),
+        )
+    elif ch.tbl == "order":
+        conn.execute(
+            """
+            INSERT INTO "order"(id, order_date, delivery_date, pickup_point_id, client_name, pickup_code, status_id, client_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                order_date = excluded.order_date, delivery_date = excluded.delivery_date,
+                pickup_point_id = excluded.pickup_point_id, client_name = excluded.client_name,
+                pickup_code = excluded.pickup_code, status_id = excluded.status_id, client_id = excluded.client_id
+            """,
+            # Like statuses, clients travel by name; ids are local to each database.
+            (row["id"], row["order_date"], row["delivery_date"], row["pickup_point_id"], row["client_name"],
+             row["pickup_code"], order_status_id(conn, row["status"], create=True), client_id(conn, row["client_name"])),
+        )
+    elif ch.tbl == "order_product":
+        order_id = row["order_id"]
+        lines = row["lines"]
+        if not conn.execute('SELECT 1 FROM "order" WHERE id = ?', (order_id,)).fetchone():
+            lines = []  # the order itself is gone; its delete arrives in the same batch or already has
+        set_order_lines(conn, order_id, lines)
+
+
+def _delete(conn: sqlite3.Connection, ch: Change, conflicts: list[str]) -> None:
+    if ch.tbl == "order":
+        conn.execute('DELETE FROM "order" WHERE id = ?', (int(ch.pk),))
+    elif ch.tbl == "product":
+        if conn.execute("SELECT 1 FROM order_product WHERE product_article = ? LIMIT 1", (ch.pk,)).fetchone():
+            conflicts.append(f"товар {ch.pk} не удалён: есть в заказах получателя")
+            return
+        conn.execute("DELETE FROM product WHERE article = ?", (ch.pk,))
+    elif ch.tbl == "pickup_point":
+        if conn.execute('SELECT 1 FROM "order" WHERE pickup_point_id = ? LIMIT 1', (int(ch.pk),)).fetchone():
+            conflicts.append(f"пункт выдачи {ch.pk} не удалён: есть в заказах получателя")
+            return
+        conn.execute("DELETE FROM pickup_point WHERE id = ?", (int(ch.pk),))
+
+
+def apply_changes(conn: sqlite3.Connection, source_node: str, changes: list[Change], last_seq: int) -> list[str]:
+    """Apply one batch in one transaction and record ``last_seq`` as applied from ``source_node``.
+
+    Re-applying a batch (e.g. after a crash before the source saw the ack) is harmless.
+    Returns conflict messages for deletes that were skipped.
+    """
+    conflicts: list[str] = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("PRAGMA defer_foreign_keys = ON")
+        conn.execute("UPDATE cdc_state SET applying = 1 WHERE id = 1")
+        by_table = {t: [c for c in changes if c.tbl == t] for t in _APPLY_ORDER}
+        dims = DimensionCache()
+        for tbl in _APPLY_ORDER:
+            for ch in by_table[tbl]:
+                if ch.row is not None:
+                    _upsert(conn, ch, dims)
+        for tbl in reversed(_APPLY_ORDER):
+            for ch in by_table[tbl]:
+                if ch.row is None:
+                    _delete(conn, ch, conflicts)
+        conn.execute("UPDATE cdc_state SET applying = 0 WHERE id = 1")
+        _set_peer_seq(conn, source_node, "applied_seq", last_seq)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return conflicts
+
+
+def prune_change_log(conn: sqlite3.Connection) -> int:
+    """Drop log entries every registered peer has acknowledged.
+
+    An acked_seq of 0 cannot tell a peer we only receive from from a clone
+    made while our log was empty and not synced since, so any peer still at 0
+    holds the whole log back: losing changes is worse than keeping them.
+    """
+    row = conn.execute("SELECT min(acked_seq) FROM replication_peer").fetchone()
+    if not row[0]:
+        return 0
+    with conn:
+        return conn.execute("DELETE FROM change_log WHERE seq <= ?", (row[0],)).rowcount
+
+
+def sync(source: Path, target: Path, batch_size: int = DEFAULT_BATCH) -> SyncStats:
+    """Ship every change of ``source`` that ``target`` has not applied yet.
+
+    Resumes from the seq recorded in the target, so an interrupted run simply
+    continues next time. Order ids are replicated as-is, so branches that
+    exchange orders must use disjoint order number ranges.
+    """
+    stats = SyncStats()
+    src = get_conn(source)
+    dst = get_conn(target)
+    src.isolation_level = None
+    dst.isolation_level = None
+    try:
+        src_node = node_id(src)
+        dst_node = node_id(dst)
+        if src_node == dst_node:
+            raise ValueError("У баз одинаковый node_id: копия создана не через replicate-clone.")
+
+        seq = _peer_seq(dst, src_node, "applied_seq")
+        while True:
+            changes, last, read = read_changes(src, seq, batch_size)
+            if not read:
+                break
+            stats.conflicts += apply_changes(dst, src_node, changes, last)
+            _set_peer_seq(src, dst_node, "acked_seq", last)
+            stats.batches += 1
+            stats.changes += read
+            stats.applied += len(changes)
+            seq = last
+        stats.last_seq = seq
+        prune_change_log(src)
+    finally:
+        src.close()
+        dst.close()
+    return stats
+
+
+def clone(source: Path, target: Path) -> str:
+    """Create a new branch database from ``source``; returns the new node id.
+
+    The copy gets its own node id and starts replicating from the source's
+    current position; the source keeps its log from that position for it.
+    """
+    if target.exists():
+        raise FileExistsError(target)
+    src = get_conn(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.execute("BEGIN")
+        last = src.execute("SELECT coalesce(max(seq), 0) FROM change_log").fetchone()[0]
+        src_node = node_id(src)
+        src.backup(dst)
+        src.rollback()
+    finally:
+        dst.close()
+        src.close()
+
+    dst = get_conn(target)
+    try:
+        with dst:
+            dst.execute("UPDATE cdc_state SET node_id = lower(hex(randomblob(16))) WHERE id = 1")
+            dst.execute("DELETE FROM replication_peer")
+            dst.execute("DELETE FROM change_log")
+            _set_peer_seq(dst, src_node, "applied_seq", last)
+        new_node = node_id(dst)
+    finally:
+        dst.close()
+
+    src = get_conn(source)
+    try:
+        with src:
+            _set_peer_seq(src, new_node, "acked_seq", last)
+    finally:
+        src.close()
+    return new_node
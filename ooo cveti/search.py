@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import re
+import sqlite3
+from typing import Any, Iterable
+
+
+# Trigram similarity (shared / union, as in pg_trgm) a catalog word needs to
+# count as a match for a query word: "ромашька" ~ "ромашка" is 0.55.
+MIN_SIMILARITY = 0.3
+# Queries shorter than this (after folding) use plain substring search.
+MIN_QUERY_LEN = 3
+
+_REFRESH_CHUNK = 500
+
+# Latin letters that look like Cyrillic ones, so "рoза" typed with a Latin "o"
+# still finds "роза". Applied to both the index and the query, so Latin words
+# stay searchable too.
+_FOLD = str.maketrans({
+    "a": "а", "b": "в", "c": "с", "e": "е", "h": "н", "k": "к", "m": "м",
+    "o": "о", "p": "р", "t": "т", "x": "х", "y": "у", "ё": "е",
+})
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def fold_text(text: Any) -> str:
+    """Lower-case, ё -> е and Latin homoglyphs -> Cyrillic."""
+    return str(text or "").lower().translate(_FOLD)
+
+
+def words(text: Any) -> set[str]:
+    return set(_WORD_RE.findall(fold_text(text)))
+
+
+def _is_code(word: str) -> bool:
+    # Words with digits (articles, sizes, "Пост7") are codes: their near misses
+    # are other codes, not typos, so they are only matched exactly and get no trigrams.
+    return any(ch.isdigit() for ch in word)
+
+
+def trigrams(word: str) -> set[str]:
+    """Trigrams of a folded word, padded like pg_trgm: "  w", " wo", ..., "d "."""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _word_ids(conn: sqlite3.Connection, vocabulary: set[str]) -> dict[str, int]:
+    """Ids of ``vocabulary`` in search_word, adding the words that are new."""
+    ids: dict[str, int] = {}
+    batch = sorted(vocabulary)
+    for i in range(0, len(batch), _REFRESH_CHUNK):
+        chunk = batch[i:i + _REFRESH_CHUNK]
+        marks = ", ".join("?" for _ in chunk)
+        ids.update(conn.execute(f"SELECT word, id FROM search_word WHERE word IN ({marks})", chunk).fetchall())
+    for word in batch:
+        if word not in ids:
+            grams = set() if _is_code(word) else trigrams(word)
+            ids[word] = conn.execute(
+                "INSERT INTO search_word(word, grams) VALUES (?, ?)", (word, len(grams))
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO search_word_trigram(tri, word_id) VALUES (?, ?)", [(g, ids[word]) for g in grams]
+            )
+    return ids
+
+
+def _reindex(conn: sqlite3.Connection, articles: list[str]) -> None:
+    marks = ", ".join("?" for _ in articles)
+    conn.execute(f"DELETE FROM product_word WHERE article IN ({marks})", articles)
+    rows = conn.execute(
+        f"""
+        SELECT article, name, description, category, manufacturer, supplier
+        FROM product_view WHERE article IN ({marks})
+        """,
+        articles,
+    ).fetchall()
+    per_product = {r[0]: words(" ".join(str(v or "") for v in r)) for r in rows}
+    ids = _word_ids(conn, set().union(*per_product.values()))
+    conn.executemany(
+        "INSERT INTO product_word(word_id, article) VALUES (?, ?)",
+        [(ids[w], article) for article, ws in per_product.items() for w in ws],
+    )
+    conn.execute(f"DELETE FROM product_search_dirty WHERE article IN ({marks})", articles)
+
+
+def refresh_index(conn: sqlite3.Connection) -> int:
+    """Re-index the products queued in product_search_dirty by the product triggers.
+
+    Only words never seen before get trigrams; everything else is a lookup.
+    Runs inside the caller's transaction if there is one. Returns the number of
+    re-indexed products.
+    """
+    articles = [r[0] for r in conn.execute("SELECT article FROM product_search_dirty")]
+    for i in range(0, len(articles), _REFRESH_CHUNK):
+        _reindex(conn, articles[i:i + _REFRESH_CHUNK])
+    return len(articles)
+
+
+def prune_vocabulary(conn: sqlite3.Connection) -> int:
+    """Drop words no product uses any more; returns how many."""
+    conn.execute(
+        """
+        DELETE FROM search_word_trigram
+        WHERE word_id IN (SELECT id FROM search_word WHERE id NOT IN (SELECT word_id FROM product_word))
+        """
+    )
+    return conn.execute("DELETE FROM search_word WHERE id NOT IN (SELECT word_id FROM product_word)").rowcount
+
+
+def uses_trigrams(search: str) -> bool:
+    return len(fold_text(search).strip()) >= MIN_QUERY_LEN and bool(words(search))
+
+
+def match_sql(schema: str, search: str, like_sql: str, like_params: Iterable[Any]) -> tuple[str, list[Any]]:
+    """SQL for (article, hits) of the products matching every word of ``search``.
+
+    Each query word is matched against the catalog vocabulary by trigram
+    similarity (codes exactly); hits is the sum of the best similarity per query word. Products
+    still waiting in product_search_dirty may have stale index rows, so they
+    are matched with ``like_sql`` (a condition on alias ``q``) instead.
+    """
+    query_words = sorted(words(search))
+    arms = []
+    params: list[Any] = []
+    values = []
+    value_params: list[Any] = []
+    for n, word in enumerate(query_words):
+        if _is_code(word):
+            arms.append(f"SELECT ? AS qn, id AS word_id, 1.0 AS sim FROM {schema}.search_word WHERE word = ?")
+            params.extend([n, word])
+            continue
+        grams = trigrams(word)
+        for g in sorted(grams):
+            values.append("(?, ?, ?)")
+            value_params.extend([n, g, len(grams)])
+    if values:
+        arms.append(f"""
+            SELECT qt.qn, t.word_id, COUNT(*) * 1.0 / (qt.grams + w.grams - COUNT(*)) AS sim
+            FROM (SELECT column1 AS qn, column2 AS tri, column3 AS grams FROM (VALUES {", ".join(values)})) qt
+            JOIN {schema}.search_word_trigram t ON t.tri = qt.tri
+            JOIN {schema}.search_word w ON w.id = t.word_id
+            GROUP BY qt.qn, t.word_id
+            HAVING sim >= ?
+        """)
+        params.extend([*value_params, MIN_SIMILARITY])
+
+    sql = f"""
+        SELECT article, SUM(best) AS hits
+        FROM (
+            SELECT c.qn, pw.article, max(c.sim) AS best
+            FROM ({" UNION ALL ".join(arms)}) c
+            JOIN {schema}.product_word pw ON pw.word_id = c.word_id
+            WHERE pw.article NOT IN (SELECT article FROM {schema}.product_search_dirty)
+            GROUP BY c.qn, pw.article
+        )
+        GROUP BY article
+        HAVING COUNT(*) = ?
+        UNION ALL
+        SELECT q.article, ?
+        FROM {schema}.product_search_dirty d
+        CROSS JOIN {schema}.product_view q ON q.article = d.article  -- CROSS: keep the (small) queue as the outer loop
+        WHERE {like_sql}
+    """
+    return sql, [*params, len(query_words), len(query_words), *like_params]
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import tkinter as tk
+from tkinter import ttk
+
+
+THREAD_WORKERS = 4
+POLL_MS = 50  # how often the UI thread drains finished tasks and progress reports
+PROGRESS_MIN_INTERVAL = 0.1  # seconds; faster progress reports from a worker are coalesced
+
+log = logging.getLogger(__name__)
+
+
+class TaskCancelled(Exception):
+    """Raised inside a worker by ``Task.check()`` once the task was cancelled."""
+
+
+class Task:
+    """Handle for a job submitted to a TaskRunner.
+
+    The worker function gets the Task as its only argument and may call
+    ``report()`` and ``check()`` on it; everything else is meant for the UI thread.
+    """
+
+    def __init__(self, runner: TaskRunner, name: str, key: Optional[str], cancellable: bool = True) -> None:
+        self.runner = runner
+        self.name = name
+        self.key = key
+        self.cancellable = cancellable  # writes are not offered for cancelling in the status bar
+        self.cancel_event = threading.Event()
+        self.future: Optional[Future] = None
+        self.progress: Any = None
+        self.started = time.monotonic()
+        self._reported = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self) -> None:
+        """Ask the task to stop. Its on_done / on_error callbacks will not be called."""
+        self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def check(self) -> None:
+        """Call from the worker between steps: raises TaskCancelled once the task was cancelled."""
+        if self.cancel_event.is_set():
+            raise TaskCancelled()
+
+    def report(self, value: Any) -> None:
+        """Call from the worker: hands a progress value to the UI thread."""
+        self.progress = value
+        now = time.monotonic()
+        if now - self._reported >= PROGRESS_MIN_INTERVAL:
+            self._reported = now
+            self.runner._post(self.runner._on_progress, self)
+
+
+class TaskRunner:
+    """Runs blocking work off the Tk thread and delivers the results back on it.
+
+    Workers never touch Tk: completions and progress reports go through a
+    queue that the UI thread drains on an ``after`` timer, and the callbacks
+    run there. Submitting with a ``key`` cancels the previous task with the
+    same key, so a page refreshed twice in a row only shows the newer result.
+    """
+
+    def __init__(self, root: tk.Misc, threads: int = THREAD_WORKERS) -> None:
+        self.root = root
+        self._threads = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="task")
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._keyed: dict[str, Task] = {}
+        self._callbacks: dict[Task, tuple[Optional[Callable], Optional[Callable], Optional[Callable]]] = {}
+        self.running: list[Task] = []
+        self.notice = ""  # the last message for the status bar, shown while nothing is running
+        self.listeners: list[Callable[[], None]] = []  # called on the UI thread whenever ``running`` changes
+        self.root.after(POLL_MS, self._drain)
+
+    def submit(
+        self,
+        name: str,
+        fn: Callable[[Task], Any],
+        on_done: Optional[Callable[[Any], None]] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+        on_progress: Optional[Callable[[Any], None]] = None,
+        key: Optional[str] = None,
+        cancellable: bool = True,
+    ) -> Task:
+        """Run ``fn(task)`` in the thread pool; ``on_done(result)`` / ``on_error(exc)`` run on the UI thread."""
+        task = self._start(name, key, on_done, on_error, on_progress, cancellable)
+        task.future = self._threads.submit(fn, task)
+        task.future.add_done_callback(lambda f: self._post(self._finish, task, f))
+        return task
+
+    def notify(self, text: str) -> None:
+        """Show ``text`` in the status bar. Safe to call from any thread."""
+        self._post(self._set_notice, text)
+
+    def cancel(self, key: str) -> None:
+        """Cancel the running task submitted with ``key``, if there is one."""
+        task = self._keyed.get(key)
+        if task is not None:
+            task.cancel()
+
+    def cancel_all(self) -> None:
+        for task in list(self.running):
+            task.cancel()
+
+    def shutdown(self) -> None:
+        self.cancel_all()
+        self._threads.shutdown(wait=False, cancel_futures=True)
+
+    def _start(self, name, key, on_done, on_error, on_progress, cancellable) -> Task:
+        if key is not None and key in self._keyed:
+            self._keyed[key].cancel()
+        task = Task(self, name, key, cancellable)
+        if key is not None:
+            self._keyed[key] = task
+        self._callbacks[task] = (on_done, on_error, on_progress)
+        self.running.append(task)
+        self._changed()
+        return task
+
+    def _post(self, fn: Callable, *args: Any) -> None:
+        # The only thing workers do with the runner: everything queued runs on the UI thread.
+        self._queue.put((fn, args))
+
+    def _drain(self) -> None:
+        try:
+            while True:
+                fn, args = self._queue.get_nowait()
+                try:
+                    fn(*args)
+                except Exception as e:  # a broken callback must not stop the timer
+                    log.exception("background task callback failed")
+                    self._set_notice(f"Ошибка в обработчике фоновой задачи: {e}")
+        except queue.Empty:
+            pass
+        self.root.after(POLL_MS, self._drain)
+
+    def _on_progress(self, task: Task) -> None:
+        if task in self._callbacks and not task.cancelled:
+            on_progress = self._callbacks[task][2]
+            if on_progress:
+                on_progress(task.progress)
+            self._changed()
+
+    def _finish(self, task: Task, future: Future) -> None:
+        on_done, on_error, _ = self._callbacks.pop(task, (None, None, None))
+        self.running.remove(task)
+        if task.key is not None and self._keyed.get(task.key) is task:
+            del self._keyed[task.key]
+        self._changed()
+        if task.cancelled or future.cancelled():
+            return
+        err = future.exception()
+        if err is None:
+            if on_done:
+                on_done(future.result())
+        elif isinstance(err, TaskCancelled):
+            pass
+        elif on_error:
+            on_error(err)
+        else:
+            log.error("background task %r failed", task.name, exc_info=err)
+            self._set_notice(f"Фоновая задача «{task.name}» завершилась с ошибкой: {err}")
+
+    def _set_notice(self, text: str) -> None:
+        self.notice = text
+        self._changed()
+
+    def _changed(self) -> None:
+        for listener in self.listeners:
+            listener()
+
+
+class TaskStatusBar(ttk.Frame):
+    """Bottom bar: what is running in the background, its progress, and a button to cancel it.
+
+    While nothing runs it shows the runner's last notice, e.g. a failed task nobody handled.
+    """
+
+    def __init__(self, parent: tk.Misc, runner: TaskRunner) -> None:
+        super().__init__(parent)
+        self.runner = runner
+        self.lbl = ttk.Label(self, text="")
+        self.lbl.pack(side="left", padx=10, pady=2)
+        self.btn_cancel = ttk.Button(self, text="Отменить", command=self.cancel)
+        runner.listeners.append(self.update_status)
+
+    def _cancellable(self) -> Optional[Task]:
+        for task in reversed(self.runner.running):
+            if task.cancellable and not task.cancelled:
+                return task
+        return None
+
+    def update_status(self) -> None:
+        tasks = self.runner.running
+        if not tasks:
+            self.lbl.config(text=self.runner.notice)
+            self.btn_cancel.pack_forget()
+            return
+        current = tasks[-1]
+        text = current.name if current.progress is None else f"{current.name}: {current.progress}"
+        if len(tasks) > 1:
+            text += f" (ещё задач: {len(tasks) - 1})"
+        self.lbl.config(text=text + "...")
+        if self._cancellable() is None:
+            self.btn_cancel.pack_forget()
+        elif not self.btn_cancel.winfo_ismapped():
+            self.btn_cancel.pack(side="right", padx=10, pady=2)
+
+    def cancel(self) -> None:
+        task = self._cancellable()
+        if task is not None:
+            task.cancel()
+            self.update_status()
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+APP_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(APP_DIR))  # the app's modules are flat files next to main.py
+
+import db  # noqa: E402
+
+
+BASELINE_DB = APP_DIR / "trade.db"  # the bundled database, at user_version 0
+
+
+@pytest.fixture
+def baseline(tmp_path: Path) -> Path:
+    """A copy of the bundled trade.db, not migrated."""
+    path = tmp_path / "baseline.db"
+    shutil.copyfile(BASELINE_DB, path)
+    return path
+
+
+@pytest.fixture
+def source(baseline: Path) -> Path:
+    """A migrated copy of the bundled trade.db."""
+    db.migrate(baseline)
+    return baseline
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+import db
+
+TABLES = ("role", "user", "product", "pickup_point", "order", "order_product")
+
+
+def _counts(path: Path) -> dict[str, int]:
+    with closing(sqlite3.connect(path)) as conn:
+        return {t: conn.execute(f'SELECT count(*) FROM "{t}"').fetchone()[0] for t in TABLES}
+
+
+def _version(path: Path) -> int:
+    with closing(sqlite3.connect(path)) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def test_baseline_migrates_to_latest_without_losing_rows(baseline: Path) -> None:
+    before = _counts(baseline)
+    assert _version(baseline) == 0
+
+    db.migrate(baseline)
+
+    assert _version(baseline) == len(db._MIGRATIONS)
+    assert _counts(baseline) == before
+    with closing(db.get_conn(baseline)) as conn:
+        assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        # Every order kept a status and its lines (the rebuilds must not drop or orphan rows).
+        assert conn.execute('SELECT count(*) FROM "order" WHERE status_id IS NULL').fetchone()[0] == 0
+
+
+def test_migrate_twice_is_a_no_op(source: Path) -> None:
+    before = _counts(source)
+    db.migrate(source)
+    assert _version(source) == len(db._MIGRATIONS)
+    assert _counts(source) == before
+
+
+def test_blank_status_orders_survive_the_status_migration(baseline: Path) -> None:
+    with closing(sqlite3.connect(baseline)) as conn, conn:
+        conn.execute("""UPDATE "order" SET status = '  ' WHERE id = (SELECT min(id) FROM "order")""")
+    before = _counts(baseline)
+
+    db.migrate(baseline)
+
+    assert _counts(baseline) == before
+    with closing(db.get_conn(baseline)) as conn:
+        status = conn.execute(
+            'SELECT s.name FROM "order" o JOIN order_status s ON s.id = o.status_id ORDER BY o.id LIMIT 1'
+        ).fetchone()[0]
+    assert status == "Новый"
+
+
+def test_status_repair_fixes_databases_migrated_before_it(source: Path) -> None:
+    with closing(sqlite3.connect(source)) as conn, conn:  # foreign keys off, as an older build may have left it
+        conn.execute("INSERT INTO order_status(name) VALUES ('')")
+        conn.execute('UPDATE "order" SET status_id = (SELECT id FROM order_status WHERE name = \'\') WHERE id = 1')
+        conn.execute('UPDATE "order" SET status_id = 99 WHERE id = 2')
+        conn.execute(f"PRAGMA user_version = {len(db._MIGRATIONS) - 1}")
+
+    db.migrate(source)
+
+    with closing(db.get_conn(source)) as conn:
+        statuses = [r[0] for r in conn.execute(
+            'SELECT s.name FROM "order" o LEFT JOIN order_status s ON s.id = o.status_id WHERE o.id IN (1, 2)'
+        )]
+        assert statuses == ["Новый", "Новый"]
+        assert conn.execute("SELECT count(*) FROM order_status WHERE trim(name) = ''").fetchone()[0] == 0
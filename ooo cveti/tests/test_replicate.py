@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+import pytest
+
+import db
+import replicate
+
+
+@pytest.fixture
+def branch(source: Path, tmp_path: Path) -> Path:
+    target = tmp_path / "branch.db"
+    replicate.clone(source, target)
+    return target
+
+
+def _conn(path: Path) -> sqlite3.Connection:
+    conn = db.get_conn(path)
+    conn.isolation_level = None  # read_changes and apply_changes issue their own BEGIN
+    return conn
+
+
+def _copy_product(conn: sqlite3.Connection, article: str, like: str = "G643F5") -> None:
+    cols = "name, unit_id, cost, max_discount, manufacturer_id, supplier_id, category_id, discount, quantity, description"
+    conn.execute(f"INSERT INTO product(article, {cols}) SELECT ?, {cols} FROM product WHERE article = ?", (article, like))
+
+
+def _save_order(conn: sqlite3.Connection, order_id: int, pickup: int, items: list[tuple[str, int]]) -> None:
+    err = db.save_order(conn, order_id, False, "Новый", "2026-01-10", "2026-01-15", pickup, None, 900, items)
+    assert err is None
+
+
+def _scalar(path: Path, sql: str, params: tuple = ()) -> object:
+    with closing(db.get_conn(path)) as conn:
+        row = conn.execute(sql, params).fetchone()
+    return row[0] if row else None
+
+
+def _set_quantity(path: Path, article: str, quantity: int) -> None:
+    with closing(db.get_conn(path)) as conn, conn:
+        conn.execute("UPDATE product SET quantity = ? WHERE article = ?", (quantity, article))
+
+
+def test_clone_refuses_existing_target(source: Path, branch: Path) -> None:
+    with pytest.raises(FileExistsError):
+        replicate.clone(source, branch)
+
+
+def test_sync_ships_updates(source: Path, branch: Path) -> None:
+    _set_quantity(source, "G643F5", 77)
+
+    stats = replicate.sync(source, branch)
+
+    assert stats.applied == 1 and stats.conflicts == []
+    assert _scalar(branch, "SELECT quantity FROM product WHERE article = 'G643F5'") == 77
+    # Applying does not log the change again at the target, so nothing comes back.
+    assert replicate.sync(branch, source).changes == 0
+
+
+def test_reapplying_a_batch_is_harmless(source: Path, branch: Path) -> None:
+    _set_quantity(source, "A357H6", 5)
+    with closing(_conn(source)) as src, closing(_conn(branch)) as dst:
+        changes, last, _ = replicate.read_changes(src, 0, 100)
+        node = replicate.node_id(src)
+        replicate.apply_changes(dst, node, changes, last)
+        before = dst.execute("SELECT count(*) FROM product").fetchone()[0]
+        # As after a crash between the apply and the ack.
+        assert replicate.apply_changes(dst, node, changes, last) == []
+        assert dst.execute("SELECT count(*) FROM product").fetchone()[0] == before
+        assert dst.execute("SELECT quantity FROM product WHERE article = 'A357H6'").fetchone()[0] == 5
+        assert dst.execute("SELECT count(*) FROM change_log").fetchone()[0] == 0
+
+
+def test_sync_resumes_from_applied_seq(source: Path, branch: Path) -> None:
+    _set_quantity(source, "G643F5", 1)
+    _set_quantity(source, "A357H6", 2)
+    _set_quantity(source, "F256G6", 3)
+    with closing(_conn(source)) as src, closing(_conn(branch)) as dst:
+        after = replicate._peer_seq(dst, replicate.node_id(src), "applied_seq")
+        changes, last, read = replicate.read_changes(src, after, 1)
+        assert read == 1
+        replicate.apply_changes(dst, replicate.node_id(src), changes, last)
+
+    stats = replicate.sync(source, branch, batch_size=1)
+
+    assert stats.changes == 2 and stats.batches == 2
+    quantities = [_scalar(branch, "SELECT quantity FROM product WHERE article = ?", (a,))
+                  for a in ("G643F5", "A357H6", "F256G6")]
+    assert quantities == [1, 2, 3]
+
+
+def test_parents_are_applied_before_children_and_deleted_after(source: Path, branch: Path) -> None:
+    with closing(db.get_conn(source)) as conn, conn:
+        conn.execute("INSERT INTO pickup_point(id, address) VALUES (900, 'Тестовый пункт')")
+        _copy_product(conn, "T900")
+        _save_order(conn, 9000, 900, [("T900", 2), ("G643F5", 1)])
+
+    # All four rows arrive in one batch, in whatever order they were logged.
+    stats = replicate.sync(source, branch)
+
+    assert stats.batches == 1 and stats.conflicts == []
+    assert _scalar(branch, 'SELECT pickup_point_id FROM "order" WHERE id = 9000') == 900
+    assert _scalar(branch, "SELECT quantity FROM order_product WHERE order_id = 9000 AND product_article = 'T900'") == 2
+
+    with closing(db.get_conn(source)) as conn, conn:
+        conn.execute('DELETE FROM "order" WHERE id = 9000')
+        conn.execute("DELETE FROM product WHERE article = 'T900'")
+        conn.execute("DELETE FROM pickup_point WHERE id = 900")
+
+    stats = replicate.sync(source, branch)
+
+    assert stats.conflicts == []
+    assert _scalar(branch, 'SELECT count(*) FROM "order" WHERE id = 9000') == 0
+    assert _scalar(branch, "SELECT count(*) FROM order_product WHERE order_id = 9000") == 0
+    assert _scalar(branch, "SELECT count(*) FROM product WHERE article = 'T900'") == 0
+    assert _scalar(branch, "SELECT count(*) FROM pickup_point WHERE id = 900") == 0
+    with closing(db.get_conn(branch)) as conn:
+        assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+
+
+def test_deletes_still_in_use_at_the_target_are_reported(source: Path, branch: Path) -> None:
+    with closing(db.get_conn(source)) as conn, conn:
+        conn.execute("INSERT INTO pickup_point(id, address) VALUES (901, 'Тестовый пункт')")
+        _copy_product(conn, "T901")
+    replicate.sync(source, branch)
+    # Only the branch takes an order for them.
+    with closing(db.get_conn(branch)) as conn, conn:
+        _save_order(conn, 9100, 901, [("T901", 1)])
+    with closing(db.get_conn(source)) as conn, conn:
+        conn.execute("DELETE FROM product WHERE article = 'T901'")
+        conn.execute("DELETE FROM pickup_point WHERE id = 901")
+
+    stats = replicate.sync(source, branch)
+
+    assert sorted(stats.conflicts) == [
+        "пункт выдачи 901 не удалён: есть в заказах получателя",
+        "товар T901 не удалён: есть в заказах получателя",
+    ]
+    assert _scalar(branch, "SELECT count(*) FROM product WHERE article = 'T901'") == 1
+    assert _scalar(branch, "SELECT count(*) FROM pickup_point WHERE id = 901") == 1
+
+
+def test_prune_waits_for_a_clone_that_has_not_synced(source: Path, tmp_path: Path) -> None:
+    with closing(db.get_conn(source)) as conn, conn:
+        conn.execute("DELETE FROM change_log")
+    b = tmp_path / "b.db"
+    c = tmp_path / "c.db"
+    replicate.clone(source, b)
+    replicate.clone(source, c)
+    _set_quantity(source, "G643F5", 42)
+
+    replicate.sync(source, b)
+    assert _scalar(source, "SELECT count(*) FROM change_log") > 0  # c has not acknowledged anything yet
+    stats = replicate.sync(source, c)
+
+    assert stats.applied == 1
+    assert _scalar(c, "SELECT quantity FROM product WHERE article = 'G643F5'") == 42
+    assert _scalar(source, "SELECT count(*) FROM change_log") == 0  # both peers have it now